@@ -6,6 +6,13 @@ set -e
 # Set default path for Daphne if not specified
 DAPHNE_EXECUTABLE_PATH=${DAPHNE_EXECUTABLE_PATH:-"~/.vision_mon_site/bin/"}
 
+# Frames in the frame store are sent by nginx (see the /protected-frames/ location in nginx.default)
+export FRAME_STORE_ACCEL_PREFIX=${FRAME_STORE_ACCEL_PREFIX:-"/protected-frames/"}
+
+# Clients besides staff users that may read /metrics/db/ (comma-separated addresses).
+# The default, this host only, lets `manage.py dbstats` read it through nginx.
+export DB_METRICS_ALLOWED_IPS=${DB_METRICS_ALLOWED_IPS:-"127.0.0.1,::1"}
+
 # Apply database migrations
 echo "Applying database migrations..."
 python manage.py migrate --noinput
@@ -1,9 +1,10 @@
 
 import time
 from collections import deque
+from .config import FLAP_THRESHOLD, FLAP_INTERVAL
 
 class AlertState:
-    def __init__(self, name, flap_threshold=3, flap_interval=600):
+    def __init__(self, name, flap_threshold=FLAP_THRESHOLD, flap_interval=FLAP_INTERVAL):
         self.name = name
         self.is_alerting = False
         self.last_change = time.time()
@@ -12,8 +13,9 @@ class AlertState:
         self.flap_interval = flap_interval
         self.is_flapping = False
 
-    def update(self, new_state):
-        current_time = time.time()
+    def update(self, new_state, now=None):
+        # `now` replays a stored update at its own time (monitor/replay.py)
+        current_time = time.time() if now is None else now
         if new_state != self.is_alerting:
             self.state_changes.append(current_time)
             self.is_alerting = new_state
@@ -40,11 +42,11 @@ class AlertManager:
     def __init__(self):
         self.states = {}
 
-    def update_state(self, name, is_alerting):
+    def update_state(self, name, is_alerting, now=None):
         if name not in self.states:
             self.states[name] = AlertState(name)
 
-        return self.states[name].update(is_alerting)
+        return self.states[name].update(is_alerting, now)
 
 # Example usage
 if __name__ == "__main__":
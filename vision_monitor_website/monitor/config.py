@@ -6,10 +6,88 @@ DB_NAME = os.getenv('DB_NAME', 'visionmon')
 DB_USER = os.getenv('DB_USER', 'pguser')
 DB_PASSWORD = os.getenv('DB_PASSWORD', 'pgpass')
 
+# Connection pool configuration (per process)
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))  # seconds to wait for a free connection
+DB_POOL_HEALTHCHECK_INTERVAL = float(os.getenv('DB_POOL_HEALTHCHECK_INTERVAL', 30))  # ping connections idle longer than this
+DB_POOL_MAX_IDLE = float(os.getenv('DB_POOL_MAX_IDLE', 300))  # close idle connections above min size after this
+
+# Decoded state_result cache used when formatting timeline rows (entries per process)
+STATE_CACHE_SIZE = int(os.getenv('STATE_CACHE_SIZE', 2048))
+# State strings whose phrase classification is memoized (monitor/phrase_matching.py)
+STATE_PHRASE_CACHE_SIZE = int(os.getenv('STATE_PHRASE_CACHE_SIZE', 4096))
+
+# Rows fetched per round trip by the server-side cursor behind the timeline export
+EXPORT_FETCH_SIZE = int(os.getenv('EXPORT_FETCH_SIZE', 2000))
+
+# Retention for the partitioned visionmon_metadata, visionmon_binary_data and state_result tables
+RETENTION_DAYS = int(os.getenv('RETENTION_DAYS', 30))
+PARTITION_PREMAKE_DAYS = int(os.getenv('PARTITION_PREMAKE_DAYS', 7))  # future daily partitions kept ready
+# visionmon_binary_data is partitioned by id instead, so frames looked up by id hit one partition
+BINARY_PARTITION_IDS = int(os.getenv('BINARY_PARTITION_IDS', 1_000_000))  # ids per partition; about a day of frames or more
+BINARY_PARTITIONS_AHEAD = int(os.getenv('BINARY_PARTITIONS_AHEAD', 2))  # empty id partitions kept ready past the newest frame
+PARTITION_RETENTION_MODE = os.getenv('PARTITION_RETENTION_MODE', 'drop')  # 'drop' or 'detach' (keep the table for archiving)
+# Row-by-row retention for data outside daily partitions, in small checkpointed batches
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', 1000))  # rows per transaction
+RETENTION_BATCH_SLEEP = float(os.getenv('RETENTION_BATCH_SLEEP', 0.5))  # seconds between batches, to let ingest through
+RETENTION_LOCK_TIMEOUT = os.getenv('RETENTION_LOCK_TIMEOUT', '2s')  # give up on a batch rather than queue behind locks
+RETENTION_MAX_RUNTIME = float(os.getenv('RETENTION_MAX_RUNTIME', 1800))  # seconds per run; the next run resumes
+
+# Query instrumentation (monitor/instrumentation.py)
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 500))  # queries slower than this go to the monitor.slow_queries log
+SLOW_QUERY_LOG_SIZE = int(os.getenv('SLOW_QUERY_LOG_SIZE', 100))  # recent slow queries kept for /metrics/db/
+SLOW_QUERY_LOG_PARAMS = os.getenv('SLOW_QUERY_LOG_PARAMS', 'false').lower() == 'true'  # log bound values; otherwise only their types
+# Besides staff users, the client addresses (comma-separated) that may read /metrics/db/: by
+# default only this host, for `manage.py dbstats`; add e.g. the Prometheus scraper's address.
+DB_METRICS_ALLOWED_IPS = tuple(ip.strip() for ip in os.getenv('DB_METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip.strip())
+
 # Redis configuration
 REDIS_HOST = os.getenv('REDIS_HOST', '192.168.0.71')
 REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
 ALERT_QUEUE = os.getenv('ALERT_QUEUE', 'alert_queue')
+# State windows, alert states and state snapshot behind ingest_state_message() (monitor/state_store.py)
+STATE_STORE = os.getenv('STATE_STORE', 'redis')  # 'redis' shares them between processes and restarts; 'local' keeps them per process
+STATE_STORE_TTL = int(os.getenv('STATE_STORE_TTL', 86400))  # seconds a window or alert state lives without updates
+# Smoothing and alerting (see `manage.py tune_alerts` for the effect of other values)
+STATE_WINDOW_MINUTES = float(os.getenv('STATE_WINDOW_MINUTES', 15))  # most frequent state over this many minutes, at most one state per second
+FLAP_THRESHOLD = int(os.getenv('FLAP_THRESHOLD', 3))  # an alert changing state this many times...
+FLAP_INTERVAL = float(os.getenv('FLAP_INTERVAL', 600))  # ...within this many seconds is flapping
+# Latest frame per camera, shared through Redis (monitor/frame_cache.py)
+LATEST_FRAME_CACHE_SIZE = int(os.getenv('LATEST_FRAME_CACHE_SIZE', 32))  # frames also kept in each process
+LATEST_FRAME_TTL = int(os.getenv('LATEST_FRAME_TTL', 3600))  # seconds a camera's entry lives without a new frame
+FRAME_IMAGE_MAX_AGE = int(os.getenv('FRAME_IMAGE_MAX_AGE', 30 * 86400))  # browser/nginx cache lifetime of /get_frame_image/ responses
+
+# Resized frame variants (?w=&q= on the image endpoints, monitor/thumbnails.py)
+THUMBNAIL_WIDTHS = tuple(int(w) for w in os.getenv('THUMBNAIL_WIDTHS', '120,240,480,960').split(','))  # requested widths round up to these
+THUMBNAIL_DEFAULT_QUALITY = int(os.getenv('THUMBNAIL_DEFAULT_QUALITY', 70))
+THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', 2))  # resize threads per process
+THUMBNAIL_CACHE_DIR = os.getenv('THUMBNAIL_CACHE_DIR', '/tmp/visionmon-thumbnails')  # shared by all processes
+THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv('THUMBNAIL_CACHE_MAX_BYTES', 512 * 1024 * 1024))  # least recently used variants are evicted beyond this
+IMAGE_NEGOTIATED_FORMATS = tuple(f.strip() for f in os.getenv('IMAGE_NEGOTIATED_FORMATS', 'avif,webp').split(',') if f.strip())  # served to clients whose Accept header names them, in this order of preference
+IMAGE_TRANSCODE_QUALITY = int(os.getenv('IMAGE_TRANSCODE_QUALITY', 80))  # quality of full-size WebP/AVIF frames
+AVIF_ENCODE_SPEED = int(os.getenv('AVIF_ENCODE_SPEED', 8))  # 0 (smallest, slowest) to 10 (fastest)
+
+# Content-addressed frame files (monitor/frame_store.py); visionmon_binary_data keeps their hash
+FRAME_STORE_BACKEND = os.getenv('FRAME_STORE_BACKEND', 'monitor.frame_store.LocalFrameStore')  # dotted path of a FrameStore
+FRAME_STORE_DIR = os.getenv('FRAME_STORE_DIR', '/opt/app/frames')  # LocalFrameStore root, also served by nginx
+FRAME_STORE_ACCEL_PREFIX = os.getenv('FRAME_STORE_ACCEL_PREFIX', '')  # internal nginx location for X-Accel-Redirect; empty serves frames from Django
+FRAME_MIGRATION_BATCH_SIZE = int(os.getenv('FRAME_MIGRATION_BATCH_SIZE', 200))  # frames moved out of Postgres per transaction
+FRAME_MIGRATION_SLEEP = float(os.getenv('FRAME_MIGRATION_SLEEP', 0.2))  # seconds between batches
+FRAME_MIGRATION_MAX_RUNTIME = float(os.getenv('FRAME_MIGRATION_MAX_RUNTIME', 300))  # seconds per run; the next run continues
+FRAME_MIGRATION_INTERVAL = int(os.getenv('FRAME_MIGRATION_INTERVAL', 600))  # scheduler moves newly ingested frames this often; 0 disables
+FRAME_DEDUP_THRESHOLD = int(os.getenv('FRAME_DEDUP_THRESHOLD', 4))  # a frame within this many dHash bits (of 64) of its camera's previous frame shares its image; -1 disables
+FRAME_ARCHIVE_DIR = os.getenv('FRAME_ARCHIVE_DIR', os.path.join(FRAME_STORE_DIR, 'archive'))  # cold tier: one zip of recompressed frames per day
+FRAME_COLD_AFTER_DAYS = int(os.getenv('FRAME_COLD_AFTER_DAYS', 7))  # days a frame stays in the frame store before it is archived; 0 disables
+FRAME_COLD_QUALITY = int(os.getenv('FRAME_COLD_QUALITY', 60))  # JPEG quality of archived frames
+FRAME_COLD_MAX_WIDTH = int(os.getenv('FRAME_COLD_MAX_WIDTH', 1280))  # archived frames are scaled down to at most this width
+
+# Grid of every camera's latest frame (/mosaic/, monitor/mosaic.py)
+MOSAIC_COLUMNS = int(os.getenv('MOSAIC_COLUMNS', 4))
+MOSAIC_TILE_WIDTH = int(os.getenv('MOSAIC_TILE_WIDTH', 480))  # pixels; tiles are 16:9
+MOSAIC_QUALITY = int(os.getenv('MOSAIC_QUALITY', 80))
+MOSAIC_TTL = int(os.getenv('MOSAIC_TTL', 3600))  # seconds a composed mosaic is kept in Redis
+DAILY_SUMMARY_MOSAIC = os.getenv('DAILY_SUMMARY_MOSAIC', 'true').lower() == 'true'  # attach the mosaic to the daily summary
 
 DAILY_SUMMARY = os.getenv('DAILY_SUMMARY', 'true')
 if DAILY_SUMMARY.lower() == 'true':
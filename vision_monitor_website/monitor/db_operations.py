@@ -1,33 +1,25 @@
 import psycopg2
+import psycopg2.errors
 import logging
-import asyncpg
-from django.conf import settings
 from psycopg2.extras import DictCursor
 from django.utils import timezone
+from datetime import datetime
+import base64
+import binascii
 import json
 
-logger = logging.getLogger(__name__)
+from .db_pool import db_connection, async_db_connection
+from .caching import LRUCache
+from .instrumentation import instrumented
+from .frame_store import resolve_frame
+from .config import STATE_CACHE_SIZE, EXPORT_FETCH_SIZE
 
-def get_db_connection():
-    try:
-        return psycopg2.connect(
-            host=settings.DATABASES['default']['HOST'],
-            database=settings.DATABASES['default']['NAME'],
-            user=settings.DATABASES['default']['USER'],
-            password=settings.DATABASES['default']['PASSWORD'],
-            port=settings.DATABASES['default']['PORT'],
-        )
-    except psycopg2.Error as e:
-        logger.error(f"Unable to connect to the database: {e}")
-        return None
+logger = logging.getLogger(__name__)
 
+@instrumented()
 def fetch_latest_facility_state():
-    conn = get_db_connection()
-    if not conn:
-        logger.error("Database connection failed")
-        return None
     try:
-        with conn.cursor() as cursor:
+        with db_connection() as conn, conn.cursor() as cursor:
             cursor.execute("""
                 SELECT raw_message, timestamp
                 FROM state_result
@@ -38,36 +30,77 @@ def fetch_latest_facility_state():
     except psycopg2.Error as e:
         logger.error(f"Database error when fetching facility status: {e}")
         return None
-    finally:
-        conn.close()
 
+# Latest metadata row per camera, scanned from the full history. Only used to
+# (re)build camera_latest and as a fallback while that table does not exist yet.
+LATEST_FRAME_ANALYSES_SCAN = """
+    SELECT DISTINCT ON (camera_id)
+        camera_id, camera_index, timestamp, description, camera_name
+    FROM visionmon_metadata
+    WHERE camera_id IS NOT NULL
+    ORDER BY camera_id, timestamp DESC NULLS LAST, id DESC
+"""
+
+# Rebuilds camera_latest from visionmon_metadata. The triggers installed by
+# migration 0003 keep it current on insert/delete; this repairs any drift
+# (e.g. after bulk loads with triggers disabled or partitions being dropped).
+REFRESH_CAMERA_LATEST = """
+WITH latest AS (
+    SELECT DISTINCT ON (camera_id)
+        camera_id, id, camera_index, camera_name, timestamp, description, data_id
+    FROM visionmon_metadata
+    WHERE camera_id IS NOT NULL
+    ORDER BY camera_id, timestamp DESC NULLS LAST, id DESC
+),
+removed AS (
+    DELETE FROM camera_latest cl
+    WHERE NOT EXISTS (SELECT 1 FROM latest l WHERE l.camera_id = cl.camera_id)
+    RETURNING cl.camera_id
+),
+upserted AS (
+    INSERT INTO camera_latest AS cl
+        (camera_id, metadata_id, camera_index, camera_name, timestamp, description, data_id, updated_at)
+    SELECT camera_id, id, camera_index, camera_name, timestamp, description, data_id, now()
+    FROM latest
+    ON CONFLICT (camera_id) DO UPDATE SET
+        metadata_id = EXCLUDED.metadata_id,
+        camera_index = EXCLUDED.camera_index,
+        camera_name = EXCLUDED.camera_name,
+        timestamp = EXCLUDED.timestamp,
+        description = EXCLUDED.description,
+        data_id = EXCLUDED.data_id,
+        updated_at = EXCLUDED.updated_at
+    WHERE (cl.metadata_id, cl.camera_index, cl.camera_name, cl.timestamp, cl.description, cl.data_id)
+          IS DISTINCT FROM
+          (EXCLUDED.metadata_id, EXCLUDED.camera_index, EXCLUDED.camera_name, EXCLUDED.timestamp, EXCLUDED.description, EXCLUDED.data_id)
+    RETURNING cl.camera_id
+)
+SELECT (SELECT COUNT(*) FROM upserted), (SELECT COUNT(*) FROM removed)
+"""
+
+@instrumented()
 def fetch_latest_frame_analyses():
-    conn = get_db_connection()
-    if not conn:
-        logger.error("Database connection failed")
-        return None
     try:
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT DISTINCT ON (camera_id)
-                    camera_id, camera_index, timestamp, description, camera_name
-                FROM visionmon_metadata
-                ORDER BY camera_id, timestamp DESC
-            """)
+        with db_connection() as conn, conn.cursor() as cursor:
+            try:
+                cursor.execute("""
+                    SELECT camera_id, camera_index, timestamp, description, camera_name
+                    FROM camera_latest
+                    ORDER BY camera_id
+                """)
+            except psycopg2.errors.UndefinedTable:
+                logger.warning("camera_latest table is missing; run migrations. Falling back to a full scan.")
+                conn.rollback()
+                cursor.execute(LATEST_FRAME_ANALYSES_SCAN)
             return cursor.fetchall()
     except psycopg2.Error as e:
         logger.error(f"Database error when fetching frame analyses: {e}")
         return None
-    finally:
-        conn.close()
 
+@instrumented()
 def fetch_recent_llm_outputs(limit=50):
-    conn = get_db_connection()
-    if not conn:
-        logger.error("Database connection failed")
-        return None
     try:
-        with conn.cursor() as cursor:
+        with db_connection() as conn, conn.cursor() as cursor:
             cursor.execute("""
                 SELECT camera_id, camera_index, timestamp, description, camera_name
                 FROM visionmon_metadata
@@ -78,37 +111,25 @@ def fetch_recent_llm_outputs(limit=50):
     except psycopg2.Error as e:
         logger.error(f"Database error when fetching LLM outputs: {e}")
         return None
-    finally:
-        conn.close()
 
+@instrumented()
 def insert_facility_status(raw_message, timestamp):
-    conn = get_db_connection()
-    if not conn:
-        logger.error("Database connection failed")
-        return False
     try:
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                INSERT INTO facility_status (raw_message, timestamp)
-                VALUES (%s, %s)
-            """, (raw_message, timestamp))
-        conn.commit()
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO facility_status (raw_message, timestamp)
+                    VALUES (%s, %s)
+                """, (raw_message, timestamp))
+            conn.commit()
         return True
     except psycopg2.Error as e:
         logger.error(f"Database error when inserting facility status: {e}")
         return False
-    finally:
-        conn.close()
-        
+
+@instrumented()
 async def fetch_daily_descriptions():
     try:
-        conn = await asyncpg.connect(
-            host=settings.DATABASES['default']['HOST'],
-            database=settings.DATABASES['default']['NAME'],
-            user=settings.DATABASES['default']['USER'],
-            password=settings.DATABASES['default']['PASSWORD']
-        )
-        
         # Fetch descriptions from the last 24 hours
         query = """
         SELECT camera_name, description
@@ -117,200 +138,423 @@ async def fetch_daily_descriptions():
         ORDER BY timestamp DESC
         """
         
-        results = await conn.fetch(query)
+        async with async_db_connection() as conn:
+            results = await conn.fetch(query)
         
         # Format results as a dictionary
         daily_descriptions = {row['camera_name']: row['description'] for row in results}
         
-        await conn.close()
         return daily_descriptions
     except Exception as e:
         print(f"Error fetching daily descriptions: {str(e)}")
         return {}
     
+@instrumented()
 def get_latest_frame(camera_id):
-    conn = get_db_connection()
-    if not conn:
-        logger.error("Database connection failed")
-        return False
     try:
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT vb.data
-            FROM visionmon_binary_data vb
-            JOIN visionmon_metadata vm ON vb.id = vm.data_id
-            WHERE vm.camera_id = %s
-            ORDER BY vm.timestamp DESC
-            LIMIT 1
-        """, (camera_id,))
-        result = cur.fetchone()
-        return result[0] if result else None
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT vb.content_hash, vb.data, vb.archive
+                FROM visionmon_binary_data vb
+                JOIN visionmon_metadata vm ON vb.id = vm.data_id
+                WHERE vm.camera_id = %s
+                ORDER BY vm.timestamp DESC
+                LIMIT 1
+            """, (camera_id,))
+            result = cur.fetchone()
+            return resolve_frame(*result) if result else None
     except Exception as e:
         print(f"Error fetching latest frame for camera {camera_id}: {str(e)}")
         return None
 
-def fetch_timeline_events(start_time, end_time, camera_id=None):
+# Newest frame for a camera index: its frame id comes from camera_latest (kept current by
+# triggers) and the image is then read by primary key, instead of sorting the metadata history.
+LATEST_CAMERA_FRAME_QUERY = """
+    SELECT vb.content_hash, vb.data, vb.archive, cl.timestamp, cl.data_id
+    FROM camera_latest cl
+    JOIN visionmon_binary_data vb ON vb.id = cl.data_id
+    WHERE cl.camera_index = %s
+    ORDER BY cl.timestamp DESC NULLS LAST
+    LIMIT 1
+"""
+
+# Same result from the metadata history; used while camera_latest is missing and when
+# the newest metadata row's frame is not stored (camera_latest row without binary data).
+LATEST_CAMERA_FRAME_SCAN = """
+    SELECT vb.content_hash, vb.data, vb.archive, vm.timestamp, vm.data_id
+    FROM visionmon_metadata vm
+    JOIN visionmon_binary_data vb ON vm.data_id = vb.id
+    WHERE vm.camera_index = %s
+    ORDER BY vm.timestamp DESC
+    LIMIT 1
+"""
+
+@instrumented()
+def fetch_latest_camera_frame(camera_index):
+    """Return (image bytes, timestamp, data_id) of the newest frame for camera_index, or None."""
+    try:
+        with db_connection() as conn, conn.cursor() as cursor:
+            try:
+                cursor.execute(LATEST_CAMERA_FRAME_QUERY, (camera_index,))
+                result = cursor.fetchone()
+            except psycopg2.errors.UndefinedTable:
+                conn.rollback()
+                result = None
+            if result is None:
+                cursor.execute(LATEST_CAMERA_FRAME_SCAN, (camera_index,))
+                result = cursor.fetchone()
+            if result is None:
+                return None
+            content_hash, data, archive, timestamp, data_id = result
+            data = resolve_frame(content_hash, data, archive)
+            if data is None:
+                return None
+            return data, timestamp, data_id
+    except psycopg2.Error as e:
+        logger.error(f"Database error when fetching latest frame for camera index {camera_index}: {e}")
+        return None
+
+# Timeline events are matched to the state_result row in effect at their timestamp
+# (the latest one at or before it) with a single as-of merge instead of a correlated
+# subquery per event: events and the state rows spanning them are merged into one
+# time-ordered stream, and each event takes the id of the last state row before it.
+# Only state ids travel through the merge; each distinct state row is then decoded once by
+# fetch_camera_states(), which keeps recently used rows in an LRU cache.
+TIMELINE_EVENTS_QUERY = """
+WITH events AS (
+    SELECT
+        vm.id,
+        vm.camera_id,
+        vm.camera_name,
+        vm.timestamp,
+        vm.data_id,
+        COALESCE(vm.description, 'No description available') AS description
+    FROM visionmon_metadata vm
+    {where}
+    {order_limit}
+),
+bounds AS (
+    SELECT MIN(timestamp) AS lo, MAX(timestamp) AS hi FROM events
+),
+merged AS (
+    SELECT e.timestamp AS ts, 1 AS kind, e.id, e.camera_id, e.camera_name, e.data_id, e.description,
+           NULL::bigint AS state_id
+    FROM events e
+    UNION ALL
+    SELECT sr.timestamp, 0, NULL, NULL, NULL, NULL, NULL, sr.id
+    FROM state_result sr, bounds
+    WHERE sr.timestamp <= bounds.hi
+      AND sr.timestamp >= COALESCE(
+          (SELECT MAX(s.timestamp) FROM state_result s WHERE s.timestamp <= bounds.lo),
+          bounds.lo
+      )
+),
+grouped AS (
+    -- every state row opens a new group; events inherit the group of the last state before them
+    SELECT merged.*,
+           COUNT(state_id) OVER (ORDER BY ts, kind, state_id) AS grp
+    FROM merged
+),
+resolved AS (
+    -- each group holds at most one state row, so its MAX is that row's id
+    SELECT id, camera_id, camera_name, ts, data_id, description, kind, grp,
+           MAX(state_id) OVER (PARTITION BY grp) AS state_id
+    FROM grouped
+)
+SELECT id, camera_id, camera_name, ts AS timestamp, data_id, description, state_id{frame_hash}
+FROM resolved
+WHERE kind = 1
+-- grp never decreases along (ts, id), so leading with it gives the same order while
+-- letting the planner reuse the window's sort instead of sorting every row again
+ORDER BY grp {direction}, ts {direction}, id {direction}
+"""
+
+# Near-identical frames of a camera share one stored image (see frame_store), so
+# equal content hashes identify a run of unchanged frames.
+TIMELINE_FRAME_HASH_COLUMN = """,
+    (SELECT vb.content_hash FROM visionmon_binary_data vb WHERE vb.id = resolved.data_id) AS frame_hash"""
+
+def build_timeline_events_query(conditions, direction='ASC', pagination=None, with_frame_hash=False):
+    """
+    pagination: None for the whole range, 'offset' to append OFFSET %s LIMIT %s,
+    or 'keyset' to append LIMIT %s (the seek condition is passed in `conditions`).
+    with_frame_hash adds each event's frame_hash, for collapse_duplicate_events.
+    """
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    order_limit = f"ORDER BY vm.timestamp {direction}, vm.id {direction}"
+    if pagination == 'offset':
+        order_limit += " OFFSET %s LIMIT %s"
+    elif pagination == 'keyset':
+        order_limit += " LIMIT %s"
+    frame_hash = TIMELINE_FRAME_HASH_COLUMN if with_frame_hash else ""
+    return TIMELINE_EVENTS_QUERY.format(where=where, order_limit=order_limit, direction=direction, frame_hash=frame_hash)
+
+def fetch_state_messages(cur, state_ids):
+    """Fetch raw_message for each distinct state_result id, once."""
+    state_ids = sorted({state_id for state_id in state_ids if state_id is not None})
+    if not state_ids:
+        return {}
+    cur.execute("SELECT id, raw_message FROM state_result WHERE id = ANY(%s)", (state_ids,))
+    return {row[0]: row[1] for row in cur.fetchall()}
+
+# state_result rows are never updated, so a decoded row stays valid for as long as it is cached.
+camera_state_cache = LRUCache(STATE_CACHE_SIZE)
+
+def base_camera_name(camera_name):
+    """Camera name without its number suffix, e.g. 'Kitchen 3' -> 'Kitchen'."""
+    return str(camera_name).split(' ')[0]
+
+def decode_camera_states(raw_message):
+    """Parse a state_result message into {base_camera_name: state}."""
     try:
-        conn = get_db_connection()
-        if not conn:
-            logger.error("Database connection failed")
-            return []
-            
-        with conn.cursor(cursor_factory=DictCursor) as cur:
-            query = """
-            SELECT 
-                vm.camera_id,
-                vm.camera_name,
-                vm.timestamp,
-                vm.data_id,
-                COALESCE(vm.description, 'No description available') as description,
-                (
-                    SELECT raw_message
-                    FROM state_result sr
-                    WHERE sr.timestamp <= vm.timestamp
-                    ORDER BY sr.timestamp DESC
-                    LIMIT 1
-                ) as state_data
-            FROM visionmon_metadata vm
-            WHERE vm.timestamp BETWEEN %s AND %s
-            """
+        state_data = json.loads(raw_message) if raw_message else {}
+    except (TypeError, ValueError) as e:
+        logger.error(f"Error decoding state_result message: {str(e)}")
+        return {}
+    camera_states = {}
+    for target_name, state in state_data.get('camera_states', {}).items():
+        # The first camera with a given base name wins, as the old prefix scan did
+        camera_states.setdefault(base_camera_name(target_name), state)
+    return camera_states
+
+def fetch_camera_states(cur, state_ids):
+    """
+    Return {state_id: {base_camera_name: state}} for the given state_result ids.
+    Ids already in camera_state_cache are served from it without touching the database.
+    """
+    camera_states = {}
+    missing = []
+    for state_id in {state_id for state_id in state_ids if state_id is not None}:
+        cached = camera_state_cache.get(state_id)
+        if cached is None:
+            missing.append(state_id)
+        else:
+            camera_states[state_id] = cached
+    for state_id, raw_message in fetch_state_messages(cur, missing).items():
+        decoded = decode_camera_states(raw_message)
+        camera_state_cache.set(state_id, decoded)
+        camera_states[state_id] = decoded
+    return camera_states
+
+def encode_timeline_cursor(timestamp, event_id):
+    """Opaque keyset position of a timeline event: its (timestamp, id)."""
+    payload = json.dumps([timestamp.isoformat(), event_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_timeline_cursor(cursor):
+    """Inverse of encode_timeline_cursor; raises ValueError for malformed cursors."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, event_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(timestamp), int(event_id)
+    except (TypeError, ValueError, UnicodeError, binascii.Error) as e:
+        raise ValueError(f"Invalid timeline cursor: {cursor!r}") from e
+
+def format_timeline_event(row, camera_states):
+    timestamp = row['timestamp']
+    formatted_timestamp = timestamp.strftime('%Y-%m-%dT%H:%M:%S.%f%z') if timestamp else None
+
+    # Match camera name ignoring the number suffix
+    camera_state = camera_states.get(row['state_id'], {}).get(base_camera_name(row['camera_name']), '')
+
+    return {
+        'camera_id': row['camera_id'],
+        'camera_name': row['camera_name'],
+        'timestamp': formatted_timestamp,
+        'data_id': row['data_id'],
+        'description': row['description'],
+        'state': camera_state,
+        'cursor': encode_timeline_cursor(timestamp, row['id']) if timestamp else None
+    }
+
+def collapse_duplicate_events(events, frame_hashes):
+    """
+    Fold each run of a camera's consecutive events showing the same frame into
+    its newest event. `events` are formatted events, newest first, and
+    `frame_hashes` their frame hashes in the same order. A folded event gets
+    'count' (events in the run) and 'first_timestamp' (when the run started).
+    """
+    collapsed = []
+    runs = {}  # camera_id -> (frame_hash, event) the camera's older events may fold into
+    for event, frame_hash in zip(events, frame_hashes):
+        run = runs.get(event['camera_id'])
+        if run is not None and frame_hash is not None and run[0] == frame_hash:
+            folded = run[1]
+            folded['count'] = folded.get('count', 1) + 1
+            folded['first_timestamp'] = event['timestamp']
+            continue
+        runs[event['camera_id']] = (frame_hash, event)
+        collapsed.append(event)
+    return collapsed
+
+@instrumented()
+def fetch_timeline_events(start_time, end_time, camera_id=None, collapse_duplicates=False):
+    try:
+        with db_connection() as conn, conn.cursor(cursor_factory=DictCursor) as cur:
+            conditions = ["vm.timestamp BETWEEN %s AND %s"]
+            params = [start_time, end_time]
             if camera_id:
-                query += " AND vm.camera_id = %s"
-                cur.execute(query, (start_time, end_time, camera_id))
-            else:
-                cur.execute(query, (start_time, end_time))
-            
+                conditions.append("vm.camera_id = %s")
+                params.append(camera_id)
+
+            cur.execute(build_timeline_events_query(conditions, with_frame_hash=collapse_duplicates), params)
             results = cur.fetchall()
+            camera_states = fetch_camera_states(cur, (row['state_id'] for row in results))
             
-            formatted_results = []
-            for row in results:
-                timestamp = row['timestamp']
-                formatted_timestamp = timestamp.strftime('%Y-%m-%dT%H:%M:%S.%f%z') if timestamp else None
-                
-                # Parse the state data JSON to get camera states
-                state_data = json.loads(row['state_data']) if row['state_data'] else {}
-                camera_states = state_data.get('camera_states', {})
-                # Match camera name ignoring the number suffix
-                camera_state = ''
-                source_name = str(row['camera_name']).split(' ')[0]  # Get name part without number
-                for target_name, state in camera_states.items():
-                    target_base = target_name.split(' ')[0]  # Get base name without number
-                    if source_name == target_base:
-                        camera_state = state
-                        break
-                print(f"Camera state: {camera_state}")
-                formatted_results.append({
-                    'camera_id': row['camera_id'],
-                    'camera_name': row['camera_name'],
-                    'timestamp': formatted_timestamp,
-                    'data_id': row['data_id'],
-                    'description': row['description'],
-                    'state': camera_state
-                })
-            
+            formatted_results = [format_timeline_event(row, camera_states) for row in results]
             formatted_results.reverse()
+            if collapse_duplicates:
+                formatted_results = collapse_duplicate_events(formatted_results, [row['frame_hash'] for row in reversed(results)])
             return formatted_results
             
     except Exception as e:
         logger.error(f"Error fetching timeline events: {str(e)}")
         return []
-    finally:
-        if conn:
-            conn.close()
             
+
+@instrumented()
+def iter_timeline_events(start_time, end_time, camera_id=None, fetch_size=EXPORT_FETCH_SIZE):
+    """
+    Stream timeline events in a date range, oldest first, as lists of at most
+    `fetch_size` formatted events. Rows come from a server-side (named) cursor,
+    so memory use does not depend on the size of the range. The pooled
+    connection is held until the generator is exhausted or closed.
+    """
+    conditions = ["vm.timestamp BETWEEN %s AND %s"]
+    params = [start_time, end_time]
+    if camera_id:
+        conditions.append("vm.camera_id = %s")
+        params.append(camera_id)
+
+    with db_connection() as conn:
+        with conn.cursor(name='timeline_export', cursor_factory=DictCursor) as cur, conn.cursor() as state_cur:
+            cur.itersize = fetch_size
+            cur.execute(build_timeline_events_query(conditions), params)
+            while True:
+                rows = cur.fetchmany(fetch_size)
+                if not rows:
+                    break
+                camera_states = fetch_camera_states(state_cur, (row['state_id'] for row in rows))
+                yield [format_timeline_event(row, camera_states) for row in rows]
+
+# A moved frame's row only holds its content hash (data is NULL), and the day
+# archive once it is in the cold tier; rows not moved to the frame store yet
+# still hold the image itself.
+FRAME_REF_QUERY = "SELECT content_hash, data, archive FROM visionmon_binary_data WHERE id = %s"
+
+@instrumented()
+def fetch_frame_ref(data_id):
+    """
+    Return (content_hash, data, archive) of a frame, or None. Only one of
+    content_hash and data is set; archive only with content_hash.
+    """
+    try:
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute(FRAME_REF_QUERY, (data_id,))
+            return cur.fetchone()
+    except Exception as e:
+        logger.error(f"Error fetching frame reference: {str(e)}")
+        return None
+
+# Frames from before partitioning have no creation time (-infinity); they read as NULL
+FRAME_CREATED_QUERY = "SELECT CASE WHEN isfinite(created_at) THEN created_at END FROM visionmon_binary_data WHERE id = %s"
+
+@instrumented()
+def fetch_frame_created_at(data_id):
+    """Return when a frame was stored, or None if it does not exist or predates created_at."""
+    try:
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute(FRAME_CREATED_QUERY, (data_id,))
+            row = cur.fetchone()
+            return row[0] if row else None
+    except Exception as e:
+        logger.error(f"Error fetching frame creation time: {str(e)}")
+        return None
+
+@instrumented()
 def get_frame_image_from_db(data_id):
-    conn = get_db_connection()
-    if not conn:
-        logger.error("Database connection failed")
-        return False
     try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT data FROM visionmon_binary_data WHERE id = %s", (data_id,))
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute(FRAME_REF_QUERY, (data_id,))
             result = cur.fetchone()
-            return result[0] if result else None
+            return resolve_frame(*result) if result else None
     except Exception as e:
         logger.error(f"Error fetching frame image: {str(e)}")
         return None
-    finally:
-        conn.close()
 
-def fetch_timeline_events_paginated(offset=0, limit=20, start_time=None, end_time=None, camera_id=None):
+def _timeline_filters(start_time=None, end_time=None, camera_id=None):
+    conditions = []
+    params = []
+    if camera_id:
+        conditions.append("vm.camera_id = %s")
+        params.append(camera_id)
+    if start_time and end_time:
+        conditions.append("vm.timestamp BETWEEN %s AND %s")
+        params.extend([start_time, end_time])
+    return conditions, params
+
+@instrumented()
+def fetch_timeline_events_paginated(offset=0, limit=20, start_time=None, end_time=None, camera_id=None,
+                                    collapse_duplicates=False):
     """
     Fetch timeline events with pagination and optional date range.
+
+    OFFSET pagination is kept for older clients; it reads and discards every
+    earlier row, so new code should use fetch_timeline_events_page instead.
+    offset and limit count events before collapse_duplicates folds them.
     """
     try:
-        conn = get_db_connection()
-        if not conn:
-            logger.error("Database connection failed")
-            return []
-
-        with conn.cursor(cursor_factory=DictCursor) as cur:
-            query = """
-            SELECT 
-                vm.camera_id,
-                vm.camera_name,
-                vm.timestamp,
-                vm.data_id,
-                COALESCE(vm.description, 'No description available') as description,
-                (
-                    SELECT raw_message
-                    FROM state_result sr
-                    WHERE sr.timestamp <= vm.timestamp
-                    ORDER BY sr.timestamp DESC
-                    LIMIT 1
-                ) as state_data
-            FROM visionmon_metadata vm
-            """
-            params = []
-            conditions = []
-
-            if camera_id:
-                conditions.append("vm.camera_id = %s")
-                params.append(camera_id)
-            if start_time and end_time:
-                conditions.append("vm.timestamp BETWEEN %s AND %s")
-                params.extend([start_time, end_time])
-
-            if conditions:
-                query += " WHERE " + " AND ".join(conditions)
-
-            query += """
-            ORDER BY vm.timestamp DESC
-            OFFSET %s
-            LIMIT %s
-            """
+        with db_connection() as conn, conn.cursor(cursor_factory=DictCursor) as cur:
+            conditions, params = _timeline_filters(start_time, end_time, camera_id)
             params.extend([offset, limit])
 
-            cur.execute(query, params)
+            cur.execute(build_timeline_events_query(conditions, direction='DESC', pagination='offset',
+                                                    with_frame_hash=collapse_duplicates), params)
             results = cur.fetchall()
+            camera_states = fetch_camera_states(cur, (row['state_id'] for row in results))
 
-            formatted_results = []
-            for row in results:
-                timestamp = row['timestamp']
-                formatted_timestamp = timestamp.strftime('%Y-%m-%dT%H:%M:%S.%f%z') if timestamp else None
-
-                state_data = json.loads(row['state_data']) if row['state_data'] else {}
-                camera_states = state_data.get('camera_states', {})
-                camera_state = ''
-                source_name = str(row['camera_name']).split(' ')[0]
-                for target_name, state in camera_states.items():
-                    target_base = target_name.split(' ')[0]
-                    if source_name == target_base:
-                        camera_state = state
-                        break
-
-                formatted_results.append({
-                    'camera_id': row['camera_id'],
-                    'camera_name': row['camera_name'],
-                    'timestamp': formatted_timestamp,
-                    'data_id': row['data_id'],
-                    'description': row['description'],
-                    'state': camera_state
-                })
-            return formatted_results
+            events = [format_timeline_event(row, camera_states) for row in results]
+            if collapse_duplicates:
+                events = collapse_duplicate_events(events, [row['frame_hash'] for row in results])
+            return events
     except Exception as e:
         logger.error(f"Error fetching timeline events (paginated): {str(e)}")
         return []
-    finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+
+@instrumented()
+def fetch_timeline_events_page(limit=20, cursor=None, start_time=None, end_time=None, camera_id=None,
+                               collapse_duplicates=False):
+    """
+    Fetch one page of timeline events, newest first, seeking past `cursor`
+    (an opaque value from encode_timeline_cursor) on the (timestamp, id) index.
+
+    Returns (events, next_cursor); next_cursor is None on the last page.
+    Raises ValueError if the cursor is malformed. With collapse_duplicates a
+    page may hold fewer than `limit` events, and a run crossing a page
+    boundary is folded separately on each page.
+    """
+    conditions, params = _timeline_filters(start_time, end_time, camera_id)
+    if cursor:
+        conditions.append("(vm.timestamp, vm.id) < (%s, %s)")
+        params.extend(decode_timeline_cursor(cursor))
+    # Fetch one extra row to learn whether another page exists
+    params.append(limit + 1)
+
+    try:
+        with db_connection() as conn, conn.cursor(cursor_factory=DictCursor) as cur:
+            cur.execute(build_timeline_events_query(conditions, direction='DESC', pagination='keyset',
+                                                    with_frame_hash=collapse_duplicates), params)
+            results = cur.fetchall()
+            has_more = len(results) > limit
+            results = results[:limit]
+            camera_states = fetch_camera_states(cur, (row['state_id'] for row in results))
+
+            events = [format_timeline_event(row, camera_states) for row in results]
+            # The next page starts after the last row, even when that row is folded away
+            next_cursor = events[-1]['cursor'] if has_more and events else None
+            if collapse_duplicates:
+                events = collapse_duplicate_events(events, [row['frame_hash'] for row in results])
+            return events, next_cursor
+    except Exception as e:
+        logger.error(f"Error fetching timeline events (keyset page): {str(e)}")
+        return [], None
@@ -0,0 +1,345 @@
+# monitor/db_pool.py
+import asyncio
+import gc
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
+
+import asyncpg
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import PoolError
+from django.conf import settings
+
+from .config import (
+    DB_POOL_MIN_SIZE,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_TIMEOUT,
+    DB_POOL_HEALTHCHECK_INTERVAL,
+    DB_POOL_MAX_IDLE,
+)
+from .instrumentation import InstrumentedConnection
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(PoolError):
+    pass
+
+
+def get_connection_params():
+    db = settings.DATABASES['default']
+    return {
+        'host': db['HOST'],
+        'database': db['NAME'],
+        'user': db['USER'],
+        'password': db['PASSWORD'],
+        'port': db['PORT'],
+    }
+
+
+class ConnectionPool:
+    """
+    Thread-safe psycopg2 connection pool.
+
+    Unlike psycopg2.pool.ThreadedConnectionPool this blocks (up to `timeout`)
+    when all connections are checked out instead of failing immediately,
+    pings connections that sat idle longer than `healthcheck_interval` before
+    handing them out, and keeps counters for pool-wait metrics.
+    """
+
+    def __init__(self, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE, timeout=DB_POOL_TIMEOUT,
+                 healthcheck_interval=DB_POOL_HEALTHCHECK_INTERVAL, max_idle=DB_POOL_MAX_IDLE):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid pool size: min={min_size}, max={max_size}")
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.healthcheck_interval = healthcheck_interval
+        self.max_idle = max_idle
+
+        self._cond = threading.Condition()
+        self._idle = []  # LIFO stack of (connection, returned_at)
+        self._size = 0
+        self._closed = False
+        self._stats = {
+            'checkouts': 0,
+            'connections_created': 0,
+            'connections_discarded': 0,
+            'healthcheck_failures': 0,
+            'timeouts': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+        }
+
+        for _ in range(min_size):
+            try:
+                conn = self._connect()
+            except psycopg2.Error as e:
+                logger.error(f"Unable to pre-fill connection pool: {e}")
+                break
+            self._idle.append((conn, time.monotonic()))
+            self._size += 1
+
+    def _connect(self):
+        # Cursors of pooled connections feed the query metrics in monitor/instrumentation.py
+        conn = psycopg2.connect(**get_connection_params(), connection_factory=InstrumentedConnection)
+        with self._cond:
+            self._stats['connections_created'] += 1
+        return conn
+
+    def _is_healthy(self, conn, returned_at):
+        if conn.closed:
+            return False
+        if time.monotonic() - returned_at < self.healthcheck_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error as e:
+            logger.warning(f"Discarding unhealthy pooled connection: {e}")
+            return False
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolError("connection pool is closed")
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    conn, returned_at = None, None
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f"Timed out after {self.timeout}s waiting for a database connection")
+                waited = True
+                self._cond.wait(remaining)
+
+            wait_time = time.monotonic() - start
+            self._stats['checkouts'] += 1
+            if waited:
+                self._stats['waits'] += 1
+            self._stats['wait_time_total'] += wait_time
+            self._stats['wait_time_max'] = max(self._stats['wait_time_max'], wait_time)
+
+        if conn is not None and not self._is_healthy(conn, returned_at):
+            with self._cond:
+                self._stats['healthcheck_failures'] += 1
+                self._stats['connections_discarded'] += 1
+            self._close_quietly(conn)
+            conn = None
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+        return conn
+
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            status = conn.info.transaction_status
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+
+        now = time.monotonic()
+        stale = []
+        with self._cond:
+            if discard or conn.closed or self._closed:
+                self._size -= 1
+                self._stats['connections_discarded'] += 1
+                stale.append(conn)
+            else:
+                self._idle.append((conn, now))
+                # Trim connections above the minimum that have been idle for too long;
+                # the stack is LIFO so the oldest entries sit at the bottom.
+                while len(self._idle) > 1 and self._size > self.min_size and now - self._idle[0][1] > self.max_idle:
+                    stale.append(self._idle.pop(0)[0])
+                    self._size -= 1
+            self._cond.notify()
+
+        for stale_conn in stale:
+            self._close_quietly(stale_conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+            })
+        checkouts = stats['checkouts']
+        stats['wait_time_avg'] = stats['wait_time_total'] / checkouts if checkouts else 0.0
+        return stats
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return this process's connection pool, creating it on first use (or after a fork)."""
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = ConnectionPool()
+                _pool_pid = pid
+                logger.info(f"Created database connection pool (min={_pool.min_size}, max={_pool.max_size})")
+    return _pool
+
+
+@contextmanager
+def db_connection():
+    """Borrow a pooled connection; it is rolled back and returned to the pool on exit."""
+    with get_pool().connection() as conn:
+        yield conn
+
+
+# asyncpg pools are bound to the event loop that created them, so keep one per loop.
+_async_pools = {}
+_async_stats = {
+    'checkouts': 0,
+    'wait_time_total': 0.0,
+    'wait_time_max': 0.0,
+    'timeouts': 0,
+}
+
+
+def _discard_closed_loop_pools():
+    """
+    Forget the pools of event loops that have closed (e.g. after an asyncio.run()
+    without close_async_pool()). Such a pool can no longer be closed or terminated,
+    as both need its loop; collecting it closes its connections' sockets.
+    """
+    closed = [loop for loop in list(_async_pools) if loop.is_closed()]
+    for loop in closed:
+        _async_pools.pop(loop, None)
+    if closed:
+        gc.collect()
+        logger.warning(f"Discarded {len(closed)} async database connection pool(s) of closed event loops")
+
+
+async def get_async_pool():
+    loop = asyncio.get_running_loop()
+    _discard_closed_loop_pools()
+    pool = _async_pools.get(loop)
+    if pool is None:
+        params = get_connection_params()
+        pool = await asyncpg.create_pool(
+            host=params['host'],
+            database=params['database'],
+            user=params['user'],
+            password=params['password'],
+            port=params['port'],
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            max_inactive_connection_lifetime=DB_POOL_MAX_IDLE,
+        )
+        existing = _async_pools.setdefault(loop, pool)
+        if existing is not pool:
+            await pool.close()
+            pool = existing
+        else:
+            logger.info(f"Created async database connection pool (min={DB_POOL_MIN_SIZE}, max={DB_POOL_MAX_SIZE})")
+    return pool
+
+
+async def close_async_pool():
+    """Close the running loop's pool; callers of asyncio.run() await this in a finally."""
+    pool = _async_pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        await pool.close()
+        logger.info("Closed async database connection pool")
+
+
+@asynccontextmanager
+async def async_db_connection():
+    pool = await get_async_pool()
+    start = time.monotonic()
+    try:
+        conn = await pool.acquire(timeout=DB_POOL_TIMEOUT)
+    except asyncio.TimeoutError:
+        _async_stats['timeouts'] += 1
+        raise PoolTimeout(f"Timed out after {DB_POOL_TIMEOUT}s waiting for an async database connection")
+    wait_time = time.monotonic() - start
+    _async_stats['checkouts'] += 1
+    _async_stats['wait_time_total'] += wait_time
+    _async_stats['wait_time_max'] = max(_async_stats['wait_time_max'], wait_time)
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+
+def get_pool_stats():
+    pool = _pool
+    stats = {'sync': pool.stats() if pool is not None else None}
+    async_stats = dict(_async_stats)
+    _discard_closed_loop_pools()
+    async_stats['pools'] = [
+        {'size': pool.get_size(), 'idle': pool.get_idle_size()}
+        for pool in list(_async_pools.values())
+    ]
+    stats['async'] = async_stats
+    return stats
+
+
+def close_pools():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
@@ -0,0 +1,207 @@
+# monitor/frame_cache.py
+import logging
+import threading
+from datetime import datetime
+
+import redis
+
+from .caching import LRUCache
+from .config import REDIS_HOST, REDIS_PORT, LATEST_FRAME_CACHE_SIZE, LATEST_FRAME_TTL
+from .db_operations import fetch_latest_camera_frame
+
+logger = logging.getLogger(__name__)
+
+# The newest frame of each camera, shared by every server process through Redis
+# and kept in a small per-process LRU in front of it:
+#
+#   latest_frame:<camera_index>  hash {data_id, timestamp, epoch, data}, expires after LATEST_FRAME_TTL
+#
+# A request first reads the hash's tiny data_id field. If this process already
+# holds that frame it is served from memory; otherwise the image is read from
+# Redis once and kept. Postgres is only queried when Redis has no entry (first
+# request after a restart, or a camera that stopped sending frames). The
+# redis_listener refreshes the entry whenever a new llm_messages analysis arrives.
+
+FRAME_KEY = 'latest_frame:{camera_index}'
+
+# Compare-and-set, so a process filling a miss from an older database read can
+# never replace a newer frame the listener has just published.
+STORE_FRAME_SCRIPT = """
+local current = tonumber(redis.call('HGET', KEYS[1], 'epoch'))
+if current and current > tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'data_id', ARGV[1], 'epoch', ARGV[2], 'timestamp', ARGV[3], 'data', ARGV[4])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return 1
+"""
+
+
+class LatestFrame:
+    __slots__ = ('data', 'timestamp', 'data_id')
+
+    def __init__(self, data, timestamp, data_id):
+        self.data = data
+        self.timestamp = timestamp  # datetime or None
+        self.data_id = data_id
+
+
+class LatestFrameCache:
+
+    def __init__(self, redis_client=None, size=LATEST_FRAME_CACHE_SIZE, ttl=LATEST_FRAME_TTL):
+        self.redis = redis_client or redis.Redis(host=REDIS_HOST, port=REDIS_PORT,
+                                                 socket_timeout=2, socket_connect_timeout=2)
+        self.local = LRUCache(size)
+        self.ttl = ttl
+        self._store_script = self.redis.register_script(STORE_FRAME_SCRIPT)
+        self._lock = threading.Lock()
+        self._stats = {
+            'local_hits': 0,
+            'redis_hits': 0,
+            'misses': 0,
+            'refreshes': 0,
+            'redis_errors': 0,
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _store(self, camera_index, frame):
+        """Publish `frame` to Redis unless a newer frame is already there."""
+        timestamp = frame.timestamp.isoformat() if frame.timestamp else ''
+        epoch = frame.timestamp.timestamp() if frame.timestamp else 0
+        return bool(self._store_script(
+            keys=[FRAME_KEY.format(camera_index=camera_index)],
+            args=[frame.data_id, repr(epoch), timestamp, frame.data, int(self.ttl)],
+        ))
+
+    def _load_from_db(self, camera_index):
+        result = fetch_latest_camera_frame(camera_index)
+        if result is None:
+            return None
+        return LatestFrame(*result)
+
+    def get(self, camera_index):
+        """Newest LatestFrame for `camera_index`, or None if the camera has no frames."""
+        key = FRAME_KEY.format(camera_index=camera_index)
+        try:
+            data_id = self.redis.hget(key, 'data_id')
+            if data_id is not None:
+                cached = self.local.get(camera_index)
+                if cached is not None and str(cached.data_id) == data_id.decode('ascii'):
+                    self._count('local_hits')
+                    return cached
+                data_id, timestamp, data = self.redis.hmget(key, 'data_id', 'timestamp', 'data')
+                if data is not None:
+                    timestamp = datetime.fromisoformat(timestamp.decode('ascii')) if timestamp else None
+                    frame = LatestFrame(data, timestamp, int(data_id))
+                    self.local.set(camera_index, frame)
+                    self._count('redis_hits')
+                    return frame
+        except redis.RedisError as e:
+            self._count('redis_errors')
+            logger.error(f"Redis error reading latest frame for camera {camera_index}: {e}")
+            frame = self._load_from_db(camera_index)
+            self._count('misses')
+            return frame
+
+        self._count('misses')
+        frame = self._load_from_db(camera_index)
+        if frame is not None:
+            self.local.set(camera_index, frame)
+            try:
+                self._store(camera_index, frame)
+            except redis.RedisError as e:
+                self._count('redis_errors')
+                logger.error(f"Redis error storing latest frame for camera {camera_index}: {e}")
+        return frame
+
+    def peek(self, camera_index):
+        """
+        (data_id, timestamp) of the newest frame for `camera_index` without
+        copying the image out of Redis, e.g. to answer a conditional request.
+        Falls back to get() when Redis has no entry. None if the camera has no frames.
+        """
+        try:
+            data_id, timestamp = self.redis.hmget(FRAME_KEY.format(camera_index=camera_index), 'data_id', 'timestamp')
+        except redis.RedisError as e:
+            self._count('redis_errors')
+            logger.error(f"Redis error reading latest frame for camera {camera_index}: {e}")
+            data_id = None
+        if data_id is not None:
+            return int(data_id), datetime.fromisoformat(timestamp.decode('ascii')) if timestamp else None
+        frame = self.get(camera_index)
+        return (frame.data_id, frame.timestamp) if frame is not None else None
+
+    def peek_many(self, camera_indexes):
+        """peek() for several cameras in one pipelined round trip; {camera_index: (data_id, timestamp) or None}."""
+        camera_indexes = list(camera_indexes)
+        try:
+            pipeline = self.redis.pipeline(transaction=False)
+            for camera_index in camera_indexes:
+                pipeline.hmget(FRAME_KEY.format(camera_index=camera_index), 'data_id', 'timestamp')
+            results = pipeline.execute()
+        except redis.RedisError as e:
+            self._count('redis_errors')
+            logger.error(f"Redis error reading latest frames: {e}")
+            results = [(None, None)] * len(camera_indexes)
+        versions = {}
+        for camera_index, (data_id, timestamp) in zip(camera_indexes, results):
+            if data_id is not None:
+                versions[camera_index] = (int(data_id), datetime.fromisoformat(timestamp.decode('ascii')) if timestamp else None)
+            else:
+                frame = self.get(camera_index)
+                versions[camera_index] = (frame.data_id, frame.timestamp) if frame is not None else None
+        return versions
+
+    def refresh(self, camera_index):
+        """Re-read the newest frame of `camera_index` from the database and publish it to every process."""
+        frame = self._load_from_db(camera_index)
+        if frame is None:
+            return None
+        try:
+            stored = self._store(camera_index, frame)
+        except redis.RedisError as e:
+            self._count('redis_errors')
+            logger.error(f"Redis error refreshing latest frame for camera {camera_index}: {e}")
+            return None
+        if stored:
+            self.local.set(camera_index, frame)
+            self._count('refreshes')
+        return frame
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['local_hits'] + stats['redis_hits'] + stats['misses']
+        stats['hit_ratio'] = (stats['local_hits'] + stats['redis_hits']) / lookups if lookups else 0.0
+        stats['local'] = self.local.stats()
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_latest_frame_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LatestFrameCache()
+    return _cache
+
+
+def camera_index_from_message(message):
+    """
+    Camera index of an llm_messages analysis, which starts with
+    '<camera name> <camera index> <date> <time> ...'; None if it does not parse.
+    """
+    parts = message.split(' ')
+    if len(parts) < 4:
+        return None
+    try:
+        return int(parts[1])
+    except ValueError:
+        return None
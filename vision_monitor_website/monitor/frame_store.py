@@ -0,0 +1,668 @@
+# monitor/frame_store.py
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+
+import numpy as np
+from django.utils.module_loading import import_string
+from PIL import Image
+
+from .config import (
+    FRAME_STORE_BACKEND,
+    FRAME_STORE_DIR,
+    FRAME_MIGRATION_BATCH_SIZE,
+    FRAME_MIGRATION_SLEEP,
+    FRAME_MIGRATION_MAX_RUNTIME,
+    FRAME_DEDUP_THRESHOLD,
+    FRAME_ARCHIVE_DIR,
+    FRAME_COLD_AFTER_DAYS,
+    FRAME_COLD_QUALITY,
+    FRAME_COLD_MAX_WIDTH,
+    RETENTION_DAYS,
+)
+from .caching import LRUCache
+from .db_pool import db_connection
+from .thumbnails import encode_variant
+
+logger = logging.getLogger(__name__)
+
+# Frame images live in a content-addressed store and visionmon_binary_data keeps
+# only their SHA-256 (content_hash, migration 0007) with data set to NULL. Rows
+# written with the image inline (the ingest pipeline, or rows not moved yet) are
+# still read from the data column, and move_frames_to_store() moves them over in
+# batches. Identical frames share one file, and so do near-identical consecutive
+# frames of a camera (a static scene): a frame whose perceptual hash is within
+# FRAME_DEDUP_THRESHOLD bits of its predecessor's is stored as that frame.
+#
+# Frames older than FRAME_COLD_AFTER_DAYS move on to a cold tier (FrameArchive):
+# recompressed, packed into one zip per day, and recorded in the row's archive
+# column (migration 0009). resolve_frame() reads from whichever tier holds a frame.
+
+# A file the frame-store migration has just reused is referenced once its batch
+# commits; the cold-tier job leaves files touched this recently alone.
+STORE_GRACE_SECONDS = 3600
+
+
+class FrameStore:
+    """
+    Interface of a frame store backend (FRAME_STORE_BACKEND). Frames are
+    addressed by the hex SHA-256 of their bytes.
+    """
+
+    def put(self, data):
+        """Store `data` durably and return its content hash."""
+        raise NotImplementedError
+
+    def get(self, content_hash):
+        """Bytes of the frame, or None if the store has no such frame."""
+        raise NotImplementedError
+
+    def delete(self, content_hash, older_than=None):
+        """
+        Delete a stored frame, unless `older_than` (an epoch time) is given and it
+        was stored or touched since then. True if a frame was deleted.
+        """
+        raise NotImplementedError
+
+    def touch(self, content_hash):
+        """Mark a stored frame as just stored again (see collect_frame_garbage); False if it is missing."""
+        raise NotImplementedError
+
+    def accel_path(self, content_hash):
+        """Path of the frame below the nginx X-Accel-Redirect location, or None if nginx cannot serve it."""
+        return None
+
+    def iter_older_than(self, cutoff):
+        """(content_hash, size) of frames last stored before the epoch time `cutoff`, for garbage collection."""
+        raise NotImplementedError
+
+
+def content_hash_of(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def perceptual_hash(data):
+    """
+    64-bit difference hash (dHash) of an image, as a signed integer for a bigint
+    column: the frame is reduced to 9x8 grey pixels and each bit records whether
+    a pixel is brighter than its right neighbour. Unchanged scenes hash alike
+    despite JPEG noise. None if the image cannot be decoded.
+    """
+    try:
+        with Image.open(BytesIO(data)) as image:
+            image.draft('L', (64, 64))
+            pixels = np.asarray(image.convert('L').resize((9, 8), Image.BOX), dtype=np.int16)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.error(f"Error hashing frame: {e}")
+        return None
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    value = int.from_bytes(np.packbits(bits).tobytes(), 'big')
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def hamming_distance(a, b):
+    return ((a ^ b) & 0xFFFFFFFFFFFFFFFF).bit_count()
+
+
+def _fsync_directory(directory):
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+class LocalFrameStore(FrameStore):
+    """
+    Frames as files in `directory`, sharded by the first two bytes of the hash
+    (ab/cd/abcd....jpg) so no directory grows too large. Files are written
+    atomically and fsynced before put() returns, since the database copy is
+    dropped once the hash is recorded.
+    """
+
+    def __init__(self, directory=FRAME_STORE_DIR):
+        self.directory = directory
+
+    def relative_path(self, content_hash):
+        return f"{content_hash[:2]}/{content_hash[2:4]}/{content_hash}.jpg"
+
+    def path(self, content_hash):
+        return os.path.join(self.directory, self.relative_path(content_hash))
+
+    def put(self, data):
+        content_hash = content_hash_of(data)
+        path = self.path(content_hash)
+        if os.path.exists(path):
+            # Already stored by an identical frame; refresh its age for garbage collection
+            os.utime(path)
+            return content_hash
+        shard = os.path.dirname(path)
+        os.makedirs(shard, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=shard, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_path, 0o644)  # nginx reads the files directly
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        _fsync_directory(shard)
+        return content_hash
+
+    def get(self, content_hash):
+        try:
+            with open(self.path(content_hash), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, content_hash, older_than=None):
+        path = self.path(content_hash)
+        try:
+            if older_than is not None and os.stat(path).st_mtime >= older_than:
+                return False
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def touch(self, content_hash):
+        try:
+            os.utime(self.path(content_hash))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def accel_path(self, content_hash):
+        return self.relative_path(content_hash)
+
+    def iter_older_than(self, cutoff):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith('.jpg'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue
+                if stat.st_mtime < cutoff:
+                    yield name[:-len('.jpg')], stat.st_size
+
+
+class FrameArchive:
+    """
+    Cold tier: the frames of one day, recompressed, in <directory>/<YYYY-MM-DD>.zip
+    as <content_hash>.jpg members. The zip's central directory is the index, so a
+    frame is found without scanning the file. Each process keeps a few archives
+    open and reopens one when a later run has replaced it.
+    """
+
+    def __init__(self, directory=FRAME_ARCHIVE_DIR, open_archives=8):
+        self.directory = directory
+        self._open = LRUCache(open_archives)  # name -> (mtime_ns, ZipFile)
+        self._lock = threading.Lock()
+
+    def path(self, name):
+        return os.path.join(self.directory, f"{name}.zip")
+
+    def _zip(self, name):
+        path = self.path(name)
+        mtime = os.stat(path).st_mtime_ns
+        cached = self._open.get(name)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        archive = zipfile.ZipFile(path)
+        self._open.set(name, (mtime, archive))
+        return archive
+
+    def get(self, name, content_hash):
+        """Bytes of a frame in the day archive `name`, or None."""
+        with self._lock:
+            try:
+                return self._zip(name).read(f"{content_hash}.jpg")
+            except (FileNotFoundError, KeyError):
+                return None
+            except (OSError, zipfile.BadZipFile) as e:
+                logger.error(f"Error reading frame {content_hash} from archive {name}: {e}")
+                return None
+
+    def write(self, name, frames):
+        """
+        Add `frames` ({content_hash: image bytes}) to the day archive `name`,
+        keeping the frames it already holds. The new archive is written next to
+        the old one, fsynced and swapped in, so readers never see a partial file.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(name)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                # Stored, not deflated: JPEG does not compress any further
+                with zipfile.ZipFile(f, 'w', zipfile.ZIP_STORED) as archive:
+                    if os.path.exists(path):
+                        with zipfile.ZipFile(path) as existing:
+                            for info in existing.infolist():
+                                if info.filename.removesuffix('.jpg') not in frames:
+                                    archive.writestr(info, existing.read(info))
+                    for content_hash, data in frames.items():
+                        archive.writestr(f"{content_hash}.jpg", data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        _fsync_directory(self.directory)
+
+    def delete_before(self, name):
+        """Delete the archives of days before the day `name`; returns (files, bytes)."""
+        files = size = 0
+        try:
+            with os.scandir(self.directory) as it:
+                entries = [entry for entry in it if entry.name.endswith('.zip') and entry.name[:-len('.zip')] < name]
+        except FileNotFoundError:
+            return 0, 0
+        for entry in entries:
+            try:
+                entry_size = entry.stat().st_size
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            with self._lock:
+                self._open.pop(entry.name[:-len('.zip')])
+            files += 1
+            size += entry_size
+        return files, size
+
+
+_store = None
+_archive = None
+_store_lock = threading.Lock()
+
+
+def get_frame_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                backend = import_string(FRAME_STORE_BACKEND)
+                _store = backend()
+    return _store
+
+
+def get_frame_archive():
+    global _archive
+    if _archive is None:
+        with _store_lock:
+            if _archive is None:
+                _archive = FrameArchive()
+    return _archive
+
+
+def resolve_frame(content_hash, data, archive=None):
+    """
+    Image bytes of a visionmon_binary_data row: from its day archive once the
+    frame is in the cold tier, from the store when the row has a content hash,
+    otherwise from its (not yet moved) data column.
+    """
+    if content_hash and archive:
+        frame = get_frame_archive().get(archive, content_hash)
+        if frame is not None:
+            return frame
+        logger.error(f"Frame {content_hash} is missing from archive {archive}")
+    if content_hash:
+        frame = get_frame_store().get(content_hash)
+        if frame is not None:
+            return frame
+        logger.error(f"Frame {content_hash} is missing from the frame store")
+    return bytes(data) if data is not None else None
+
+
+# Rows still holding their image, oldest first, with the camera and time of their
+# metadata row. The partial index from migration 0007 only covers these rows, so
+# finding them does not scan moved rows. Frames are stored just before their
+# metadata; a frame without metadata is left for the next run unless it is old
+# enough that its metadata is not coming.
+PENDING_FRAMES_QUERY = """
+    SELECT vb.id, vb.data, vm.camera_id, vm.timestamp, vm.id
+    FROM visionmon_binary_data vb
+    LEFT JOIN LATERAL (
+        SELECT m.camera_id, m.timestamp, m.id
+        FROM visionmon_metadata m
+        WHERE m.data_id = vb.id
+        ORDER BY m.id
+        LIMIT 1
+    ) vm ON true
+    WHERE vb.content_hash IS NULL AND vb.data IS NOT NULL AND vb.id > %s
+      AND (vm.id IS NOT NULL OR vb.created_at < now() - interval '5 minutes')
+    ORDER BY vb.id
+    LIMIT %s
+"""
+
+# Stored frame of the camera's previous metadata row, to compare a new frame with
+PREVIOUS_FRAME_QUERY = """
+    SELECT vb.phash, vb.content_hash
+    FROM visionmon_metadata vm
+    JOIN visionmon_binary_data vb ON vb.id = vm.data_id
+    WHERE vm.camera_id = %s AND (vm.timestamp, vm.id) < (%s, %s)
+    ORDER BY vm.timestamp DESC, vm.id DESC
+    LIMIT 1
+"""
+
+MARK_FRAMES_MOVED = """
+    UPDATE visionmon_binary_data vb
+    SET content_hash = moved.content_hash, phash = moved.phash, data = NULL
+    FROM unnest(%s::integer[], %s::text[], %s::bigint[]) AS moved(id, content_hash, phash)
+    WHERE vb.id = moved.id AND vb.content_hash IS NULL
+"""
+
+PENDING_FRAMES_SUMMARY = """
+    SELECT count(*), coalesce(sum(octet_length(data)), 0)
+    FROM visionmon_binary_data
+    WHERE content_hash IS NULL AND data IS NOT NULL
+"""
+
+# Hashes that frames still in the store (not archived) refer to
+REFERENCED_HASHES_QUERY = """
+    SELECT DISTINCT content_hash FROM visionmon_binary_data WHERE content_hash = ANY(%s) AND archive IS NULL
+"""
+
+
+def pending_frames():
+    """(rows, bytes) of frames still stored in Postgres."""
+    with db_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(PENDING_FRAMES_SUMMARY)
+        return cursor.fetchone()
+
+
+def move_frames_to_store(batch_size=FRAME_MIGRATION_BATCH_SIZE, sleep=FRAME_MIGRATION_SLEEP,
+                         max_runtime=FRAME_MIGRATION_MAX_RUNTIME, dedup_threshold=FRAME_DEDUP_THRESHOLD, store=None):
+    """
+    Move images from visionmon_binary_data.data into the frame store in batches
+    of `batch_size`, sleeping `sleep` seconds between batches and stopping after
+    `max_runtime` seconds. Each batch writes its files before the transaction
+    that records their hashes and clears the column commits, so an interrupted
+    run leaves at most unreferenced files behind.
+
+    A frame within `dedup_threshold` bits of its camera's previous stored frame
+    (perceptual_hash) is recorded as that frame instead of being stored; -1 only
+    shares byte-identical frames. Returns rows, bytes, deduplicated, seconds,
+    rows_per_sec and finished.
+    """
+    store = store or get_frame_store()
+    stats = {'rows': 0, 'bytes': 0, 'deduplicated': 0, 'seconds': 0.0, 'finished': False}
+    started = time.monotonic()
+    deadline = started + max_runtime
+    last_id = 0
+    previous_frames = {}  # camera_id -> (phash, content_hash) of its latest stored frame
+
+    with db_connection() as conn:
+        while time.monotonic() < deadline:
+            with conn.cursor() as cursor:
+                cursor.execute(PENDING_FRAMES_QUERY, (last_id, batch_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    conn.commit()
+                    stats['finished'] = True
+                    break
+                ids, hashes, phashes = [], [], []
+                for data_id, data, camera_id, timestamp, metadata_id in rows:
+                    data = bytes(data)
+                    phash = perceptual_hash(data)
+                    previous = None
+                    if camera_id is not None and dedup_threshold >= 0 and phash is not None:
+                        if camera_id not in previous_frames:
+                            cursor.execute(PREVIOUS_FRAME_QUERY, (camera_id, timestamp, metadata_id))
+                            previous_frames[camera_id] = cursor.fetchone()
+                        previous = previous_frames[camera_id]
+                    if (previous and previous[0] is not None and previous[1]
+                            and hamming_distance(phash, previous[0]) <= dedup_threshold
+                            and store.touch(previous[1])):
+                        # Comparing later frames with the shared frame's hash, not their
+                        # own, keeps a slowly changing scene from drifting away from it.
+                        phash, content_hash = previous
+                        stats['deduplicated'] += 1
+                    else:
+                        content_hash = store.put(data)
+                    if camera_id is not None:
+                        previous_frames[camera_id] = (phash, content_hash)
+                    ids.append(data_id)
+                    hashes.append(content_hash)
+                    phashes.append(phash)
+                    stats['bytes'] += len(data)
+                cursor.execute(MARK_FRAMES_MOVED, (ids, hashes, phashes))
+                stats['rows'] += cursor.rowcount
+            conn.commit()
+            last_id = ids[-1]
+            if len(rows) < batch_size:
+                stats['finished'] = True
+                break
+            if sleep:
+                time.sleep(sleep)
+
+    stats['seconds'] = time.monotonic() - started
+    stats['rows_per_sec'] = stats['rows'] / stats['seconds'] if stats['seconds'] else 0.0
+    return stats
+
+
+# Frames moved before perceptual hashes were recorded
+UNHASHED_FRAMES_QUERY = """
+    SELECT id, content_hash
+    FROM visionmon_binary_data
+    WHERE content_hash IS NOT NULL AND phash IS NULL AND id > %s
+    ORDER BY id
+    LIMIT %s
+"""
+
+SET_FRAME_PHASHES = """
+    UPDATE visionmon_binary_data vb
+    SET phash = hashed.phash
+    FROM unnest(%s::integer[], %s::bigint[]) AS hashed(id, phash)
+    WHERE vb.id = hashed.id
+"""
+
+
+def backfill_perceptual_hashes(batch_size=FRAME_MIGRATION_BATCH_SIZE, max_runtime=FRAME_MIGRATION_MAX_RUNTIME, store=None):
+    """
+    Record the perceptual hash of frames that were moved to the store without
+    one, so new frames can be compared with them. Returns rows, seconds and finished.
+    """
+    store = store or get_frame_store()
+    stats = {'rows': 0, 'seconds': 0.0, 'finished': False}
+    started = time.monotonic()
+    deadline = started + max_runtime
+    last_id = 0
+    hashed = {}  # content_hash -> phash; shared frames are decoded once
+
+    with db_connection() as conn:
+        while time.monotonic() < deadline:
+            with conn.cursor() as cursor:
+                cursor.execute(UNHASHED_FRAMES_QUERY, (last_id, batch_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    conn.commit()
+                    stats['finished'] = True
+                    break
+                ids, phashes = [], []
+                for data_id, content_hash in rows:
+                    if content_hash not in hashed:
+                        data = store.get(content_hash)
+                        hashed[content_hash] = perceptual_hash(data) if data else None
+                    if hashed[content_hash] is not None:
+                        ids.append(data_id)
+                        phashes.append(hashed[content_hash])
+                cursor.execute(SET_FRAME_PHASHES, (ids, phashes))
+                stats['rows'] += cursor.rowcount
+            conn.commit()
+            last_id = rows[-1][0]
+
+    stats['seconds'] = time.monotonic() - started
+    return stats
+
+
+def collect_frame_garbage(retention_days=RETENTION_DAYS, batch_size=1000, store=None):
+    """
+    Delete stored frames no row references any more (archived rows use their
+    day archive), and day archives past retention. Only files not written or
+    re-stored for longer than `retention_days` are considered, so frames that a
+    running migration batch or a newer identical frame still needs are kept.
+    Returns rows (files), bytes, seconds, rows_per_sec and finished.
+    """
+    store = store or get_frame_store()
+    stats = {'rows': 0, 'bytes': 0, 'seconds': 0.0, 'finished': True}
+    started = time.monotonic()
+    cutoff = time.time() - retention_days * 86400
+
+    def collect(candidates):
+        with db_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(REFERENCED_HASHES_QUERY, (list(candidates),))
+            referenced = {row[0] for row in cursor.fetchall()}
+        for content_hash, size in candidates.items():
+            # An identical frame may have re-stored the file and committed its row
+            # since the query; older_than keeps the file then
+            if content_hash not in referenced and store.delete(content_hash, older_than=cutoff):
+                stats['rows'] += 1
+                stats['bytes'] += size
+
+    candidates = {}
+    for content_hash, size in store.iter_older_than(cutoff):
+        candidates[content_hash] = size
+        if len(candidates) >= batch_size:
+            collect(candidates)
+            candidates = {}
+    if candidates:
+        collect(candidates)
+
+    # Day archives past retention; their rows are gone with their partitions
+    expired_day = (datetime.now(timezone.utc) - timedelta(days=retention_days)).date().isoformat()
+    files, size = get_frame_archive().delete_before(expired_day)
+    stats['rows'] += files
+    stats['bytes'] += size
+
+    stats['seconds'] = time.monotonic() - started
+    stats['rows_per_sec'] = stats['rows'] / stats['seconds'] if stats['seconds'] else 0.0
+    return stats
+
+
+# Oldest day with frames still in the store, found on the partial index from migration 0009
+OLDEST_HOT_FRAME_QUERY = """
+    SELECT min(created_at) FROM visionmon_binary_data
+    WHERE content_hash IS NOT NULL AND archive IS NULL AND created_at >= %s AND created_at < %s
+"""
+
+HOT_FRAMES_OF_DAY_QUERY = """
+    SELECT DISTINCT content_hash FROM visionmon_binary_data
+    WHERE content_hash IS NOT NULL AND archive IS NULL AND created_at >= %s AND created_at < %s
+"""
+
+# Another day's archive holding a frame whose file has already left the store
+ARCHIVED_COPY_QUERY = """
+    SELECT archive FROM visionmon_binary_data
+    WHERE content_hash = %s AND archive IS NOT NULL
+    LIMIT 1
+"""
+
+MARK_FRAMES_ARCHIVED = """
+    UPDATE visionmon_binary_data
+    SET archive = %s
+    WHERE content_hash = ANY(%s) AND archive IS NULL AND created_at >= %s AND created_at < %s
+"""
+
+
+def archive_cold_frames(cold_after_days=FRAME_COLD_AFTER_DAYS, max_runtime=FRAME_MIGRATION_MAX_RUNTIME,
+                        store=None, archive=None):
+    """
+    Move the frames of every whole (UTC) day older than `cold_after_days` from
+    the store into that day's archive, scaled down to FRAME_COLD_MAX_WIDTH and
+    recompressed at FRAME_COLD_QUALITY. Days are archived oldest first, one per
+    transaction, until `max_runtime` seconds have passed. The archive is written
+    before the rows point to it, and a file is only deleted from the store once
+    no frame still in the store refers to it. Rows from before partitioning
+    (created_at -infinity) belong to no day and stay in the store until
+    retention removes them.
+
+    Returns rows (frames archived), bytes (freed in the store), archive_bytes,
+    days, seconds, rows_per_sec and finished.
+    """
+    stats = {'rows': 0, 'bytes': 0, 'archive_bytes': 0, 'days': 0, 'seconds': 0.0, 'finished': False}
+    if cold_after_days <= 0:
+        stats['finished'] = True
+        stats['rows_per_sec'] = 0.0
+        return stats
+    store = store or get_frame_store()
+    archive = archive or get_frame_archive()
+    started = time.monotonic()
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=cold_after_days)).replace(hour=0, minute=0, second=0, microsecond=0)
+    day_start = datetime.min.replace(tzinfo=timezone.utc)
+
+    with db_connection() as conn:
+        while time.monotonic() - started < max_runtime:
+            with conn.cursor() as cursor:
+                # Days only ever move forward, so frames that cannot be archived are not retried forever
+                cursor.execute(OLDEST_HOT_FRAME_QUERY, (day_start, cutoff))
+                oldest = cursor.fetchone()[0]
+                if oldest is None:
+                    conn.commit()
+                    stats['finished'] = True
+                    break
+                day_start = oldest.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+                day_end = day_start + timedelta(days=1)
+                name = day_start.date().isoformat()
+
+                cursor.execute(HOT_FRAMES_OF_DAY_QUERY, (day_start, day_end))
+                hashes = [row[0] for row in cursor.fetchall()]
+                frames, stored_sizes = {}, {}
+                for content_hash in hashes:
+                    data = store.get(content_hash)
+                    if data is None:
+                        # Shared with an earlier day whose archiving already freed the file
+                        cursor.execute(ARCHIVED_COPY_QUERY, (content_hash,))
+                        row = cursor.fetchone()
+                        data = archive.get(row[0], content_hash) if row else None
+                        if data is None:
+                            logger.error(f"Frame {content_hash} is missing from the frame store and the archives")
+                        else:
+                            frames[content_hash] = data
+                        continue
+                    stored_sizes[content_hash] = len(data)
+                    try:
+                        frames[content_hash] = encode_variant(data, FRAME_COLD_MAX_WIDTH, FRAME_COLD_QUALITY)
+                    except (OSError, ValueError, Image.DecompressionBombError) as e:
+                        logger.error(f"Error recompressing frame {content_hash}, archiving it as is: {e}")
+                        frames[content_hash] = data
+                if frames:
+                    archive.write(name, frames)
+                    stats['archive_bytes'] += sum(len(data) for data in frames.values())
+                cursor.execute(MARK_FRAMES_ARCHIVED, (name, hashes, day_start, day_end))
+                stats['rows'] += cursor.rowcount
+                conn.commit()
+
+                cursor.execute(REFERENCED_HASHES_QUERY, (list(stored_sizes),))
+                still_needed = {row[0] for row in cursor.fetchall()}
+            conn.commit()
+            grace = time.time() - STORE_GRACE_SECONDS
+            for content_hash, size in stored_sizes.items():
+                if content_hash not in still_needed and store.delete(content_hash, older_than=grace):
+                    stats['bytes'] += size
+            stats['days'] += 1
+            day_start = day_end
+
+    stats['seconds'] = time.monotonic() - started
+    stats['rows_per_sec'] = stats['rows'] / stats['seconds'] if stats['seconds'] else 0.0
+    return stats
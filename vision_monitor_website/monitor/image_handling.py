@@ -1,93 +1,272 @@
 import logging
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, HttpResponseNotModified, Http404
+from django.utils.cache import quote_etag
+from django.utils.http import http_date, parse_etags
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
 import redis
-import base64
-from .db_operations import get_db_connection, get_frame_image_from_db
+from .db_operations import get_frame_image_from_db, fetch_frame_ref, fetch_frame_created_at
+from .frame_store import get_frame_store, resolve_frame
+from .frame_cache import get_latest_frame_cache
+from .thumbnails import parse_variant, get_thumbnail_service, negotiate_format, NEGOTIATED_FORMATS
+from .mosaic import get_mosaic_service, MOSAIC_FORMATS
+from .config import FRAME_IMAGE_MAX_AGE, FRAME_STORE_ACCEL_PREFIX
 
 logger = logging.getLogger(__name__)
 
 redis_client = redis.Redis(host='192.168.0.71', port=6379)
 
+FRAME_IMAGE_CACHE_CONTROL = f'public, max-age={FRAME_IMAGE_MAX_AGE}, immutable'
+
+def _variant(request):
+    """
+    Resized variant requested with ?w=/?q=, in the format negotiated from the
+    Accept header, parsed once per request (None for the original).
+    """
+    if not hasattr(request, '_image_variant'):
+        try:
+            request._image_variant = parse_variant(request.GET, request.headers.get('Accept', ''))
+            request._image_variant_error = None
+        except ValueError as e:
+            request._image_variant = None
+            request._image_variant_error = str(e)
+    return request._image_variant
+
+def _variant_suffix(request):
+    variant = _variant(request)
+    return f"-{variant.tag}" if variant else ""
+
+def _latest_frame_version(request, camera_index):
+    """
+    (data_id, timestamp) of the camera's newest frame, looked up once per request
+    and camera: notify() passes one request for several cameras.
+    """
+    if not hasattr(request, '_latest_frame_versions'):
+        request._latest_frame_versions = {}
+    if camera_index not in request._latest_frame_versions:
+        try:
+            version = get_latest_frame_cache().peek(camera_index)
+        except Exception as e:
+            logger.error(f"Error retrieving latest image version: {str(e)}")
+            version = None
+        request._latest_frame_versions[camera_index] = version
+    return request._latest_frame_versions[camera_index]
+
+def latest_image_etag_for(camera_index, data_id, timestamp):
+    return f"latest-{camera_index}-{data_id}-{timestamp.timestamp() if timestamp else 0:.6f}"
+
+def latest_image_etag(request, camera_index):
+    version = _latest_frame_version(request, camera_index)
+    if version is None:
+        return None
+    data_id, timestamp = version
+    return latest_image_etag_for(camera_index, data_id, timestamp) + _variant_suffix(request)
+
+def latest_image_last_modified(request, camera_index):
+    version = _latest_frame_version(request, camera_index)
+    return version[1] if version else None
+
+# Conditional requests are answered from the frame's id and timestamp alone, so an
+# unchanged image costs a 304 without the image being read from Redis or Postgres.
+# Clients accepting WebP or AVIF get the frame transcoded once and cached.
+@vary_on_headers('Accept')
+@condition(etag_func=latest_image_etag, last_modified_func=latest_image_last_modified)
 def get_latest_image(request, camera_index):
-    conn = get_db_connection()
-    if not conn:
-        raise Http404("Database connection failed")
+    # Served from the shared latest-frame cache; Postgres is only read on a cache miss
+    variant = _variant(request)
+    if request._image_variant_error:
+        return HttpResponse(request._image_variant_error, status=400)
+    if _latest_frame_version(request, camera_index) is None:
+        raise Http404("Image not found")
     try:
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT vb.data, vm.timestamp
-                FROM visionmon_metadata vm
-                JOIN visionmon_binary_data vb ON vm.data_id = vb.id
-                WHERE vm.camera_index = %s
-                ORDER BY vm.timestamp DESC
-                LIMIT 1
-            """, [camera_index])
-            result = cursor.fetchone()
-            if result:
-                image_data, timestamp = result
-                response = HttpResponse(image_data, content_type='image/jpeg')
-                
-                response['Cache-Control'] = 'no-store, must-revalidate'
-                response['Pragma'] = 'no-cache'
-                response['Expires'] = '0'
-                
-                response['X-Image-Timestamp'] = timestamp.isoformat()
-                
-                return response
-            else:
-                raise Http404("Image not found")
+        frame = get_latest_frame_cache().get(camera_index)
     except Exception as e:
         logger.error(f"Error retrieving latest image: {str(e)}")
         raise Http404("Error retrieving image")
-    finally:
-        conn.close()
-        
+    if frame is None:
+        raise Http404("Image not found")
+
+    image_data = frame.data
+    if variant:
+        image_data = get_thumbnail_service().get(frame.data_id, variant, lambda: frame.data)
+        if image_data is None:
+            raise Http404("Image not found")
+
+    response = HttpResponse(image_data, content_type=variant.content_type if variant else 'image/jpeg')
+    # Let browsers keep the image but revalidate it on every use
+    response['Cache-Control'] = 'no-cache'
+    if frame.timestamp:
+        response['X-Image-Timestamp'] = frame.timestamp.isoformat()
+    # The frame may have changed since the validators were computed; describe the one sent
+    response['ETag'] = quote_etag(latest_image_etag_for(camera_index, frame.data_id, frame.timestamp) + _variant_suffix(request))
+    if frame.timestamp:
+        response['Last-Modified'] = http_date(frame.timestamp.timestamp())
+
+    return response
+
 def get_latest_image_non_web(camera_index):
-    conn = get_db_connection()
-    if not conn:
-        logger.error("Database connection failed")
     try:
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT vb.data, vm.timestamp
-                FROM visionmon_metadata vm
-                JOIN visionmon_binary_data vb ON vm.data_id = vb.id
-                WHERE vm.camera_index = %s
-                ORDER BY vm.timestamp DESC
-                LIMIT 1
-            """, [camera_index])
-            result = cursor.fetchone()
-            if result:
-                image_data, timestamp = result
-                return image_data, timestamp
-            else:
-                logger.error("Image not found")
+        frame = get_latest_frame_cache().get(camera_index)
+        if frame:
+            return frame.data, frame.timestamp
+        else:
+            logger.error("Image not found")
     except Exception as e:
         logger.error(f"Error retrieving latest image: {str(e)}")
-    finally:
-        conn.close()
 
+# Composites are written to Redis by the analysis pipeline as composite_<camera>.
+# Their SHA-1, computed inside Redis, is the ETag: a client holding the current
+# composite gets a 304 without the image leaving Redis, in a single round trip.
+# Variants (resized, or WebP/AVIF for clients accepting them) are cached by that
+# SHA-1 and tagged with the variant, e.g. "<sha1>-q80-webp".
+COMPOSITE_KEY = 'composite_{camera}'
+
+COMPOSITE_SCRIPT = redis_client.register_script("""
+local data = redis.call('GET', KEYS[1])
+if not data then
+    return nil
+end
+local digest = redis.sha1hex(data)
+for _, etag in ipairs(ARGV) do
+    if etag == digest then
+        return {digest}
+    end
+end
+return {digest, data}
+""")
+
+@vary_on_headers('Accept')
 def get_composite_image(request, camera_name):
-    composite_key = f'composite_{camera_name}'
-    composite_data = redis_client.get(composite_key)
-    if composite_data:
-        return HttpResponse(composite_data, content_type='image/png')
-    else:
+    variant = _variant(request)
+    if request._image_variant_error:
+        return HttpResponse(request._image_variant_error, status=400)
+    suffix = _variant_suffix(request)
+    client_etags = [etag.removeprefix('W/').strip('"') for etag in parse_etags(request.headers.get('If-None-Match', ''))]
+    # Only a validator of this variant can match; the script compares bare digests
+    client_etags = [etag[:len(etag) - len(suffix)] for etag in client_etags if etag.endswith(suffix)]
+    try:
+        result = COMPOSITE_SCRIPT(keys=[COMPOSITE_KEY.format(camera=camera_name)], args=client_etags)
+    except redis.RedisError as e:
+        logger.error(f"Error retrieving composite image: {str(e)}")
+        raise Http404("Error retrieving image")
+    if not result:
         return HttpResponse(status=404)
 
-def get_composite_images(latest_frame_analyses):
-    composite_images = {}
-    for analysis in latest_frame_analyses:
-        camera_id = analysis[0]
-        composite_key = f'composite_{camera_id}'
-        composite_data = redis_client.get(composite_key)
-        if composite_data:
-            composite_images[camera_id] = base64.b64encode(composite_data).decode('utf-8')
-    return composite_images
+    digest = result[0].decode('ascii')
+    if len(result) == 1:
+        response = HttpResponseNotModified()
+    elif variant:
+        image_data = get_thumbnail_service().get(f"composite-{digest}", variant, lambda: result[1])
+        if image_data is None:
+            raise Http404("Image not found")
+        response = HttpResponse(image_data, content_type=variant.content_type)
+    else:
+        response = HttpResponse(result[1], content_type='image/png')
+    response['ETag'] = quote_etag(digest + suffix)
+    # Composites change in place, so browsers keep them but revalidate on every use
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+def get_composite_urls(camera_names):
+    """/get_composite_image/ URL of each camera that has a composite, checked in one pipelined round trip."""
+    try:
+        pipeline = redis_client.pipeline(transaction=False)
+        for camera_name in camera_names:
+            pipeline.exists(COMPOSITE_KEY.format(camera=camera_name))
+        exists = pipeline.execute()
+    except redis.RedisError as e:
+        logger.error(f"Error checking composite images: {str(e)}")
+        return {}
+    return {
+        camera_name: f'/get_composite_image/{camera_name}/'
+        for camera_name, found in zip(camera_names, exists) if found
+    }
+
+def frame_image_etag(request, data_id):
+    return f"frame-{data_id}{_variant_suffix(request)}"
 
+def frame_image_last_modified(request, data_id):
+    # If-Modified-Since is ignored next to If-None-Match, so the lookup is skipped then
+    if request.headers.get('If-None-Match'):
+        return None
+    _variant(request)
+    if request._image_variant_error:
+        return None
+    # None for a missing frame, so the view answers it with a 404 rather than a 304
+    return fetch_frame_created_at(data_id)
+
+# A stored frame never changes, so its id is a strong validator: a revalidation is
+# answered with a 304 without reading the blob, and browsers and nginx may keep the
+# image for FRAME_IMAGE_MAX_AGE without asking again. If-Modified-Since alone is
+# answered from the frame's creation time.
+@vary_on_headers('Accept')
+@condition(etag_func=frame_image_etag, last_modified_func=frame_image_last_modified)
 def get_frame_image(request, data_id):
-    image_data = get_frame_image_from_db(data_id)
+    variant = _variant(request)
+    if request._image_variant_error:
+        return HttpResponse(request._image_variant_error, status=400)
+    if variant:
+        # The original is only read from the database if this variant is not cached yet
+        image_data = get_thumbnail_service().get(data_id, variant, lambda: get_frame_image_from_db(data_id))
+    else:
+        ref = fetch_frame_ref(data_id)
+        if ref is None:
+            return HttpResponse(status=404)
+        content_hash, data, archive = ref
+        # Archived frames are read out of their day archive here; nginx cannot reach into it
+        accel_path = get_frame_store().accel_path(content_hash) if content_hash and not archive and FRAME_STORE_ACCEL_PREFIX else None
+        if accel_path:
+            # nginx sends the file itself (sendfile); the image never passes through Django
+            response = HttpResponse(content_type='image/jpeg')
+            response['X-Accel-Redirect'] = FRAME_STORE_ACCEL_PREFIX + accel_path
+            response['Cache-Control'] = FRAME_IMAGE_CACHE_CONTROL
+            return response
+        image_data = resolve_frame(content_hash, data, archive)
     if image_data:
-        return HttpResponse(image_data, content_type='image/jpeg')
+        response = HttpResponse(image_data, content_type=variant.content_type if variant else 'image/jpeg')
+        response['Cache-Control'] = FRAME_IMAGE_CACHE_CONTROL
+        return response
     else:
-        return HttpResponse(status=404)
\ No newline at end of file
+        return HttpResponse(status=404)
+
+# Mosaic formats offered to clients that did not pick one with ?format=
+MOSAIC_NEGOTIATED_FORMATS = tuple(image_format for image_format in NEGOTIATED_FORMATS if image_format in MOSAIC_FORMATS)
+
+def _mosaic_format(request):
+    if 'format' in request.GET:
+        return request.GET['format'].lower()
+    return negotiate_format(request.headers.get('Accept', ''), MOSAIC_NEGOTIATED_FORMATS)
+
+def _mosaic_version(request):
+    """Version of the current mosaic, looked up once per request from the frame ids alone."""
+    if not hasattr(request, '_mosaic_version'):
+        try:
+            request._mosaic_version = get_mosaic_service().current_version()
+        except Exception as e:
+            logger.error(f"Error retrieving mosaic version: {str(e)}")
+            request._mosaic_version = None
+    return request._mosaic_version
+
+def mosaic_etag(request):
+    version = _mosaic_version(request)
+    return f"mosaic-{version}-{_mosaic_format(request)}" if version else None
+
+# A grid of every camera's latest frame in one response. Unchanged frames mean an
+# unchanged ETag, answered with a 304 before anything is composed or read.
+@vary_on_headers('Accept')
+@condition(etag_func=mosaic_etag)
+def get_mosaic(request):
+    image_format = _mosaic_format(request)
+    if image_format not in MOSAIC_FORMATS:
+        return HttpResponse(f"Unsupported format: {image_format}", status=400)
+    try:
+        version, data = get_mosaic_service().get(image_format, _mosaic_version(request))
+    except Exception as e:
+        logger.error(f"Error composing mosaic: {str(e)}")
+        raise Http404("Error composing mosaic")
+
+    response = HttpResponse(data, content_type=MOSAIC_FORMATS[image_format][1])
+    response['Cache-Control'] = 'no-cache'
+    # Frames may have changed since the ETag was computed; describe the mosaic sent
+    response['ETag'] = quote_etag(f"mosaic-{version}-{image_format}")
+    return response
@@ -0,0 +1,409 @@
+# monitor/instrumentation.py
+import contextvars
+import functools
+import inspect
+import logging
+import threading
+import time
+from collections import deque
+
+import psycopg2.extensions
+
+from .config import SLOW_QUERY_MS, SLOW_QUERY_LOG_SIZE, SLOW_QUERY_LOG_PARAMS
+
+logger = logging.getLogger(__name__)
+# A separate logger so slow queries can be routed to their own handler or file.
+slow_query_logger = logging.getLogger('monitor.slow_queries')
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is +Inf.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Longest SQL text / parameter repr kept in slow-query records.
+MAX_SQL_LENGTH = 2000
+MAX_PARAM_LENGTH = 200
+
+# The operation (instrumented function call) running in the current thread or task.
+_current_operation = contextvars.ContextVar('current_db_operation', default=None)
+
+
+class OperationStats:
+    """Latency histogram and row/byte/error counters for one instrumented function."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+
+    def observe(self, seconds, rows, size, error):
+        index = 0
+        while index < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[index]:
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.errors += error
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.rows += rows
+        self.bytes += size
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (max_seconds for the +Inf bucket)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max_seconds
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'total_seconds': self.total_seconds,
+            'mean_seconds': self.total_seconds / self.count if self.count else 0.0,
+            'max_seconds': self.max_seconds,
+            'p50_seconds': self.quantile(0.5),
+            'p95_seconds': self.quantile(0.95),
+            'p99_seconds': self.quantile(0.99),
+            'rows': self.rows,
+            'bytes': self.bytes,
+            # cumulative, as in a Prometheus histogram
+            'buckets': {
+                str(bound): sum(self.buckets[:index + 1])
+                for index, bound in enumerate(LATENCY_BUCKETS + ('+Inf',))
+            },
+        }
+
+
+class QueryMetrics:
+    """Per-process registry of OperationStats plus a ring buffer of recent slow queries."""
+
+    def __init__(self, slow_query_ms=SLOW_QUERY_MS, slow_log_size=SLOW_QUERY_LOG_SIZE):
+        self.slow_query_seconds = slow_query_ms / 1000
+        self._lock = threading.Lock()
+        self._operations = {}
+        self._slow_queries = deque(maxlen=slow_log_size)
+
+    def observe(self, name, seconds, rows=0, size=0, error=False):
+        with self._lock:
+            stats = self._operations.get(name)
+            if stats is None:
+                stats = self._operations[name] = OperationStats()
+            stats.observe(seconds, rows, size, error)
+
+    def record_slow(self, record):
+        with self._lock:
+            self._slow_queries.append(record)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'operations': {name: stats.as_dict() for name, stats in sorted(self._operations.items())},
+                'slow_queries': list(self._slow_queries),
+                'slow_query_threshold_ms': self.slow_query_seconds * 1000,
+            }
+
+    def reset(self):
+        with self._lock:
+            self._operations.clear()
+            self._slow_queries.clear()
+
+
+query_metrics = QueryMetrics()
+
+
+def _payload_size(row):
+    """Bytes of the text and binary values in a result row (numbers and timestamps are not counted)."""
+    size = 0
+    for value in row:
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            size += len(value)
+        elif isinstance(value, str):
+            size += len(value)
+    return size
+
+
+def _format_param(value, redact):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} bytes>"
+    if redact:
+        # Values may be camera ids, state messages or other data; only the type is kept
+        return f"<{type(value).__name__}>"
+    text = repr(value)
+    return text if len(text) <= MAX_PARAM_LENGTH else text[:MAX_PARAM_LENGTH] + '...'
+
+
+def format_params(params, redact=not SLOW_QUERY_LOG_PARAMS):
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: _format_param(value, redact) for key, value in params.items()}
+    return [_format_param(value, redact) for value in params]
+
+
+def format_sql(sql):
+    sql = sql.decode('utf-8', 'replace') if isinstance(sql, bytes) else str(sql)
+    sql = ' '.join(sql.split())
+    return sql if len(sql) <= MAX_SQL_LENGTH else sql[:MAX_SQL_LENGTH] + '...'
+
+
+class _Operation:
+    """Statements, rows and bytes accumulated by one call of an instrumented function."""
+
+    __slots__ = ('name', 'seconds', 'rows', 'bytes', 'error', 'statements')
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.error = False
+        self.statements = []
+
+
+class InstrumentedCursorMixin:
+    """
+    Times execute() and the fetches that follow it, and attributes the time,
+    rows and payload bytes to the running instrumented operation, if any.
+    Slow statements outside an operation are logged on their own.
+    """
+
+    _statement = None
+
+    def _begin(self, sql, params):
+        # Raw SQL and parameters; they are only formatted if the statement turns out to be slow
+        self._statement = {'sql': sql, 'params': params, 'seconds': 0.0, 'rows': 0, 'error': None}
+        operation = _current_operation.get()
+        if operation is not None:
+            operation.statements.append(self._statement)
+
+    def _account(self, seconds, rows=0, size=0):
+        statement = self._statement
+        if statement is not None:
+            statement['seconds'] += seconds
+            statement['rows'] += rows
+        operation = _current_operation.get()
+        if operation is not None:
+            operation.rows += rows
+            operation.bytes += size
+        elif statement is not None and seconds >= query_metrics.slow_query_seconds:
+            _log_slow_statement(statement)
+
+    def execute(self, query, vars=None):
+        self._begin(query, vars)
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        except Exception as e:
+            self._statement['error'] = str(e).strip()
+            operation = _current_operation.get()
+            if operation is not None:
+                operation.error = True
+            raise
+        finally:
+            self._account(time.perf_counter() - start)
+
+    def executemany(self, query, vars_list):
+        self._begin(query, None)
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            self._account(time.perf_counter() - start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._account(time.perf_counter() - start, 1 if row is not None else 0,
+                      _payload_size(row) if row is not None else 0)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(size) if size is not None else super().fetchmany()
+        self._account(time.perf_counter() - start, len(rows), sum(_payload_size(row) for row in rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._account(time.perf_counter() - start, len(rows), sum(_payload_size(row) for row in rows))
+        return rows
+
+
+_instrumented_cursor_classes = {}
+
+
+def instrumented_cursor_class(cursor_class):
+    cls = _instrumented_cursor_classes.get(cursor_class)
+    if cls is None:
+        cls = type(f'Instrumented{cursor_class.__name__}', (InstrumentedCursorMixin, cursor_class), {})
+        _instrumented_cursor_classes[cursor_class] = cls
+    return cls
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """Connection whose cursors, whatever their cursor_factory (e.g. DictCursor), are instrumented."""
+
+    def cursor(self, *args, **kwargs):
+        cursor_factory = kwargs.pop('cursor_factory', None) or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = instrumented_cursor_class(cursor_factory)
+        return super().cursor(*args, **kwargs)
+
+
+def _log_slow_statement(statement, operation=None):
+    record = dict(statement, sql=format_sql(statement['sql']), params=format_params(statement['params']),
+                  operation=operation, at=time.time())
+    query_metrics.record_slow(record)
+    slow_query_logger.warning(
+        f"Slow query ({record['seconds'] * 1000:.1f} ms, {record['rows']} rows"
+        f"{', in ' + operation if operation else ''}): {record['sql']} -- params: {record['params']}"
+    )
+
+
+def _finish(operation, seconds, result=None, count_result=False):
+    operation.seconds = seconds
+    if count_result and not operation.statements and hasattr(result, '__len__'):
+        # asyncpg queries do not go through psycopg2 cursors; count what came back
+        operation.rows = len(result)
+    query_metrics.observe(operation.name, operation.seconds, operation.rows, operation.bytes, operation.error)
+    if operation.seconds < query_metrics.slow_query_seconds:
+        return
+    slow = [statement for statement in operation.statements
+            if statement['seconds'] >= query_metrics.slow_query_seconds]
+    for statement in slow:
+        _log_slow_statement(statement, operation.name)
+    if not slow:
+        # Slow overall without a single slow statement: many small queries, or time spent in Python
+        query_metrics.record_slow({
+            'operation': operation.name, 'sql': None, 'params': None, 'seconds': operation.seconds,
+            'rows': operation.rows, 'error': None, 'statements': len(operation.statements), 'at': time.time(),
+        })
+        slow_query_logger.warning(
+            f"Slow operation {operation.name} ({operation.seconds * 1000:.1f} ms, "
+            f"{len(operation.statements)} statements, {operation.rows} rows, {operation.bytes} bytes)"
+        )
+
+
+def instrumented(name=None):
+    """
+    Record latency, rows fetched and payload bytes of every call of the decorated
+    data-access function under `name` (default: the function's name) in
+    query_metrics. Works for plain functions, generators (only the time spent
+    producing items is counted) and coroutines.
+    """
+    def decorator(func):
+        operation_name = name or func.__name__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                operation = _Operation(operation_name)
+                token = _current_operation.set(operation)
+                start = time.perf_counter()
+                result = None
+                try:
+                    result = await func(*args, **kwargs)
+                    return result
+                except Exception:
+                    operation.error = True
+                    raise
+                finally:
+                    _current_operation.reset(token)
+                    _finish(operation, time.perf_counter() - start, result, count_result=True)
+            return async_wrapper
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                operation = _Operation(operation_name)
+                generator = func(*args, **kwargs)
+                busy = 0.0
+                try:
+                    while True:
+                        token = _current_operation.set(operation)
+                        start = time.perf_counter()
+                        try:
+                            item = next(generator)
+                        except StopIteration:
+                            return
+                        finally:
+                            busy += time.perf_counter() - start
+                            _current_operation.reset(token)
+                        yield item
+                except Exception:
+                    operation.error = True
+                    raise
+                finally:
+                    generator.close()
+                    _finish(operation, busy)
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            operation = _Operation(operation_name)
+            token = _current_operation.set(operation)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                operation.error = True
+                raise
+            finally:
+                _current_operation.reset(token)
+                _finish(operation, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def render_prometheus(snapshot, pool_stats=None, cache_stats=None):
+    """Prometheus text exposition of a query_metrics snapshot (and connection pool and cache stats)."""
+    lines = [
+        '# HELP visionmon_db_operation_seconds Latency of instrumented data-access functions.',
+        '# TYPE visionmon_db_operation_seconds histogram',
+    ]
+    for name, stats in snapshot['operations'].items():
+        for bound, count in stats['buckets'].items():
+            lines.append(f'visionmon_db_operation_seconds_bucket{{operation="{_label(name)}",le="{bound}"}} {count}')
+        lines.append(f'visionmon_db_operation_seconds_sum{{operation="{_label(name)}"}} {stats["total_seconds"]}')
+        lines.append(f'visionmon_db_operation_seconds_count{{operation="{_label(name)}"}} {stats["count"]}')
+    for metric, key, help_text in (
+        ('visionmon_db_operation_rows_total', 'rows', 'Rows fetched by instrumented data-access functions.'),
+        ('visionmon_db_operation_bytes_total', 'bytes', 'Text and binary payload bytes fetched.'),
+        ('visionmon_db_operation_errors_total', 'errors', 'Calls during which a statement failed.'),
+    ):
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} counter')
+        for name, stats in snapshot['operations'].items():
+            lines.append(f'{metric}{{operation="{_label(name)}"}} {stats[key]}')
+
+    sync_pool = (pool_stats or {}).get('sync')
+    if sync_pool:
+        lines.append('# TYPE visionmon_db_pool_connections gauge')
+        for state in ('size', 'idle', 'in_use'):
+            lines.append(f'visionmon_db_pool_connections{{state="{state}"}} {sync_pool[state]}')
+        lines.append('# TYPE visionmon_db_pool_wait_seconds_total counter')
+        lines.append(f'visionmon_db_pool_wait_seconds_total {sync_pool["wait_time_total"]}')
+        lines.append('# TYPE visionmon_db_pool_timeouts_total counter')
+        lines.append(f'visionmon_db_pool_timeouts_total {sync_pool["timeouts"]}')
+    if cache_stats:
+        lines.append('# TYPE visionmon_cache_lookups_total counter')
+        for cache, stats in cache_stats.items():
+            if 'local_hits' in stats:
+                outcomes = {'local_hit': stats['local_hits'], 'redis_hit': stats['redis_hits'], 'miss': stats['misses']}
+            else:
+                outcomes = {'hit': stats['hits'], 'miss': stats['misses']}
+            for outcome, count in outcomes.items():
+                lines.append(f'visionmon_cache_lookups_total{{cache="{_label(cache)}",outcome="{outcome}"}} {count}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from monitor.config import FRAME_ARCHIVE_DIR, FRAME_COLD_AFTER_DAYS, FRAME_COLD_QUALITY, FRAME_COLD_MAX_WIDTH
+from monitor.frame_store import archive_cold_frames
+from monitor.retention import format_bytes
+
+
+class Command(BaseCommand):
+    help = 'Moves frames older than FRAME_COLD_AFTER_DAYS from the frame store into recompressed per-day archives'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cold-after-days', type=int, default=FRAME_COLD_AFTER_DAYS,
+                            help='Archive whole days older than this many days')
+        # No runtime limit by default: a manual run archives the whole backlog
+        parser.add_argument('--max-runtime', type=float, default=float('inf'),
+                            help='Stop after this many seconds; the next run continues where it stopped')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Archiving frames older than {options['cold_after_days']} days to {FRAME_ARCHIVE_DIR} "
+                          f"(quality {FRAME_COLD_QUALITY}, at most {FRAME_COLD_MAX_WIDTH}px wide)")
+        stats = archive_cold_frames(cold_after_days=options['cold_after_days'], max_runtime=options['max_runtime'])
+        line = (f"Archived {stats['rows']} frames of {stats['days']} days in {stats['seconds']:.1f}s "
+                f"({stats['rows_per_sec']:.0f} frames/s): {format_bytes(stats['bytes'])} freed in the frame store, "
+                f"{format_bytes(stats['archive_bytes'])} added to archives")
+        if stats['finished']:
+            self.stdout.write(self.style.SUCCESS(line))
+        else:
+            self.stdout.write(self.style.WARNING(f"{line}; unfinished, run again to continue"))
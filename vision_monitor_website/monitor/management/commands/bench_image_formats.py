@@ -0,0 +1,66 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from monitor.config import camera_indexes, IMAGE_TRANSCODE_QUALITY, THUMBNAIL_DEFAULT_QUALITY
+from monitor.db_operations import fetch_latest_camera_frame
+from monitor.thumbnails import IMAGE_FORMATS, NEGOTIATED_FORMATS, encode_variant
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks bytes and encode time per image format (JPEG, WebP, AVIF) on sample frames'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', help='JPEG files to use instead of the latest frame of every camera')
+        parser.add_argument('--widths', default='original,240',
+                            help="Comma-separated widths to encode at; 'original' keeps the frame size")
+        parser.add_argument('--quality', type=int, default=None,
+                            help=f'Encoder quality (default {IMAGE_TRANSCODE_QUALITY} at full size, '
+                                 f'{THUMBNAIL_DEFAULT_QUALITY} for thumbnails)')
+        parser.add_argument('--repeat', type=int, default=3, help='Encodes per frame and variant')
+
+    def handle(self, *args, **options):
+        frames = self.load_frames(options['files'])
+        if not frames:
+            self.stderr.write(self.style.ERROR('No sample frames found'))
+            return
+        original_bytes = statistics.mean(len(frame) for frame in frames)
+        self.stdout.write(f"{len(frames)} sample frames, {original_bytes / 1024:.1f} KiB per original JPEG")
+
+        formats = ['jpeg'] + list(NEGOTIATED_FORMATS)
+        skipped = [image_format for image_format in IMAGE_FORMATS if image_format not in formats]
+        if skipped:
+            self.stdout.write(f"Not benchmarked (disabled or no encoder in this Pillow build): {', '.join(skipped)}")
+
+        self.stdout.write(f"{'format':<6} {'width':>8} {'quality':>7} {'KiB/frame':>10} {'vs original':>12} {'encode ms':>10}")
+        for width in options['widths'].split(','):
+            width = None if width.strip() == 'original' else int(width)
+            quality = options['quality'] or (THUMBNAIL_DEFAULT_QUALITY if width else IMAGE_TRANSCODE_QUALITY)
+            for image_format in formats:
+                sizes, timings = [], []
+                for frame in frames:
+                    for _ in range(options['repeat']):
+                        started = time.perf_counter()
+                        data = encode_variant(frame, width, quality, image_format)
+                        timings.append(time.perf_counter() - started)
+                    sizes.append(len(data))
+                size = statistics.mean(sizes)
+                self.stdout.write(
+                    f"{image_format:<6} {width or 'original':>8} {quality:>7} {size / 1024:>10.1f} "
+                    f"{size / original_bytes:>11.0%} {statistics.median(timings) * 1000:>10.1f}"
+                )
+
+    def load_frames(self, files):
+        if files:
+            frames = []
+            for path in files:
+                with open(path, 'rb') as f:
+                    frames.append(f.read())
+            return frames
+        frames = []
+        for camera_index in sorted(set(camera_indexes.values())):
+            result = fetch_latest_camera_frame(camera_index)
+            if result is not None and result[0]:
+                frames.append(bytes(result[0]))
+        return frames
@@ -0,0 +1,118 @@
+import json
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from monitor.caching import LRUCache
+from monitor.config import camera_indexes, camera_names
+from monitor.db_operations import decode_camera_states, encode_timeline_cursor, format_timeline_event
+
+
+# Row formatting as it was before the decoded-state cache: parse the whole
+# state_result message and scan its cameras for every timeline row.
+def legacy_format_timeline_event(row, state_messages):
+    timestamp = row['timestamp']
+    formatted_timestamp = timestamp.strftime('%Y-%m-%dT%H:%M:%S.%f%z') if timestamp else None
+
+    raw_state = state_messages.get(row['state_id'])
+    state_data = json.loads(raw_state) if raw_state else {}
+    camera_states = state_data.get('camera_states', {})
+    camera_state = ''
+    source_name = str(row['camera_name']).split(' ')[0]
+    for target_name, state in camera_states.items():
+        target_base = target_name.split(' ')[0]
+        if source_name == target_base:
+            camera_state = state
+            break
+
+    return {
+        'camera_id': row['camera_id'],
+        'camera_name': row['camera_name'],
+        'timestamp': formatted_timestamp,
+        'data_id': row['data_id'],
+        'description': row['description'],
+        'state': camera_state,
+        'cursor': encode_timeline_cursor(timestamp, row['id']) if timestamp else None
+    }
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmarks per-row timeline formatting with and without the decoded camera-state cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000, help='Timeline rows per run')
+        parser.add_argument('--rows-per-state', type=int, default=12, help='Rows sharing each state_result row')
+        parser.add_argument('--state-size', type=int, default=2048, help='Approximate bytes per state_result message')
+        parser.add_argument('--repeat', type=int, default=7, help='Runs per variant')
+
+    def handle(self, *args, **options):
+        rows, state_messages = self.build_rows(options)
+        cache = LRUCache(max(len(state_messages), 1))
+
+        def legacy():
+            return [legacy_format_timeline_event(row, state_messages) for row in rows]
+
+        def cached_cold():
+            cache.clear()
+            return cached_warm()
+
+        def cached_warm():
+            camera_states = {}
+            for state_id in {row['state_id'] for row in rows}:
+                decoded = cache.get(state_id)
+                if decoded is None:
+                    decoded = decode_camera_states(state_messages[state_id])
+                    cache.set(state_id, decoded)
+                camera_states[state_id] = decoded
+            return [format_timeline_event(row, camera_states) for row in rows]
+
+        if legacy() != cached_cold():
+            self.stderr.write(self.style.ERROR('Cached formatting does not match the legacy output'))
+            return
+
+        self.stdout.write(
+            f"{len(rows)} rows, {len(state_messages)} distinct states, "
+            f"~{options['state_size']} bytes per state message"
+        )
+        self.stdout.write(f"{'variant':<28} {'median ms':>10} {'us/row':>8}")
+        for name, run in (('legacy (parse per row)', legacy),
+                          ('cache, cold', cached_cold),
+                          ('cache, warm', cached_warm)):
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                run()
+                timings.append(time.perf_counter() - started)
+            median = statistics.median(timings)
+            self.stdout.write(f"{name:<28} {median * 1000:>10.2f} {median * 1e6 / len(rows):>8.2f}")
+
+    def build_rows(self, options):
+        cameras = [(camera_id, f"{name} {camera_indexes[camera_id]}") for camera_id, name in camera_names.items()]
+        padding = 'x' * max(options['state_size'] - 400, 0)
+        state_count = max(options['rows'] // options['rows_per_state'], 1)
+        state_messages = {
+            state_id: json.dumps({
+                'facility_state': 'nothing',
+                'camera_states': {camera_name: f"state {state_id}" for _, camera_name in cameras},
+                'notes': padding,
+            })
+            for state_id in range(1, state_count + 1)
+        }
+
+        now = timezone.now()
+        rows = []
+        for i in range(options['rows']):
+            camera_id, camera_name = cameras[i % len(cameras)]
+            rows.append({
+                'id': i + 1,
+                'camera_id': camera_id,
+                'camera_name': camera_name,
+                'timestamp': now - timedelta(seconds=i),
+                'data_id': i + 1,
+                'description': 'Synthetic description',
+                'state_id': 1 + i * state_count // options['rows'],
+            })
+        return rows, state_messages
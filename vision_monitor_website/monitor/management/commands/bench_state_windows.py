@@ -0,0 +1,149 @@
+import json
+import random
+import time
+from collections import deque, Counter
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from monitor.db_pool import db_connection
+from monitor.state_management import (
+    StateWindow,
+    camera_alert_config,
+    camera_state_weight,
+    facility_config,
+    facility_state_weight,
+    state_key_phrases,
+)
+
+SYNTHETIC_STATES = [
+    "nothing", "single person present", "people eating", "night-time", "bustling", "door open",
+    "religious or spiritual gathering", "big religious festival", "over capacity",
+    "Single person present near the altar", "people eating lunch", "camera view obstructed", "unclear",
+]
+
+
+# The windows as they were before StateWindow: a deque per window, filtered and
+# recounted with a weighted Counter on every query.
+class LegacyWindow:
+
+    def __init__(self, camera_id=None):
+        self.camera_id = camera_id
+        self.entries = deque(maxlen=900)
+
+    def append(self, state, timestamp):
+        while self.entries and (timestamp - self.entries[0][1]) > timedelta(minutes=15):
+            self.entries.popleft()
+        self.entries.append((state, timestamp))
+
+    def most_frequent(self):
+        if not self.entries:
+            return None
+        relevant_states = [state for state, _ in self.entries if any(phrase in state.lower() for phrase in state_key_phrases)]
+        if not relevant_states:
+            return self.entries[-1][0]
+        state_counts = Counter()
+        if self.camera_id is None:
+            for state in relevant_states:
+                for config_state, config in facility_config.items():
+                    if config_state in state.lower():
+                        state_counts[state] += config["penalty"]
+                        break
+                else:
+                    state_counts[state] += 1.0
+        else:
+            camera_config = camera_alert_config.get(self.camera_id)
+            for state in relevant_states:
+                if camera_config and any(alert in state.lower() for alert in camera_config["alert_states"]):
+                    state_counts[state] += camera_config["penalty"]
+                else:
+                    state_counts[state] += 1.0
+        return state_counts.most_common(1)[0][0]
+
+
+class Command(BaseCommand):
+    help = 'Replays a day of state messages through the legacy and incremental state windows and compares them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=24, help='Hours of state_result messages to replay')
+        parser.add_argument('--synthetic', action='store_true', help='Replay generated messages instead of state_result')
+        parser.add_argument('--interval', type=float, default=10,
+                            help='Seconds between generated messages (the legacy windows get slow below ~5)')
+        parser.add_argument('--queries', type=int, default=3,
+                            help='Mode queries per window and message')
+
+    def handle(self, *args, **options):
+        messages = [] if options['synthetic'] else self.load_messages(options['hours'])
+        if not messages:
+            if not options['synthetic']:
+                self.stdout.write("No state_result messages in that range; replaying generated messages")
+            messages = self.generate_messages(options['hours'], options['interval'])
+        cameras = sorted({camera_id for _, _, camera_states in messages for camera_id in camera_states})
+        self.stdout.write(f"{len(messages)} messages, {len(cameras)} cameras, {options['queries']} queries per window and message")
+
+        def legacy_windows():
+            return LegacyWindow(), {camera_id: LegacyWindow(camera_id) for camera_id in cameras}
+
+        def incremental_windows():
+            return (StateWindow(facility_state_weight),
+                    {camera_id: StateWindow(camera_state_weight(camera_id)) for camera_id in cameras})
+
+        results = {}
+        self.stdout.write(f"{'variant':<14} {'total ms':>10} {'us/message':>11}")
+        for name, make_windows in (('legacy', legacy_windows), ('incremental', incremental_windows)):
+            facility_window, camera_windows = make_windows()
+            decisions = []
+            started = time.perf_counter()
+            for timestamp, facility_state, camera_states in messages:
+                facility_window.append(facility_state, timestamp)
+                for camera_id, state in camera_states.items():
+                    camera_windows[camera_id].append(state, timestamp)
+                for _ in range(options['queries']):
+                    decision = (facility_window.most_frequent(),
+                                tuple(camera_windows[camera_id].most_frequent() for camera_id in camera_states))
+                decisions.append(decision)
+            elapsed = time.perf_counter() - started
+            results[name] = decisions
+            self.stdout.write(f"{name:<14} {elapsed * 1000:>10.1f} {elapsed * 1e6 / len(messages):>11.1f}")
+
+        mismatches = sum(a != b for a, b in zip(results['legacy'], results['incremental']))
+        if mismatches:
+            # Only possible where two states tie exactly: the legacy float sums could round a tie either way
+            self.stdout.write(self.style.WARNING(f"{mismatches} of {len(messages)} decisions differ (exact ties)"))
+        else:
+            self.stdout.write(self.style.SUCCESS("Both variants chose the same states for every message"))
+
+    def load_messages(self, hours):
+        with db_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT timestamp, raw_message FROM state_result WHERE timestamp >= %s ORDER BY timestamp, id",
+                (timezone.now() - timedelta(hours=hours),),
+            )
+            rows = cursor.fetchall()
+        messages = []
+        for timestamp, raw_message in rows:
+            try:
+                data = json.loads(raw_message)
+            except (TypeError, ValueError):
+                continue
+            messages.append((timestamp, data.get('facility_state', '').strip(), data.get('camera_states', {})))
+        return messages
+
+    def generate_messages(self, hours, interval):
+        # Each camera mostly keeps its state, as real scenes do, with occasional changes
+        rng = random.Random(42)
+        cameras = list(camera_alert_config)
+        current = {camera_id: rng.choice(SYNTHETIC_STATES) for camera_id in cameras}
+        facility_state = 'nothing'
+        timestamp = timezone.now() - timedelta(hours=hours)
+        messages = []
+        for _ in range(int(hours * 3600 / interval)):
+            for camera_id in cameras:
+                if rng.random() < 0.1:
+                    current[camera_id] = rng.choice(SYNTHETIC_STATES)
+            if rng.random() < 0.05:
+                facility_state = rng.choice(list(facility_config) + ['unclear'])
+            messages.append((timestamp, facility_state, dict(current)))
+            timestamp += timedelta(seconds=interval)
+        return messages
@@ -0,0 +1,167 @@
+import json
+import statistics
+import time
+from datetime import timedelta
+
+import psycopg2
+from psycopg2.extras import DictCursor
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from monitor.config import camera_indexes, camera_names
+from monitor.db_operations import build_timeline_events_query, fetch_state_messages
+from monitor.db_pool import get_connection_params
+
+BENCH_SCHEMA = 'timeline_bench'
+
+# The per-row correlated subquery the timeline endpoints used before the as-of merge.
+LEGACY_TIMELINE_QUERY = """
+SELECT
+    vm.camera_id,
+    vm.camera_name,
+    vm.timestamp,
+    vm.data_id,
+    COALESCE(vm.description, 'No description available') as description,
+    (
+        SELECT raw_message
+        FROM state_result sr
+        WHERE sr.timestamp <= vm.timestamp
+        ORDER BY sr.timestamp DESC
+        LIMIT 1
+    ) as state_data
+FROM visionmon_metadata vm
+{where}
+{order_limit}
+"""
+
+FACILITY_STATES = ['nothing', 'single person present', 'people eating', 'night-time', 'religious or spiritual gathering']
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the legacy correlated-subquery timeline query against the set-based one on synthetic data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='Days of synthetic history to generate')
+        parser.add_argument('--frame-interval', type=int, default=60, help='Seconds between frames per camera')
+        parser.add_argument('--state-interval', type=int, default=60, help='Seconds between state_result rows')
+        parser.add_argument('--state-size', type=int, default=2048, help='Approximate bytes per state_result message')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per scenario')
+        parser.add_argument('--no-indexes', action='store_true', help='Benchmark without the timeline indexes')
+        parser.add_argument('--keep', action='store_true', help=f'Keep the {BENCH_SCHEMA} schema afterwards')
+
+    def handle(self, *args, **options):
+        conn = psycopg2.connect(**get_connection_params())
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+                cur.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+                cur.execute(f"SET search_path TO {BENCH_SCHEMA}")
+            conn.commit()
+
+            end_time = timezone.now().replace(microsecond=0)
+            start_time = end_time - timedelta(days=options['days'])
+            self.populate(conn, start_time, end_time, options)
+
+            scenarios = [
+                ('last hour', [end_time - timedelta(hours=1), end_time], False),
+                ('last day', [end_time - timedelta(days=1), end_time], False),
+                ('page 1 (20 rows)', [0, 20], True),
+                ('page at offset 2000', [2000, 20], True),
+            ]
+            self.stdout.write(f"{'scenario':<22} {'variant':<8} {'median ms':>10} {'rows':>7} {'state bytes':>12}")
+            for name, params, paginate in scenarios:
+                for variant, run in (('legacy', self.run_legacy), ('set', self.run_set_based)):
+                    timings = []
+                    for _ in range(options['repeat']):
+                        started = time.perf_counter()
+                        rows, state_bytes = run(conn, params, paginate)
+                        timings.append((time.perf_counter() - started) * 1000)
+                        conn.rollback()
+                    self.stdout.write(
+                        f"{name:<22} {variant:<8} {statistics.median(timings):>10.1f} {rows:>7} {state_bytes:>12}"
+                    )
+        finally:
+            if not options['keep']:
+                conn.rollback()
+                with conn.cursor() as cur:
+                    cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+                conn.commit()
+            conn.close()
+
+    def populate(self, conn, start_time, end_time, options):
+        padding = 'x' * max(options['state_size'] - 400, 0)
+        state_template = json.dumps({
+            'facility_state': '__STATE__',
+            'camera_states': {
+                f"{name} {camera_indexes[camera_id]}": '__STATE__'
+                for camera_id, name in camera_names.items()
+            },
+            'notes': padding,
+        })
+        cameras = [(camera_id, camera_indexes[camera_id], f"{name} {camera_indexes[camera_id]}")
+                   for camera_id, name in camera_names.items()]
+
+        self.stdout.write(f"Generating {options['days']} days of synthetic data in schema {BENCH_SCHEMA}...")
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE visionmon_metadata (
+                    id bigserial PRIMARY KEY,
+                    camera_id text,
+                    camera_index integer,
+                    camera_name text,
+                    timestamp timestamptz,
+                    description text,
+                    data_id bigint
+                )
+            """)
+            cur.execute("""
+                CREATE TABLE state_result (
+                    id bigserial PRIMARY KEY,
+                    raw_message text,
+                    timestamp timestamptz
+                )
+            """)
+            cur.execute("""
+                INSERT INTO state_result (raw_message, timestamp)
+                SELECT replace(%s, '__STATE__', (%s::text[])[1 + (extract(epoch FROM ts)::bigint / 600) %% %s]), ts
+                FROM generate_series(%s::timestamptz, %s::timestamptz, make_interval(secs => %s)) ts
+            """, (state_template, FACILITY_STATES, len(FACILITY_STATES), start_time, end_time, options['state_interval']))
+            cur.execute("""
+                INSERT INTO visionmon_metadata (camera_id, camera_index, camera_name, timestamp, description, data_id)
+                SELECT c.camera_id, c.camera_index, c.camera_name, ts,
+                       'Synthetic description for ' || c.camera_name, row_number() OVER ()
+                FROM generate_series(%s::timestamptz, %s::timestamptz, make_interval(secs => %s)) ts
+                CROSS JOIN unnest(%s::text[], %s::integer[], %s::text[]) AS c(camera_id, camera_index, camera_name)
+            """, (start_time, end_time, options['frame_interval'],
+                  [c[0] for c in cameras], [c[1] for c in cameras], [c[2] for c in cameras]))
+            if not options['no_indexes']:
+                cur.execute("CREATE INDEX ON state_result (timestamp, id)")
+                cur.execute("CREATE INDEX ON visionmon_metadata (timestamp, id)")
+                cur.execute("CREATE INDEX ON visionmon_metadata (camera_id, timestamp, id)")
+            cur.execute("ANALYZE visionmon_metadata")
+            cur.execute("ANALYZE state_result")
+            cur.execute("SELECT (SELECT COUNT(*) FROM visionmon_metadata), (SELECT COUNT(*) FROM state_result)")
+            metadata_rows, state_rows = cur.fetchone()
+        conn.commit()
+        self.stdout.write(f"  {metadata_rows} metadata rows, {state_rows} state_result rows")
+
+    def run_legacy(self, conn, params, paginate):
+        if paginate:
+            query = LEGACY_TIMELINE_QUERY.format(where='', order_limit='ORDER BY vm.timestamp DESC OFFSET %s LIMIT %s')
+        else:
+            query = LEGACY_TIMELINE_QUERY.format(where='WHERE vm.timestamp BETWEEN %s AND %s', order_limit='')
+        with conn.cursor(cursor_factory=DictCursor) as cur:
+            cur.execute(query, params)
+            rows = cur.fetchall()
+        return len(rows), sum(len(row['state_data'] or '') for row in rows)
+
+    def run_set_based(self, conn, params, paginate):
+        if paginate:
+            query = build_timeline_events_query([], direction='DESC', pagination='offset')
+        else:
+            query = build_timeline_events_query(['vm.timestamp BETWEEN %s AND %s'])
+        with conn.cursor(cursor_factory=DictCursor) as cur:
+            cur.execute(query, params)
+            rows = cur.fetchall()
+            state_messages = fetch_state_messages(cur, (row['state_id'] for row in rows))
+        return len(rows), sum(len(message or '') for message in state_messages.values())
@@ -0,0 +1,67 @@
+from django.apps import apps
+from django.contrib.postgres.indexes import PostgresIndex
+from django.core.management.base import BaseCommand, CommandError
+
+from monitor.db_pool import db_connection
+
+EXISTING_INDEXES_QUERY = """
+SELECT t.relname, i.relname, am.amname, ix.indisvalid,
+       ARRAY(
+           SELECT a.attname
+           FROM unnest(ix.indkey) WITH ORDINALITY AS k(attnum, n)
+           JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+           ORDER BY k.n
+       )
+FROM pg_index ix
+JOIN pg_class t ON t.oid = ix.indrelid
+JOIN pg_class i ON i.oid = ix.indexrelid
+JOIN pg_am am ON am.oid = i.relam
+JOIN pg_namespace ns ON ns.oid = t.relnamespace
+WHERE ns.nspname = current_schema() AND t.relname = ANY(%s)
+"""
+
+
+def required_indexes():
+    """(table, index name, access method, columns) for every index declared on the monitor models."""
+    for model in apps.get_app_config('monitor').get_models():
+        for index in model._meta.indexes:
+            method = index.suffix if isinstance(index, PostgresIndex) else 'btree'
+            columns = [model._meta.get_field(field_name.lstrip('-')).column for field_name in index.fields]
+            yield model._meta.db_table, index.name, method, columns
+
+
+class Command(BaseCommand):
+    help = 'Reports hot-path indexes declared on the monitor models that are missing or invalid in the database'
+
+    def handle(self, *args, **options):
+        required = list(required_indexes())
+        tables = sorted({table for table, _, _, _ in required})
+
+        with db_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(EXISTING_INDEXES_QUERY, (tables,))
+            existing = cursor.fetchall()
+
+        missing = 0
+        for table, name, method, columns in required:
+            # Any valid index of the same type whose leading columns match will do,
+            # whatever it happens to be called.
+            matches = [
+                (index_name, valid) for index_table, index_name, index_method, valid, index_columns in existing
+                if index_table == table and index_method == method and list(index_columns[:len(columns)]) == columns
+            ]
+            label = f"{table} ({', '.join(columns)}) {method}"
+            if any(valid for _, valid in matches):
+                covering = ', '.join(index_name for index_name, valid in matches if valid)
+                self.stdout.write(f"  ok       {label:<60} {covering}")
+            elif matches:
+                missing += 1
+                self.stdout.write(self.style.WARNING(
+                    f"  INVALID  {label:<60} {matches[0][0]} (a concurrent build failed; drop and recreate it)"
+                ))
+            else:
+                missing += 1
+                self.stdout.write(self.style.ERROR(f"  MISSING  {label:<60} expected {name}"))
+
+        if missing:
+            raise CommandError(f"{missing} hot-path index(es) missing or invalid; run `manage.py migrate monitor`")
+        self.stdout.write(self.style.SUCCESS(f"All {len(required)} hot-path indexes are present"))
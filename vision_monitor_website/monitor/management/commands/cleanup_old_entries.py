@@ -1,110 +1,68 @@
 # File: monitor/management/commands/cleanup_old_entries.py
 
 from django.core.management.base import BaseCommand
-from django.db import connection
-from django.utils import timezone
-from datetime import timedelta
-import logging
+
+from monitor.config import (
+    RETENTION_DAYS,
+    RETENTION_BATCH_SIZE,
+    RETENTION_BATCH_SLEEP,
+    RETENTION_MAX_RUNTIME,
+)
+from monitor.partitions import expired_partitions
+from monitor.retention import plan_retention, format_bytes
+from monitor.scheduled_tasks import cleanup_old_entries
+
 
 class Command(BaseCommand):
-    help = 'Deletes frame analysis entries older than 30 days'
+    help = f'Retires partitions and deletes frame analysis entries older than {RETENTION_DAYS} days'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be retired and deleted, with query plans, without changing anything')
+        parser.add_argument('--retention-days', type=int, default=RETENTION_DAYS)
+        parser.add_argument('--batch-size', type=int, default=RETENTION_BATCH_SIZE, help='Rows deleted per transaction')
+        parser.add_argument('--sleep', type=float, default=RETENTION_BATCH_SLEEP, help='Seconds to pause between batches')
+        parser.add_argument('--max-runtime', type=float, default=RETENTION_MAX_RUNTIME,
+                            help='Stop after this many seconds; the next run resumes from the checkpoint')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore an unfinished checkpoint and start from the oldest row')
 
     def handle(self, *args, **options):
+        if options['dry_run']:
+            self.dry_run(options['retention_days'], options['batch_size'])
+            return
+
         self.stdout.write(self.style.SUCCESS('Starting cleanup operation...'))
-        thirty_days_ago = timezone.now() - timedelta(days=30)
-        
-        self.stdout.write(f'Will delete entries older than: {thirty_days_ago}')
-        
-        try:
-            with connection.cursor() as cursor:
-                self.stdout.write('Executing deletion query...')
-                cursor.execute("""
-                    EXPLAIN ANALYZE
-                    WITH old_metadata AS (
-                        SELECT id, data_id 
-                        FROM visionmon_metadata 
-                        WHERE timestamp < %s
-                    ),
-                    deleted_metadata AS (
-                        DELETE FROM visionmon_metadata
-                        WHERE id IN (SELECT id FROM old_metadata)
-                        RETURNING id
-                    ),
-                    deleted_binary_data AS (
-                        DELETE FROM visionmon_binary_data
-                        WHERE id IN (SELECT data_id FROM old_metadata)
-                        RETURNING id
-                    ),
-                    old_state_results AS (
-                        SELECT id
-                        FROM state_result 
-                        WHERE timestamp < %s
-                    ),
-                    deleted_state_results AS (
-                        DELETE FROM state_result
-                        WHERE id IN (SELECT id FROM old_state_results)
-                        RETURNING id
-                    )
-                    SELECT 
-                        (SELECT COUNT(*) FROM deleted_metadata) +
-                        (SELECT COUNT(*) FROM deleted_binary_data) +
-                        (SELECT COUNT(*) FROM deleted_state_results) as total_deleted;
-                """, [thirty_days_ago, thirty_days_ago])
-                
-                query_plan = cursor.fetchall()
-                self.stdout.write('Query plan:')
-                for row in query_plan:
-                    self.stdout.write(f'    {row[0]}')
-                
-                # Execute the actual deletion query without EXPLAIN ANALYZE
-                cursor.execute("""
-                    WITH old_metadata AS (
-                        SELECT id, data_id 
-                        FROM visionmon_metadata 
-                        WHERE timestamp < %s
-                    ),
-                    deleted_metadata AS (
-                        DELETE FROM visionmon_metadata
-                        WHERE id IN (SELECT id FROM old_metadata)
-                        RETURNING id
-                    ),
-                    deleted_binary_data AS (
-                        DELETE FROM visionmon_binary_data
-                        WHERE id IN (SELECT data_id FROM old_metadata)
-                        RETURNING id
-                    ),
-                    old_state_results AS (
-                        SELECT id
-                        FROM state_result 
-                        WHERE timestamp < %s
-                    ),
-                    deleted_state_results AS (
-                        DELETE FROM state_result
-                        WHERE id IN (SELECT id FROM old_state_results)
-                        RETURNING id
-                    )
-                    SELECT 
-                        (SELECT COUNT(*) FROM deleted_metadata) +
-                        (SELECT COUNT(*) FROM deleted_binary_data) +
-                        (SELECT COUNT(*) FROM deleted_state_results) as total_deleted;
-                """, [thirty_days_ago, thirty_days_ago])
-                
-                deleted_count = cursor.fetchone()[0]
-                self.stdout.write(self.style.SUCCESS(f'Successfully deleted {deleted_count} entries'))
+        # Same code path as the scheduler's daily run.
+        stats = cleanup_old_entries(
+            retention_days=options['retention_days'],
+            batch_size=options['batch_size'],
+            sleep=options['sleep'],
+            max_runtime=options['max_runtime'],
+            restart=options['restart'],
+        )
+        for table, table_stats in stats.items():
+            unit = {'frame_store': 'unreferenced files', 'frame_archive': 'archived frames'}.get(table, 'rows')
+            line = (f"{table}: {table_stats['rows']} {unit}, {format_bytes(table_stats['bytes'])} freed "
+                    f"in {table_stats['seconds']:.1f}s ({table_stats['rows_per_sec']:.0f} {unit.split()[-1]}/s)")
+            if table_stats['finished']:
+                self.stdout.write(line)
+            else:
+                self.stdout.write(self.style.WARNING(f"{line}; unfinished, the next run resumes"))
+        self.stdout.write(self.style.SUCCESS('Cleanup operation completed'))
 
-        except Exception as e:
-            self.stdout.write(self.style.ERROR(f'Error during cleanup: {str(e)}'))
-            # Get details about any blocking queries
-            cursor.execute("""
-                SELECT pid, state, query_start, query
-                FROM pg_stat_activity
-                WHERE state != 'idle';
-            """)
-            active_queries = cursor.fetchall()
-            self.stdout.write('Active database queries:')
-            for query in active_queries:
-                self.stdout.write(f'    PID: {query[0]}, State: {query[1]}, Started: {query[2]}')
-                self.stdout.write(f'    Query: {query[3]}')
-            raise
+    def dry_run(self, retention_days, batch_size):
+        expired = expired_partitions(retention_days)
+        self.stdout.write(f"Partitions that would be retired: {len(expired)}")
+        for table, partition in expired:
+            self.stdout.write(f"  {partition['name']} (up to {partition['upper']})")
 
-        self.stdout.write(self.style.SUCCESS('Cleanup operation completed'))
\ No newline at end of file
+        report = plan_retention(retention_days, batch_size)
+        self.stdout.write(f"Rows older than {report['cutoff']}, including any in those partitions:")
+        for table, counts in report['tables'].items():
+            self.stdout.write(f"  {table}: {counts['rows']} rows, ~{format_bytes(counts['bytes'])}")
+        for table, plan in report['plans'].items():
+            self.stdout.write(f"\nBatch plan for {table} (batch size {batch_size}):")
+            for line in plan:
+                self.stdout.write(f"  {line}")
+        self.stdout.write(self.style.SUCCESS('Dry run: nothing was changed'))
@@ -0,0 +1,92 @@
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from monitor.db_pool import db_connection
+from monitor.retention import format_bytes
+
+SORT_KEYS = {
+    'total': 'total_seconds',
+    'p95': 'p95_seconds',
+    'max': 'max_seconds',
+    'count': 'count',
+    'bytes': 'bytes',
+}
+
+PG_STAT_STATEMENTS_QUERY = """
+SELECT calls, total_exec_time, mean_exec_time, rows, left(regexp_replace(query, '\\s+', ' ', 'g'), 160)
+FROM pg_stat_statements
+WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+ORDER BY total_exec_time DESC
+LIMIT %s
+"""
+
+
+class Command(BaseCommand):
+    help = 'Shows per-function query latency, rows and bytes, and recent slow queries, from a running server'
+
+    def add_arguments(self, parser):
+        # Metrics are kept per server process, so they are read from its /metrics/db/ endpoint.
+        parser.add_argument('--url', default='http://localhost:8000/metrics/db/', help='Metrics endpoint of the server')
+        parser.add_argument('--sort', choices=sorted(SORT_KEYS), default='total')
+        parser.add_argument('--slow', type=int, default=10, help='Number of recent slow queries to show')
+        parser.add_argument('--pg', action='store_true',
+                            help='Also show the top statements from pg_stat_statements, if the extension is installed')
+
+    def handle(self, *args, **options):
+        try:
+            response = requests.get(options['url'], timeout=10)
+            if response.status_code == 403:
+                raise CommandError(f"{options['url']} refused this host; add its address to DB_METRICS_ALLOWED_IPS")
+            response.raise_for_status()
+            metrics = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise CommandError(f"Could not read metrics from {options['url']}: {e}")
+
+        operations = metrics['operations']
+        sort_key = SORT_KEYS[options['sort']]
+        self.stdout.write(f"{'operation':<36} {'calls':>7} {'err':>4} {'mean ms':>8} {'p95 ms':>8} {'max ms':>8} "
+                          f"{'total s':>8} {'rows':>9} {'bytes':>10}")
+        for name, stats in sorted(operations.items(), key=lambda item: item[1][sort_key], reverse=True):
+            self.stdout.write(
+                f"{name:<36} {stats['count']:>7} {stats['errors']:>4} {stats['mean_seconds'] * 1000:>8.1f} "
+                f"{stats['p95_seconds'] * 1000:>8.1f} {stats['max_seconds'] * 1000:>8.1f} "
+                f"{stats['total_seconds']:>8.2f} {stats['rows']:>9} {format_bytes(stats['bytes']):>10}"
+            )
+        if not operations:
+            self.stdout.write("(no instrumented calls yet)")
+
+        pool = (metrics.get('pool') or {}).get('sync')
+        if pool:
+            self.stdout.write(f"\nPool: {pool['in_use']}/{pool['size']} in use (max {pool['max_size']}), "
+                              f"{pool['waits']} waits, avg wait {pool['wait_time_avg'] * 1000:.1f} ms, "
+                              f"{pool['timeouts']} timeouts")
+
+        frames = (metrics.get('caches') or {}).get('latest_frame')
+        if frames:
+            self.stdout.write(f"Latest-frame cache: {frames['local_hits']} local hits, {frames['redis_hits']} Redis hits, "
+                              f"{frames['misses']} misses ({frames['hit_ratio']:.1%} hit ratio), "
+                              f"{frames['refreshes']} refreshes, {frames['redis_errors']} Redis errors")
+
+        slow_queries = metrics['slow_queries'][-options['slow']:] if options['slow'] > 0 else []
+        self.stdout.write(f"\nRecent slow queries (>= {metrics['slow_query_threshold_ms']:.0f} ms): {len(metrics['slow_queries'])}")
+        for record in reversed(slow_queries):
+            where = f" in {record['operation']}" if record.get('operation') else ''
+            self.stdout.write(f"  {record['seconds'] * 1000:.1f} ms, {record['rows']} rows{where}")
+            if record.get('sql'):
+                self.stdout.write(f"    {record['sql'][:300]}")
+                self.stdout.write(f"    params: {record['params']}")
+
+        if options['pg']:
+            self.show_pg_stat_statements()
+
+    def show_pg_stat_statements(self, limit=10):
+        with db_connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'")
+            if cursor.fetchone() is None:
+                self.stdout.write(self.style.WARNING("\npg_stat_statements is not installed in this database"))
+                return
+            cursor.execute(PG_STAT_STATEMENTS_QUERY, (limit,))
+            rows = cursor.fetchall()
+        self.stdout.write("\nTop statements by total time (pg_stat_statements):")
+        for calls, total, mean, row_count, query in rows:
+            self.stdout.write(f"  {calls:>8} calls {total / 1000:>9.2f} s total {mean:>8.2f} ms mean {row_count:>9} rows  {query}")
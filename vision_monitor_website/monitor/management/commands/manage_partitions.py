@@ -0,0 +1,77 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand
+
+from monitor.config import RETENTION_DAYS, PARTITION_PREMAKE_DAYS, PARTITION_RETENTION_MODE
+from monitor.db_pool import db_connection
+from monitor.partitions import (
+    PARTITIONED_TABLES,
+    drop_expired_partitions,
+    ensure_partitions,
+    expired_partitions,
+    list_partitions,
+    newest_id,
+)
+
+
+class Command(BaseCommand):
+    help = 'Lists, pre-creates and retires the daily and id-range partitions of the visionmon tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--list', action='store_true', help='Only list partitions and what would be retired')
+        parser.add_argument('--days-ahead', type=int, default=PARTITION_PREMAKE_DAYS,
+                            help='Daily partitions to keep ready ahead of today')
+        parser.add_argument('--retention-days', type=int, default=RETENTION_DAYS,
+                            help='Retire partitions entirely older than this many days')
+        parser.add_argument('--mode', choices=['drop', 'detach'], default=PARTITION_RETENTION_MODE,
+                            help='DROP retired partitions, or DETACH them and keep the tables')
+
+    def handle(self, *args, **options):
+        if options['list']:
+            self.list_partitions(options['retention_days'])
+            return
+
+        created = ensure_partitions(days_ahead=options['days_ahead'])
+        for name in created:
+            self.stdout.write(f'  created  {name}')
+        retired = drop_expired_partitions(retention_days=options['retention_days'], mode=options['mode'])
+        for name in retired:
+            self.stdout.write(f'  {options["mode"]:<8} {name}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(created)} partition(s) created, {len(retired)} retired ({options["mode"]})'
+        ))
+
+    def list_partitions(self, retention_days):
+        expired = {partition['name'] for _, partition in expired_partitions(retention_days)}
+        now = datetime.now(dt_timezone.utc)
+        with db_connection() as conn, conn.cursor() as cursor:
+            for table, key in PARTITIONED_TABLES.items():
+                partitions = list_partitions(cursor, table)
+                # Id partitions lie in the future while no frame has reached them
+                frontier = newest_id(cursor, table) if key == 'id' and partitions else now
+                self.stdout.write(self.style.MIGRATE_HEADING(f'{table} ({len(partitions)} partitions)'))
+                if not partitions:
+                    self.stdout.write('  not partitioned; run migrations')
+                for partition in partitions:
+                    cursor.execute(
+                        "SELECT pg_size_pretty(pg_total_relation_size(to_regclass(%s)))", (partition['name'],)
+                    )
+                    size = cursor.fetchone()[0]
+                    if partition['default']:
+                        bounds = 'DEFAULT'
+                    else:
+                        lower = self.format_bound(partition['lower'], 'MINVALUE')
+                        upper = self.format_bound(partition['upper'], 'MAXVALUE')
+                        bounds = f'{lower} .. {upper}'
+                    if partition['name'] in expired:
+                        status = 'expired'
+                    elif partition['lower'] is not None and partition['lower'] > frontier:
+                        status = 'future'
+                    else:
+                        status = ''
+                    self.stdout.write(f'  {partition["name"]:<40} {bounds:<55} {size:>10} {status}')
+
+    def format_bound(self, bound, unbounded):
+        if bound is None:
+            return unbounded
+        return bound.isoformat() if isinstance(bound, datetime) else str(bound)
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+
+from monitor.config import (
+    FRAME_MIGRATION_BATCH_SIZE,
+    FRAME_MIGRATION_SLEEP,
+    FRAME_STORE_BACKEND,
+    FRAME_DEDUP_THRESHOLD,
+)
+from monitor.frame_store import move_frames_to_store, pending_frames, backfill_perceptual_hashes
+from monitor.retention import format_bytes
+
+
+class Command(BaseCommand):
+    help = 'Moves frame images from visionmon_binary_data into the content-addressed frame store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many frames are still in Postgres')
+        parser.add_argument('--batch-size', type=int, default=FRAME_MIGRATION_BATCH_SIZE, help='Frames moved per transaction')
+        parser.add_argument('--sleep', type=float, default=FRAME_MIGRATION_SLEEP, help='Seconds to pause between batches')
+        # No runtime limit by default: a manual run moves the whole backlog
+        parser.add_argument('--max-runtime', type=float, default=float('inf'),
+                            help='Stop after this many seconds; the next run continues where it stopped')
+        parser.add_argument('--dedup-threshold', type=int, default=FRAME_DEDUP_THRESHOLD,
+                            help="Share the previous frame's image when the perceptual hashes differ in at most this many bits; -1 disables")
+        parser.add_argument('--backfill-phash', action='store_true',
+                            help='Also record perceptual hashes of frames moved before they were computed')
+
+    def handle(self, *args, **options):
+        rows, size = pending_frames()
+        self.stdout.write(f"{rows} frames ({format_bytes(size)}) still stored in Postgres; store: {FRAME_STORE_BACKEND}")
+        if options['dry_run']:
+            return
+
+        if options['backfill_phash']:
+            stats = backfill_perceptual_hashes(batch_size=options['batch_size'], max_runtime=options['max_runtime'])
+            self.stdout.write(f"Recorded perceptual hashes of {stats['rows']} stored frames in {stats['seconds']:.1f}s"
+                              + ('' if stats['finished'] else '; unfinished, run again to continue'))
+        if not rows:
+            return
+
+        stats = move_frames_to_store(
+            batch_size=options['batch_size'],
+            sleep=options['sleep'],
+            max_runtime=options['max_runtime'],
+            dedup_threshold=options['dedup_threshold'],
+        )
+        line = (f"Moved {stats['rows']} frames ({format_bytes(stats['bytes'])}) in {stats['seconds']:.1f}s "
+                f"({stats['rows_per_sec']:.0f} frames/s), {stats['deduplicated']} near-duplicates share "
+                f"their predecessor's image")
+        if stats['finished']:
+            self.stdout.write(self.style.SUCCESS(line))
+        else:
+            self.stdout.write(self.style.WARNING(f"{line}; unfinished, run again to continue"))
+        self.stdout.write("Postgres frees the space once visionmon_binary_data is vacuumed")
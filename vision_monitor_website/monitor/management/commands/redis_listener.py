@@ -6,13 +6,15 @@ from django.core.management.base import BaseCommand
 from channels.layers import get_channel_layer
 import redis
 import os
-from django.conf import settings
 from asgiref.sync import async_to_sync
-import psycopg2
 from django.utils import timezone
 from django.urls import reverse
 from django.http import HttpRequest
 from monitor.notifications import process_scheduled_alerts_sync, notify
+from monitor.db_pool import db_connection
+from monitor.frame_cache import get_latest_frame_cache, camera_index_from_message
+from monitor.mosaic import get_mosaic_service
+from monitor.state_management import ingest_state_message, state_message_id
 
 logger = logging.getLogger(__name__)
 
@@ -84,8 +86,16 @@ class Command(BaseCommand):
                         logger.info(f"Received message from Redis channel {channel}: {data}")
 
                         if channel == REDIS_STATE_RESULT_CHANNEL:
-                            self.store_state_result_sync(data)
-                            self.trigger_notification_sync(data)
+                            received_at = timezone.now()
+                            self.store_state_result_sync(data, received_at)
+                            # Gate before ingesting: the alert transitions of an ingested
+                            # message are consumed, so they must be notified as well
+                            if self.notifications_enabled_sync():
+                                snapshot = ingest_state_message(data, state_message_id(received_at))
+                                if snapshot is not None:
+                                    self.trigger_notification_sync(snapshot)
+                        elif channel == REDIS_MESSAGE_CHANNEL:
+                            self.refresh_latest_frame_sync(data)
 
                         async_to_sync(channel_layer.group_send)(
                             "llm_output",
@@ -121,55 +131,58 @@ class Command(BaseCommand):
                 logger.error(f"Error in scheduled alerts processor: {str(e)}", exc_info=True)
                 time.sleep(REDIS_RECONNECT_DELAY)
 
-    def store_state_result_sync(self, raw_message):
+    def store_state_result_sync(self, raw_message, received_at):
         try:
-            conn = psycopg2.connect(
-                host=settings.DATABASES['default']['HOST'],
-                database=settings.DATABASES['default']['NAME'],
-                user=settings.DATABASES['default']['USER'],
-                password=settings.DATABASES['default']['PASSWORD'],
-                port=settings.DATABASES['default']['PORT'],
-            )
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    INSERT INTO state_result (raw_message, timestamp)
-                    VALUES (%s, %s)
-                """, (raw_message, timezone.now()))
-            conn.commit()
+            with db_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("""
+                        INSERT INTO state_result (raw_message, timestamp)
+                        VALUES (%s, %s)
+                    """, (raw_message, received_at))
+                conn.commit()
             logger.info(f"Stored raw message in database")
         except Exception as e:
             logger.error(f"Error storing raw message in database: {str(e)}")
-        finally:
-            if conn:
-                conn.close()
 
-    def trigger_notification_sync(self, raw_message):
+    def refresh_latest_frame_sync(self, message):
+        # A new analysis means a new frame for that camera; publish it to the
+        # shared latest-frame cache so image requests do not have to query Postgres
+        camera_index = camera_index_from_message(message)
+        if camera_index is None:
+            logger.warning(f"Could not find a camera index in message: {message[:100]}")
+            return
+        try:
+            frame = get_latest_frame_cache().refresh(camera_index)
+            if frame is not None:
+                logger.info(f"Refreshed cached latest frame for camera {camera_index} (data_id {frame.data_id})")
+                # Recompose the all-camera mosaic in the background
+                get_mosaic_service().schedule_refresh()
+        except Exception as e:
+            logger.error(f"Error refreshing latest frame for camera {camera_index}: {str(e)}")
+
+    def notifications_enabled_sync(self):
+        # Notify (and track states) only while at least 15 state results arrived in the last hour
         try:
-            conn = psycopg2.connect(
-                host=settings.DATABASES['default']['HOST'],
-                database=settings.DATABASES['default']['NAME'],
-                user=settings.DATABASES['default']['USER'],
-                password=settings.DATABASES['default']['PASSWORD'],
-                port=settings.DATABASES['default']['PORT'],
-            )
-            with conn.cursor() as cursor:
+            with db_connection() as conn, conn.cursor() as cursor:
                 cursor.execute("""
                     SELECT COUNT(*) FROM state_result
                     WHERE timestamp >= %s
                 """, (timezone.now() - timezone.timedelta(hours=1),))
                 count = cursor.fetchone()[0]
+        except Exception as e:
+            logger.error(f"Error counting recent state results: {str(e)}")
+            return False
+        if count < 15:
+            logger.info(f"Skipped notification. Only {count} state results in the last hour.")
+        return count >= 15
 
-            if count >= 15:
-                request = HttpRequest()
-                request.META['SERVER_NAME'] = 'example.com'
-                request.META['SERVER_PORT'] = '8000'
+    def trigger_notification_sync(self, snapshot):
+        try:
+            request = HttpRequest()
+            request.META['SERVER_NAME'] = 'example.com'
+            request.META['SERVER_PORT'] = '8000'
 
-                notify(request, raw_message)
-                logger.info(f"Triggered notification with raw message")
-            else:
-                logger.info(f"Skipped notification. Only {count} state results in the last hour.")
+            notify(request, snapshot)
+            logger.info(f"Triggered notification for state version {snapshot.version}")
         except Exception as e:
             logger.error(f"Error in trigger_notification_sync: {str(e)}")
-        finally:
-            if conn:
-                conn.close()
\ No newline at end of file
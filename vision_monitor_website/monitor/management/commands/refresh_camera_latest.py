@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from monitor.db_operations import LATEST_FRAME_ANALYSES_SCAN, REFRESH_CAMERA_LATEST
+from monitor.db_pool import db_connection
+
+
+class Command(BaseCommand):
+    help = 'Backfills or repairs the camera_latest table from visionmon_metadata'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only report cameras whose camera_latest row differs from the metadata history')
+
+    def handle(self, *args, **options):
+        with db_connection() as conn:
+            if options['check']:
+                self.report_drift(conn)
+                return
+
+            started = time.perf_counter()
+            with conn.cursor() as cursor:
+                cursor.execute(REFRESH_CAMERA_LATEST)
+                updated, removed = cursor.fetchone()
+            conn.commit()
+            elapsed = (time.perf_counter() - started) * 1000
+            self.stdout.write(self.style.SUCCESS(
+                f'camera_latest refreshed in {elapsed:.0f} ms: {updated} row(s) written, {removed} removed'
+            ))
+
+    def report_drift(self, conn):
+        with conn.cursor() as cursor:
+            cursor.execute(LATEST_FRAME_ANALYSES_SCAN)
+            expected = {row[0]: row for row in cursor.fetchall() }
+            cursor.execute("""
+                SELECT camera_id, camera_index, timestamp, description, camera_name
+                FROM camera_latest
+            """)
+            actual = {row[0]: row for row in cursor.fetchall()}
+
+        drifted = sorted(camera_id for camera_id in expected.keys() | actual.keys()
+                         if expected.get(camera_id) != actual.get(camera_id))
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS(f'camera_latest is up to date ({len(actual)} cameras)'))
+            return
+        for camera_id in drifted:
+            self.stdout.write(f'  {camera_id}: expected {expected.get(camera_id)}, found {actual.get(camera_id)}')
+        self.stdout.write(self.style.WARNING(
+            f'{len(drifted)} camera(s) out of date; run without --check to repair'
+        ))
@@ -0,0 +1,91 @@
+import json
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from monitor.replay import default_camera_config, load_state_messages, replay, replay_live
+
+TRANSITIONS = ('ALERT', 'RESOLVED', 'FLAPPING_START', 'FLAPPING_END')
+
+
+class Command(BaseCommand):
+    help = ('Replays stored state_result messages through the state windows and alert logic and counts the '
+            'alerts each camera would have produced, optionally with other camera_alert_config penalties')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=7, help='Replay this many days up to --end')
+        parser.add_argument('--start', help='First day to replay (YYYY-MM-DD); overrides --days')
+        parser.add_argument('--end', help='Day after the last one to replay (YYYY-MM-DD, default now)')
+        parser.add_argument('--config', help='JSON file in the shape of camera_alert_config to replay with')
+        parser.add_argument('--penalty', action='append', default=[], metavar='CAMERA=PENALTY',
+                            help="Replay with another penalty for one camera, e.g. --penalty 'Hall 2=0.6'")
+        parser.add_argument('--verify', action='store_true',
+                            help='Also replay message by message through StateWindow and AlertManager and compare')
+
+    def handle(self, *args, **options):
+        end_time = self.parse_day(options['end']) if options['end'] else timezone.now()
+        start_time = self.parse_day(options['start']) if options['start'] else end_time - timedelta(days=options['days'])
+        camera_config = self.camera_config(options['config'], options['penalty'])
+
+        started = time.perf_counter()
+        messages = load_state_messages(start_time, end_time)
+        self.stdout.write(f"Loaded {len(messages)} state messages from {start_time:%Y-%m-%d %H:%M} "
+                          f"to {end_time:%Y-%m-%d %H:%M} in {time.perf_counter() - started:.1f}s")
+        if not messages:
+            return
+
+        started = time.perf_counter()
+        result = replay(messages, camera_config)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"Replayed in {elapsed * 1000:.0f} ms ({elapsed * 1e6 / len(messages):.1f} us/message)")
+
+        self.stdout.write(f"{'camera':<20} {'messages':>8} " + ' '.join(f'{name:>14}' for name in TRANSITIONS))
+        for camera_id in sorted(result['cameras']):
+            camera_result = result['cameras'][camera_id]
+            counts = Counter(transition for _, transition, _ in camera_result['alerts'])
+            self.stdout.write(f"{camera_id:<20} {len(camera_result['indexes']):>8} "
+                              + ' '.join(f'{counts[name]:>14}' for name in TRANSITIONS))
+
+        if options['verify']:
+            self.verify(messages, result, camera_config)
+
+    def verify(self, messages, result, camera_config):
+        started = time.perf_counter()
+        live = replay_live(messages, camera_config)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"Live path took {elapsed * 1000:.0f} ms ({elapsed * 1e6 / len(messages):.1f} us/message)")
+        differences = []
+        if live['facility'] != result['facility']:
+            differences.append('facility modes')
+        for camera_id, camera_result in live['cameras'].items():
+            for key in ('modes', 'alerts'):
+                if camera_result[key] != result['cameras'][camera_id][key]:
+                    differences.append(f'{camera_id} {key}')
+        if differences:
+            raise CommandError(f"Replay differs from the live path: {', '.join(differences)}")
+        self.stdout.write(self.style.SUCCESS("Identical to the live path for every message"))
+
+    def parse_day(self, value):
+        try:
+            return timezone.make_aware(datetime.strptime(value, '%Y-%m-%d'))
+        except ValueError:
+            raise CommandError(f"Invalid date: {value} (expected YYYY-MM-DD)")
+
+    def camera_config(self, path, penalties):
+        if not path and not penalties:
+            return None
+        if path:
+            with open(path) as f:
+                camera_config = {camera_id: {"penalty": config["penalty"], "alert_states": set(config["alert_states"])}
+                                 for camera_id, config in json.load(f).items()}
+        else:
+            camera_config = default_camera_config()
+        for override in penalties:
+            camera_id, separator, penalty = override.rpartition('=')
+            if not separator or camera_id not in camera_config:
+                raise CommandError(f"Invalid --penalty {override!r}: expected CAMERA=PENALTY for a configured camera")
+            camera_config[camera_id]["penalty"] = float(penalty)
+        return camera_config
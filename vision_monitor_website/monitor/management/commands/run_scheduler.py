@@ -1,6 +1,6 @@
 from django.core.management.base import BaseCommand
 from monitor.openai_operations import run_scheduler
-from monitor.scheduled_tasks import run_no_show_checks, run_cleanup_old_entries
+from monitor.scheduled_tasks import run_no_show_checks, run_cleanup_old_entries, run_frame_migration
 import threading
 import asyncio
 import logging
@@ -18,8 +18,8 @@ class Command(BaseCommand):
         )
 
     async def run_tasks(self):
-        # Gather both tasks to run concurrently
-        await asyncio.gather(run_no_show_checks(), run_cleanup_old_entries())
+        # Gather the tasks to run concurrently
+        await asyncio.gather(run_no_show_checks(), run_cleanup_old_entries(), run_frame_migration())
 
     def handle(self, *args, **options):
         logger.info('Starting scheduler and no-show checks...')
@@ -0,0 +1,172 @@
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from monitor.config import FLAP_THRESHOLD, FLAP_INTERVAL, STATE_WINDOW_MINUTES
+from monitor.replay import (
+    alert_state_matches,
+    alert_transitions,
+    default_camera_config,
+    encode_messages,
+    load_state_messages,
+    time_to_alert,
+    windowed_modes,
+)
+
+CSV_FIELDS = ('camera', 'penalty', 'window_minutes', 'flap_threshold', 'flap_interval',
+              'alerts', 'resolved', 'flaps', 'median_time_to_alert', 'p90_time_to_alert')
+
+# Set in each worker process by init_worker(), so the encoded history is sent once per worker
+_encoded = None
+_matches = None
+
+
+def init_worker(encoded, matches):
+    global _encoded, _matches
+    _encoded, _matches = encoded, matches
+
+
+def sweep_task(camera_id, penalty, window_minutes, flap_thresholds, flap_intervals):
+    """
+    Results of one camera with one penalty and window length, for every flap
+    setting: the windows are replayed once, the cheap flap detection per setting.
+    """
+    weights = np.where(_matches[camera_id], penalty, 1.0)
+    indexes, codes = _encoded['cameras'][camera_id]
+    seconds = _encoded['seconds'][indexes]
+    raw_alerting = _encoded['alerting'][codes]
+    modes = windowed_modes(_encoded['times'][indexes], codes, _encoded['relevant'], weights,
+                           max_age=timedelta(minutes=window_minutes), maxlen=int(window_minutes * 60))
+    mode_alerting = _encoded['alerting'][modes]
+    results = []
+    for flap_threshold in flap_thresholds:
+        for flap_interval in flap_intervals:
+            changed, transitions = alert_transitions(seconds, mode_alerting, flap_threshold, flap_interval)
+            alerts = changed[transitions == 'ALERT']
+            delays = time_to_alert(seconds, raw_alerting, mode_alerting, alerts)
+            results.append({
+                'camera': camera_id,
+                'penalty': penalty,
+                'window_minutes': window_minutes,
+                'flap_threshold': flap_threshold,
+                'flap_interval': flap_interval,
+                'alerts': len(alerts),
+                'resolved': int((transitions == 'RESOLVED').sum()),
+                'flaps': int((transitions == 'FLAPPING_START').sum()),
+                'median_time_to_alert': float(np.median(delays)) if len(delays) else None,
+                'p90_time_to_alert': float(np.percentile(delays, 90)) if len(delays) else None,
+            })
+    return results
+
+
+def parse_list(value, cast):
+    try:
+        return sorted({cast(item) for item in value.split(',') if item.strip()})
+    except ValueError:
+        raise CommandError(f"Invalid list: {value}")
+
+
+class Command(BaseCommand):
+    help = ('Replays stored state_result messages over a grid of camera penalties, window lengths and flap '
+            'settings in a process pool, and reports alerts, flaps and time to alert per camera')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=7, help='Replay this many days up to --end')
+        parser.add_argument('--start', help='First day to replay (YYYY-MM-DD); overrides --days')
+        parser.add_argument('--end', help='Day after the last one to replay (YYYY-MM-DD, default now)')
+        parser.add_argument('--cameras', help='Comma-separated camera ids to tune (default all configured)')
+        parser.add_argument('--penalties', default='0.1,0.25,0.4,0.55,0.7,0.85,1.0',
+                            help="Penalties to try; each camera's current penalty is always included")
+        parser.add_argument('--window-minutes', default=str(STATE_WINDOW_MINUTES),
+                            help='Window lengths to try, in minutes (the window keeps at most one state per second)')
+        parser.add_argument('--flap-thresholds', default=str(FLAP_THRESHOLD),
+                            help='Numbers of alert changes that make an alert flapping')
+        parser.add_argument('--flap-intervals', default=str(FLAP_INTERVAL),
+                            help='Seconds within which those changes make an alert flapping')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Worker processes')
+        parser.add_argument('--csv', help='Also write every result to this CSV file')
+
+    def handle(self, *args, **options):
+        end_time = self.parse_day(options['end']) if options['end'] else timezone.now()
+        start_time = self.parse_day(options['start']) if options['start'] else end_time - timedelta(days=options['days'])
+        penalties = parse_list(options['penalties'], float)
+        window_minutes = parse_list(options['window_minutes'], float)
+        flap_thresholds = parse_list(options['flap_thresholds'], int)
+        flap_intervals = parse_list(options['flap_intervals'], float)
+        if any(threshold < 1 for threshold in flap_thresholds):
+            raise CommandError("Flap thresholds must be at least 1")
+
+        camera_config = default_camera_config()
+        if options['cameras']:
+            unknown = set(options['cameras'].split(',')) - set(camera_config)
+            if unknown:
+                raise CommandError(f"Unknown cameras: {', '.join(sorted(unknown))}")
+            camera_config = {camera_id: camera_config[camera_id] for camera_id in options['cameras'].split(',')}
+
+        started = time.perf_counter()
+        messages = load_state_messages(start_time, end_time)
+        if not messages:
+            self.stdout.write("No state messages in that range")
+            return
+        encoded = encode_messages(messages)
+        camera_config = {camera_id: config for camera_id, config in camera_config.items() if camera_id in encoded['cameras']}
+        matches = {camera_id: alert_state_matches(encoded, config['alert_states']) for camera_id, config in camera_config.items()}
+        self.stdout.write(f"Loaded and encoded {len(messages)} state messages ({len(encoded['states'])} distinct states) "
+                          f"in {time.perf_counter() - started:.1f}s")
+
+        tasks = [
+            (camera_id, penalty, minutes, flap_thresholds, flap_intervals)
+            for camera_id, config in camera_config.items()
+            for penalty in sorted(set(penalties) | {config['penalty']})
+            for minutes in window_minutes
+        ]
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=max(1, options['workers']), initializer=init_worker,
+                                 initargs=(encoded, matches)) as executor:
+            results = [result for task_results in executor.map(sweep_task, *zip(*tasks)) for result in task_results]
+        self.stdout.write(f"Replayed {len(results)} combinations in {time.perf_counter() - started:.1f}s "
+                          f"with {options['workers']} workers")
+
+        self.report(results, camera_config)
+        if options['csv']:
+            with open(options['csv'], 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+                writer.writeheader()
+                writer.writerows(results)
+            self.stdout.write(f"Wrote {len(results)} results to {options['csv']}")
+
+    def report(self, results, camera_config):
+        current = (STATE_WINDOW_MINUTES, FLAP_THRESHOLD, FLAP_INTERVAL)
+        header = (f"  {'penalty':>7} {'window':>7} {'flap n':>6} {'flap s':>7} {'alerts':>7} {'flaps':>6} "
+                  f"{'median tta':>11} {'p90 tta':>8}")
+        self.stdout.write("tta: time to alert, from the first alerting state a camera sent to the alert")
+        for camera_id in camera_config:
+            self.stdout.write(f"\n{camera_id} (current penalty {camera_config[camera_id]['penalty']}, * = current settings)")
+            self.stdout.write(header)
+            for result in results:
+                if result['camera'] != camera_id:
+                    continue
+                marker = '*' if (result['penalty'] == camera_config[camera_id]['penalty'] and
+                                 (result['window_minutes'], result['flap_threshold'], result['flap_interval']) == current) else ' '
+                self.stdout.write(
+                    f"{marker} {result['penalty']:>7g} {result['window_minutes']:>6g}m {result['flap_threshold']:>6} "
+                    f"{result['flap_interval']:>6g}s {result['alerts']:>7} {result['flaps']:>6} "
+                    f"{self.format_delay(result['median_time_to_alert']):>11} {self.format_delay(result['p90_time_to_alert']):>8}"
+                )
+
+    def format_delay(self, seconds):
+        if seconds is None:
+            return '-'
+        return f"{seconds / 60:.1f}m"
+
+    def parse_day(self, value):
+        try:
+            return timezone.make_aware(datetime.strptime(value, '%Y-%m-%d'))
+        except ValueError:
+            raise CommandError(f"Invalid date: {value} (expected YYYY-MM-DD)")
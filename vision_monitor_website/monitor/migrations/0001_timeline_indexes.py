@@ -0,0 +1,29 @@
+from django.db import migrations
+
+from ._operations import RunPostgresSQL
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block.
+    atomic = False
+
+    dependencies = []
+
+    operations = [
+        # Range scan + index-only lookups of the state rows spanning a timeline page.
+        RunPostgresSQL(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS state_result_timestamp_id_idx "
+            "ON state_result (timestamp, id)",
+            "DROP INDEX CONCURRENTLY IF EXISTS state_result_timestamp_id_idx",
+        ),
+        RunPostgresSQL(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS visionmon_metadata_timestamp_idx "
+            "ON visionmon_metadata (timestamp)",
+            "DROP INDEX CONCURRENTLY IF EXISTS visionmon_metadata_timestamp_idx",
+        ),
+        RunPostgresSQL(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS visionmon_metadata_camera_id_timestamp_idx "
+            "ON visionmon_metadata (camera_id, timestamp)",
+            "DROP INDEX CONCURRENTLY IF EXISTS visionmon_metadata_camera_id_timestamp_idx",
+        ),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations
+
+from ._operations import RunPostgresSQL
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('monitor', '0001_timeline_indexes'),
+    ]
+
+    operations = [
+        # Keyset pagination seeks on (timestamp, id) < (cursor_ts, cursor_id), newest first.
+        # These supersede the single-column indexes from 0001, which are dropped once
+        # the composite ones exist.
+        RunPostgresSQL(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS visionmon_metadata_timestamp_id_idx "
+            "ON visionmon_metadata (timestamp, id)",
+            "DROP INDEX CONCURRENTLY IF EXISTS visionmon_metadata_timestamp_id_idx",
+        ),
+        RunPostgresSQL(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS visionmon_metadata_camera_id_timestamp_id_idx "
+            "ON visionmon_metadata (camera_id, timestamp, id)",
+            "DROP INDEX CONCURRENTLY IF EXISTS visionmon_metadata_camera_id_timestamp_id_idx",
+        ),
+        RunPostgresSQL(
+            "DROP INDEX CONCURRENTLY IF EXISTS visionmon_metadata_timestamp_idx",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS visionmon_metadata_timestamp_idx "
+            "ON visionmon_metadata (timestamp)",
+        ),
+        RunPostgresSQL(
+            "DROP INDEX CONCURRENTLY IF EXISTS visionmon_metadata_camera_id_timestamp_idx",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS visionmon_metadata_camera_id_timestamp_idx "
+            "ON visionmon_metadata (camera_id, timestamp)",
+        ),
+    ]
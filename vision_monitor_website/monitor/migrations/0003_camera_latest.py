@@ -0,0 +1,130 @@
+from django.db import migrations
+
+from ._operations import RunPostgresSQL
+
+
+CREATE_CAMERA_LATEST = """
+CREATE TABLE IF NOT EXISTS camera_latest (
+    camera_id text PRIMARY KEY,
+    metadata_id bigint NOT NULL,
+    camera_index integer,
+    camera_name text,
+    timestamp timestamptz,
+    description text,
+    data_id bigint,
+    updated_at timestamptz NOT NULL DEFAULT now()
+)
+"""
+
+# Statement-level triggers see every row of a (possibly multi-row) INSERT or DELETE
+# through a transition table, so bulk retention deletes cost one pass per statement
+# rather than one lookup per deleted row.
+CREATE_TRIGGERS = """
+CREATE OR REPLACE FUNCTION camera_latest_after_insert() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO camera_latest AS cl
+        (camera_id, metadata_id, camera_index, camera_name, timestamp, description, data_id, updated_at)
+    SELECT DISTINCT ON (camera_id)
+        camera_id, id, camera_index, camera_name, timestamp, description, data_id, now()
+    FROM new_rows
+    WHERE camera_id IS NOT NULL
+    ORDER BY camera_id, timestamp DESC NULLS LAST, id DESC
+    ON CONFLICT (camera_id) DO UPDATE SET
+        metadata_id = EXCLUDED.metadata_id,
+        camera_index = EXCLUDED.camera_index,
+        camera_name = EXCLUDED.camera_name,
+        timestamp = EXCLUDED.timestamp,
+        description = EXCLUDED.description,
+        data_id = EXCLUDED.data_id,
+        updated_at = EXCLUDED.updated_at
+    WHERE cl.timestamp IS NULL
+       OR (EXCLUDED.timestamp, EXCLUDED.metadata_id) >= (cl.timestamp, cl.metadata_id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION camera_latest_after_delete() RETURNS trigger AS $$
+BEGIN
+    -- Only cameras whose current latest row was deleted need recomputing.
+    UPDATE camera_latest cl SET
+        metadata_id = vm.id,
+        camera_index = vm.camera_index,
+        camera_name = vm.camera_name,
+        timestamp = vm.timestamp,
+        description = vm.description,
+        data_id = vm.data_id,
+        updated_at = now()
+    FROM old_rows o
+    CROSS JOIN LATERAL (
+        SELECT *
+        FROM visionmon_metadata m
+        WHERE m.camera_id = o.camera_id
+        ORDER BY m.timestamp DESC NULLS LAST, m.id DESC
+        LIMIT 1
+    ) vm
+    WHERE cl.camera_id = o.camera_id AND cl.metadata_id = o.id;
+
+    -- Cameras with no metadata left at all.
+    DELETE FROM camera_latest cl
+    USING old_rows o
+    WHERE cl.camera_id = o.camera_id AND cl.metadata_id = o.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS camera_latest_insert ON visionmon_metadata;
+CREATE TRIGGER camera_latest_insert
+    AFTER INSERT ON visionmon_metadata
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION camera_latest_after_insert();
+
+DROP TRIGGER IF EXISTS camera_latest_delete ON visionmon_metadata;
+CREATE TRIGGER camera_latest_delete
+    AFTER DELETE ON visionmon_metadata
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION camera_latest_after_delete();
+"""
+
+DROP_TRIGGERS = """
+DROP TRIGGER IF EXISTS camera_latest_insert ON visionmon_metadata;
+DROP TRIGGER IF EXISTS camera_latest_delete ON visionmon_metadata;
+DROP FUNCTION IF EXISTS camera_latest_after_insert();
+DROP FUNCTION IF EXISTS camera_latest_after_delete();
+"""
+
+# Runs after the triggers exist, so rows inserted meanwhile are not missed; the
+# timestamp guard keeps a newer trigger-written row from being overwritten.
+BACKFILL_CAMERA_LATEST = """
+INSERT INTO camera_latest AS cl
+    (camera_id, metadata_id, camera_index, camera_name, timestamp, description, data_id)
+SELECT DISTINCT ON (camera_id)
+    camera_id, id, camera_index, camera_name, timestamp, description, data_id
+FROM visionmon_metadata
+WHERE camera_id IS NOT NULL
+ORDER BY camera_id, timestamp DESC NULLS LAST, id DESC
+ON CONFLICT (camera_id) DO UPDATE SET
+    metadata_id = EXCLUDED.metadata_id,
+    camera_index = EXCLUDED.camera_index,
+    camera_name = EXCLUDED.camera_name,
+    timestamp = EXCLUDED.timestamp,
+    description = EXCLUDED.description,
+    data_id = EXCLUDED.data_id,
+    updated_at = now()
+WHERE cl.timestamp IS NULL
+   OR (EXCLUDED.timestamp, EXCLUDED.metadata_id) >= (cl.timestamp, cl.metadata_id)
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitor', '0002_timeline_keyset_indexes'),
+    ]
+
+    operations = [
+        # One row per camera holding its most recent visionmon_metadata row, kept
+        # current by triggers so the dashboards never scan the metadata history.
+        RunPostgresSQL(CREATE_CAMERA_LATEST, "DROP TABLE IF EXISTS camera_latest"),
+        RunPostgresSQL(CREATE_TRIGGERS, DROP_TRIGGERS),
+        RunPostgresSQL(BACKFILL_CAMERA_LATEST, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,150 @@
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+from ._operations import RunPostgresSQL
+
+
+CREATE_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS visionmon_binary_data (
+        id serial PRIMARY KEY,
+        data bytea
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS visionmon_metadata (
+        id serial PRIMARY KEY,
+        camera_id text,
+        camera_index integer,
+        timestamp timestamptz,
+        description text,
+        camera_name text,
+        data_id integer
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS state_result (
+        id serial PRIMARY KEY,
+        raw_message text,
+        timestamp timestamptz
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS facility_status (
+        id serial PRIMARY KEY,
+        raw_message text,
+        timestamp timestamptz
+    )
+    """,
+]
+
+# Indexes created by 0001/0002 under names longer than Django allows (30 chars).
+RENAMED_INDEXES = [
+    ('visionmon_metadata_timestamp_id_idx', 'vm_meta_ts_id_idx'),
+    ('visionmon_metadata_camera_id_timestamp_id_idx', 'vm_meta_camera_ts_id_idx'),
+    ('state_result_timestamp_id_idx', 'state_result_ts_id_idx'),
+]
+
+INDEXES = [
+    ('vm_meta_ts_id_idx', 'visionmon_metadata', 'btree', '(timestamp, id)'),
+    ('vm_meta_camera_ts_id_idx', 'visionmon_metadata', 'btree', '(camera_id, timestamp, id)'),
+    ('vm_meta_camera_index_ts_idx', 'visionmon_metadata', 'btree', '(camera_index, timestamp)'),
+    ('vm_meta_data_id_idx', 'visionmon_metadata', 'btree', '(data_id)'),
+    ('state_result_ts_id_idx', 'state_result', 'btree', '(timestamp, id)'),
+    ('facility_status_ts_brin', 'facility_status', 'brin', '(timestamp)'),
+]
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block.
+    atomic = False
+
+    dependencies = [
+        ('monitor', '0003_camera_latest'),
+    ]
+
+    operations = [
+        # The tables already exist in production, so only the migration state gets
+        # the models; the database side just makes sure the tables are there.
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                RunPostgresSQL(sql, migrations.RunSQL.noop) for sql in CREATE_TABLES
+            ],
+            state_operations=[
+                migrations.CreateModel(
+                    name='VisionmonBinaryData',
+                    fields=[
+                        ('id', models.AutoField(primary_key=True, serialize=False)),
+                        ('data', models.BinaryField(null=True)),
+                    ],
+                    options={
+                        'db_table': 'visionmon_binary_data',
+                    },
+                ),
+                migrations.CreateModel(
+                    name='VisionmonMetadata',
+                    fields=[
+                        ('id', models.AutoField(primary_key=True, serialize=False)),
+                        ('camera_id', models.TextField(null=True)),
+                        ('camera_index', models.IntegerField(null=True)),
+                        ('timestamp', models.DateTimeField(null=True)),
+                        ('description', models.TextField(null=True)),
+                        ('camera_name', models.TextField(null=True)),
+                        ('data_id', models.IntegerField(null=True)),
+                    ],
+                    options={
+                        'db_table': 'visionmon_metadata',
+                        'indexes': [
+                            models.Index(fields=['timestamp', 'id'], name='vm_meta_ts_id_idx'),
+                            models.Index(fields=['camera_id', 'timestamp', 'id'], name='vm_meta_camera_ts_id_idx'),
+                            models.Index(fields=['camera_index', 'timestamp'], name='vm_meta_camera_index_ts_idx'),
+                            models.Index(fields=['data_id'], name='vm_meta_data_id_idx'),
+                        ],
+                    },
+                ),
+                migrations.CreateModel(
+                    name='StateResult',
+                    fields=[
+                        ('id', models.AutoField(primary_key=True, serialize=False)),
+                        ('raw_message', models.TextField(null=True)),
+                        ('timestamp', models.DateTimeField(null=True)),
+                    ],
+                    options={
+                        'db_table': 'state_result',
+                        'indexes': [
+                            models.Index(fields=['timestamp', 'id'], name='state_result_ts_id_idx'),
+                        ],
+                    },
+                ),
+                migrations.CreateModel(
+                    name='FacilityStatus',
+                    fields=[
+                        ('id', models.AutoField(primary_key=True, serialize=False)),
+                        ('raw_message', models.TextField(null=True)),
+                        ('timestamp', models.DateTimeField(null=True)),
+                    ],
+                    options={
+                        'db_table': 'facility_status',
+                        'indexes': [
+                            django.contrib.postgres.indexes.BrinIndex(fields=['timestamp'], name='facility_status_ts_brin'),
+                        ],
+                    },
+                ),
+            ],
+        ),
+        *[
+            RunPostgresSQL(
+                f"ALTER INDEX IF EXISTS {old_name} RENAME TO {new_name}",
+                f"ALTER INDEX IF EXISTS {new_name} RENAME TO {old_name}",
+            )
+            for old_name, new_name in RENAMED_INDEXES
+        ],
+        *[
+            RunPostgresSQL(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} USING {method} {columns}",
+                f"DROP INDEX CONCURRENTLY IF EXISTS {name}",
+            )
+            for name, table, method, columns in INDEXES
+            if name not in {new_name for _, new_name in RENAMED_INDEXES}
+        ],
+    ]
@@ -0,0 +1,176 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import migrations, models, transaction
+
+
+# (table, partition key, indexes the partitioned parent carries)
+TABLES = [
+    ('visionmon_metadata', 'timestamp', [
+        ('vm_meta_ts_id_idx', 'btree', '(timestamp, id)'),
+        ('vm_meta_camera_ts_id_idx', 'btree', '(camera_id, timestamp, id)'),
+        ('vm_meta_camera_index_ts_idx', 'btree', '(camera_index, timestamp)'),
+        ('vm_meta_data_id_idx', 'btree', '(data_id)'),
+        ('vm_meta_id_idx', 'btree', '(id)'),
+    ]),
+    # Frames are looked up by id, so binary data is partitioned by id range and
+    # keeps its primary key; see BINARY_PARTITION_IDS.
+    ('visionmon_binary_data', 'id', []),
+    ('state_result', 'timestamp', [
+        ('state_result_ts_id_idx', 'btree', '(timestamp, id)'),
+        ('state_result_id_idx', 'btree', '(id)'),
+    ]),
+]
+
+PREMAKE_DAYS = 7
+
+# Ids per visionmon_binary_data partition and empty partitions made ahead of the
+# newest id (the defaults of BINARY_PARTITION_IDS and BINARY_PARTITIONS_AHEAD)
+BINARY_PARTITION_IDS = 1_000_000
+BINARY_PARTITIONS_AHEAD = 2
+
+# Partitions cannot have triggers with transition tables, so the camera_latest
+# triggers from 0003 move from the old table to the partitioned parent.
+DROP_CAMERA_LATEST_TRIGGERS = """
+DROP TRIGGER IF EXISTS camera_latest_insert ON visionmon_metadata_legacy;
+DROP TRIGGER IF EXISTS camera_latest_delete ON visionmon_metadata_legacy;
+"""
+
+CREATE_CAMERA_LATEST_TRIGGERS = """
+CREATE TRIGGER camera_latest_insert
+    AFTER INSERT ON visionmon_metadata
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION camera_latest_after_insert();
+CREATE TRIGGER camera_latest_delete
+    AFTER DELETE ON visionmon_metadata
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION camera_latest_after_delete();
+"""
+
+
+def partition_tables(apps, schema_editor):
+    """
+    Turn each table into a range-partitioned table without copying it: the
+    existing table is renamed to <table>_legacy and attached as the partition for
+    everything before the cutover. Metadata and state results are partitioned by
+    day, with the cutover at midnight UTC tomorrow; binary data is partitioned by
+    id, with the cutover at least BINARY_PARTITION_IDS ids past the newest frame.
+    Daily or id-range partitions and a DEFAULT partition take the rows from then
+    on. Once the legacy rows fall out of the retention window the whole legacy
+    partition is dropped like any other.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+
+    today = datetime.now(dt_timezone.utc).date()
+    midnight = datetime(today.year, today.month, today.day, tzinfo=dt_timezone.utc) + timedelta(days=1)
+
+    with connection.cursor() as cursor:
+        for table, key, indexes in TABLES:
+            cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table])
+            row = cursor.fetchone()
+            if row is None or row[0] == 'p':
+                continue
+            legacy = f'{table}_legacy'
+            bound = f'{legacy}_bound'
+
+            # Steps outside the swap transaction, so they do not hold locks for long:
+            if key == 'id':
+                # Ids come from a sequence, so every row fits below the cutover; the
+                # headroom covers the frames inserted until the swap.
+                cursor.execute(f"SELECT coalesce(max(id), 0) FROM {table}")
+                cutover = (cursor.fetchone()[0] // BINARY_PARTITION_IDS + 2) * BINARY_PARTITION_IDS
+                # created_at dates the frames for the retention of id partitions and the
+                # cold tier. Constant default, so no table rewrite; existing rows read as -infinity.
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS created_at timestamptz NOT NULL DEFAULT '-infinity'")
+                cursor.execute(f"ALTER TABLE {table} ALTER COLUMN created_at SET DEFAULT now()")
+            else:
+                cutover = midnight
+                # Rows that cannot live in the legacy partition (NULL keys, clocks running
+                # ahead) are parked and re-inserted through the partitioned table below.
+                cursor.execute(f"CREATE TABLE IF NOT EXISTS {table}_parked (LIKE {table})")
+                cursor.execute(f"""
+                    WITH moved AS (DELETE FROM {table} WHERE {key} IS NULL OR {key} >= %s RETURNING *)
+                    INSERT INTO {table}_parked SELECT * FROM moved
+                """, [cutover])
+                # The primary key index is unique and cannot back the parent's plain (id) index.
+                cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {legacy}_id_idx ON {table} (id)")
+            # A validated CHECK matching the partition bound lets ATTACH skip its full-table scan.
+            cursor.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {bound}")
+            cursor.execute(f"""
+                ALTER TABLE {table} ADD CONSTRAINT {bound}
+                CHECK ({key} IS NOT NULL AND {key} < %s) NOT VALID
+            """, [cutover])
+            cursor.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {bound}")
+
+            with transaction.atomic(using=connection.alias):
+                cursor.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+                if table == 'visionmon_metadata':
+                    cursor.execute(DROP_CAMERA_LATEST_TRIGGERS)
+                for name, _, _ in indexes:
+                    cursor.execute(f"ALTER INDEX IF EXISTS {name} RENAME TO {name}_legacy")
+                # A primary key must include the partition key, so only binary data keeps
+                # one; the legacy primary key index is attached to it, nothing is rebuilt.
+                primary_key = ', PRIMARY KEY (id)' if key == 'id' else ''
+                cursor.execute(f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS{primary_key}) PARTITION BY RANGE ({key})")
+                cursor.execute(f"SELECT pg_get_serial_sequence('{legacy}', 'id')")
+                sequence = cursor.fetchone()[0]
+                if sequence:
+                    cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id")
+                for name, method, columns in indexes:
+                    cursor.execute(f"CREATE INDEX {name} ON ONLY {table} USING {method} {columns}")
+                # Matching legacy indexes are attached to the parent's; nothing is rebuilt.
+                cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {legacy} FOR VALUES FROM (MINVALUE) TO (%s)", [cutover])
+                cursor.execute(f"ALTER TABLE {legacy} DROP CONSTRAINT {bound}")
+                cursor.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+                if key == 'id':
+                    for offset in range(BINARY_PARTITIONS_AHEAD):
+                        start = cutover + offset * BINARY_PARTITION_IDS
+                        cursor.execute(
+                            f"CREATE TABLE {table}_p{start} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)",
+                            [start, start + BINARY_PARTITION_IDS]
+                        )
+                else:
+                    for offset in range(PREMAKE_DAYS + 1):
+                        start = cutover + timedelta(days=offset)
+                        cursor.execute(
+                            f"CREATE TABLE {table}_p{start:%Y%m%d} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)",
+                            [start, start + timedelta(days=1)]
+                        )
+                if key != 'id':
+                    cursor.execute(f"INSERT INTO {table} SELECT * FROM {table}_parked")
+                    cursor.execute(f"DROP TABLE {table}_parked")
+                if table == 'visionmon_metadata':
+                    cursor.execute(CREATE_CAMERA_LATEST_TRIGGERS)
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block; the table
+    # swap itself runs in its own transaction.
+    atomic = False
+
+    dependencies = [
+        ('monitor', '0004_visionmon_models'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_tables, elidable=False),
+        # partition_tables() already made these changes in the database.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddField(
+                    model_name='visionmonbinarydata',
+                    name='created_at',
+                    field=models.DateTimeField(auto_now_add=True),
+                ),
+                migrations.AddIndex(
+                    model_name='visionmonmetadata',
+                    index=models.Index(fields=['id'], name='vm_meta_id_idx'),
+                ),
+                migrations.AddIndex(
+                    model_name='stateresult',
+                    index=models.Index(fields=['id'], name='state_result_id_idx'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitor', '0005_partition_timeseries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetentionCheckpoint',
+            fields=[
+                ('table_name', models.CharField(max_length=63, primary_key=True, serialize=False)),
+                ('cutoff', models.DateTimeField()),
+                ('last_timestamp', models.DateTimeField(null=True)),
+                ('last_id', models.BigIntegerField(null=True)),
+                ('rows_deleted', models.BigIntegerField(default=0)),
+                ('bytes_freed', models.BigIntegerField(default=0)),
+                ('started_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField(null=True)),
+            ],
+            options={
+                'db_table': 'retention_checkpoint',
+            },
+        ),
+    ]
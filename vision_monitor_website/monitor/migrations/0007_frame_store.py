@@ -0,0 +1,88 @@
+from django.db import migrations, models
+
+
+# Indexes on visionmon_binary_data's parent; each partition gets its own copy.
+INDEXES = [
+    ('vm_binary_hash_idx', 'hash_idx', '(content_hash)'),
+    ('vm_binary_pending_idx', 'pending_idx', '(id) WHERE content_hash IS NULL AND data IS NOT NULL'),
+]
+
+
+def add_content_hash(apps, schema_editor):
+    """
+    Add the frame store's content_hash column and its indexes. The column is
+    nullable without a default, so adding it does not rewrite the table. On the
+    partitioned table the parent index is created ON ONLY the parent and each
+    partition's index is built concurrently and then attached, so ingest is never
+    blocked behind an index build; partitions created later inherit the indexes.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('visionmon_binary_data')")
+        row = cursor.fetchone()
+        if row is None:
+            return
+        cursor.execute("ALTER TABLE visionmon_binary_data ADD COLUMN IF NOT EXISTS content_hash text")
+
+        if row[0] != 'p':
+            for name, _, definition in INDEXES:
+                cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON visionmon_binary_data {definition}")
+            return
+
+        cursor.execute("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'visionmon_binary_data'::regclass
+        """)
+        partitions = [name for name, in cursor.fetchall()]
+        for name, suffix, definition in INDEXES:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY visionmon_binary_data {definition}")
+            for partition in partitions:
+                cursor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{partition}_{suffix}" ON "{partition}" {definition}')
+                cursor.execute(f'ALTER INDEX {name} ATTACH PARTITION "{partition}_{suffix}"')
+
+
+def remove_content_hash(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        for name, _, _ in INDEXES:
+            cursor.execute(f"DROP INDEX IF EXISTS {name}")
+        cursor.execute("ALTER TABLE IF EXISTS visionmon_binary_data DROP COLUMN IF EXISTS content_hash")
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block.
+    atomic = False
+
+    dependencies = [
+        ('monitor', '0006_retention_checkpoint'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_content_hash, remove_content_hash, elidable=False),
+        # add_content_hash() already made these changes in the database.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddField(
+                    model_name='visionmonbinarydata',
+                    name='content_hash',
+                    field=models.TextField(null=True),
+                ),
+                migrations.AddIndex(
+                    model_name='visionmonbinarydata',
+                    index=models.Index(fields=['content_hash'], name='vm_binary_hash_idx'),
+                ),
+                migrations.AddIndex(
+                    model_name='visionmonbinarydata',
+                    index=models.Index(condition=models.Q(('content_hash__isnull', True), ('data__isnull', False)),
+                                       fields=['id'], name='vm_binary_pending_idx'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+from ._operations import RunPostgresSQL
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitor', '0007_frame_store'),
+    ]
+
+    operations = [
+        # Nullable without a default, so adding it does not rewrite the table.
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                RunPostgresSQL(
+                    "ALTER TABLE visionmon_binary_data ADD COLUMN IF NOT EXISTS phash bigint",
+                    "ALTER TABLE visionmon_binary_data DROP COLUMN IF EXISTS phash",
+                ),
+            ],
+            state_operations=[
+                migrations.AddField(
+                    model_name='visionmonbinarydata',
+                    name='phash',
+                    field=models.BigIntegerField(null=True),
+                ),
+            ],
+        ),
+    ]
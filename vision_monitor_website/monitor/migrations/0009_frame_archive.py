@@ -0,0 +1,78 @@
+from django.db import migrations, models
+
+
+# Index on visionmon_binary_data's parent; each partition gets its own copy.
+INDEX = ('vm_binary_hot_idx', 'hot_idx', '(created_at) WHERE content_hash IS NOT NULL AND archive IS NULL')
+
+
+def add_archive(apps, schema_editor):
+    """
+    Add the cold tier's archive column and the partial index the tiering job
+    uses to find the oldest frames still in the hot store. As in 0007, the
+    partitions' indexes are built concurrently and attached to an index
+    created ON ONLY the parent.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+
+    name, suffix, definition = INDEX
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('visionmon_binary_data')")
+        row = cursor.fetchone()
+        if row is None:
+            return
+        cursor.execute("ALTER TABLE visionmon_binary_data ADD COLUMN IF NOT EXISTS archive text")
+
+        if row[0] != 'p':
+            cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON visionmon_binary_data {definition}")
+            return
+
+        cursor.execute("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'visionmon_binary_data'::regclass
+        """)
+        partitions = [partition for partition, in cursor.fetchall()]
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY visionmon_binary_data {definition}")
+        for partition in partitions:
+            cursor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{partition}_{suffix}" ON "{partition}" {definition}')
+            cursor.execute(f'ALTER INDEX {name} ATTACH PARTITION "{partition}_{suffix}"')
+
+
+def remove_archive(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP INDEX IF EXISTS {INDEX[0]}")
+        cursor.execute("ALTER TABLE IF EXISTS visionmon_binary_data DROP COLUMN IF EXISTS archive")
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block.
+    atomic = False
+
+    dependencies = [
+        ('monitor', '0008_frame_phash'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_archive, remove_archive, elidable=False),
+        # add_archive() already made these changes in the database.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddField(
+                    model_name='visionmonbinarydata',
+                    name='archive',
+                    field=models.TextField(null=True),
+                ),
+                migrations.AddIndex(
+                    model_name='visionmonbinarydata',
+                    index=models.Index(condition=models.Q(('archive__isnull', True), ('content_hash__isnull', False)),
+                                       fields=['created_at'], name='vm_binary_hot_idx'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+class RunPostgresSQL(migrations.RunSQL):
+    """
+    RunSQL that only runs against PostgreSQL.
+
+    The visionmon tables are created by the ingest pipeline in the production
+    PostgreSQL database; on other backends (the SQLite database used in CI)
+    they do not exist, so these operations are skipped there.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
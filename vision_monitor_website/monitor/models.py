@@ -0,0 +1,105 @@
+from django.contrib.postgres.indexes import BrinIndex
+from django.db import models
+
+# These tables are written by the ingest pipeline and were created outside Django.
+# Migration 0004 adopts them (CREATE TABLE IF NOT EXISTS) so that the indexes the
+# hot queries depend on are declared here and created by migrations; 0005 turns
+# metadata and state results into daily range-partitioned tables, which therefore
+# have no primary key constraint, and binary data into id-range partitions, which
+# keep theirs (see monitor/partitions.py). The app still queries them with raw
+# SQL; `check_indexes` compares these declarations with a live database.
+
+
+class VisionmonBinaryData(models.Model):
+    id = models.AutoField(primary_key=True)
+    data = models.BinaryField(null=True)
+    # SHA-256 of the image in the frame store (monitor/frame_store.py); data is
+    # NULL once the image has been moved there
+    content_hash = models.TextField(null=True)
+    # 64-bit dHash of that image, to recognise near-identical frames from the same camera
+    phash = models.BigIntegerField(null=True)
+    # Day archive of the cold tier holding a recompressed copy of the image, once
+    # the frame is old enough to leave the frame store (NULL while it is there)
+    archive = models.TextField(null=True)
+    # Dates the frame for partition retention and the cold tier; set by the database default on insert
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'visionmon_binary_data'
+        indexes = [
+            # Frame store garbage collection looks up whether a hash is still referenced
+            models.Index(fields=['content_hash'], name='vm_binary_hash_idx'),
+            # Only the frames still waiting to be moved to the frame store
+            models.Index(fields=['id'], name='vm_binary_pending_idx',
+                         condition=models.Q(content_hash__isnull=True, data__isnull=False)),
+            # Only the frames still in the frame store, for the cold-tier job
+            models.Index(fields=['created_at'], name='vm_binary_hot_idx',
+                         condition=models.Q(content_hash__isnull=False, archive__isnull=True)),
+        ]
+
+
+class VisionmonMetadata(models.Model):
+    id = models.AutoField(primary_key=True)
+    camera_id = models.TextField(null=True)
+    camera_index = models.IntegerField(null=True)
+    timestamp = models.DateTimeField(null=True)
+    description = models.TextField(null=True)
+    camera_name = models.TextField(null=True)
+    data_id = models.IntegerField(null=True)
+
+    class Meta:
+        db_table = 'visionmon_metadata'
+        indexes = [
+            # Timeline range scans and keyset pages, optionally per camera
+            models.Index(fields=['timestamp', 'id'], name='vm_meta_ts_id_idx'),
+            models.Index(fields=['camera_id', 'timestamp', 'id'], name='vm_meta_camera_ts_id_idx'),
+            # Latest image per camera index (get_latest_image)
+            models.Index(fields=['camera_index', 'timestamp'], name='vm_meta_camera_index_ts_idx'),
+            # Binary rows are looked up and cleaned up through their metadata
+            models.Index(fields=['data_id'], name='vm_meta_data_id_idx'),
+            models.Index(fields=['id'], name='vm_meta_id_idx'),
+        ]
+
+
+class StateResult(models.Model):
+    id = models.AutoField(primary_key=True)
+    raw_message = models.TextField(null=True)
+    timestamp = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = 'state_result'
+        indexes = [
+            # A B-tree rather than BRIN: the timeline's as-of lookups and the latest
+            # facility state both need ordered "latest row at or before" seeks.
+            models.Index(fields=['timestamp', 'id'], name='state_result_ts_id_idx'),
+            models.Index(fields=['id'], name='state_result_id_idx'),
+        ]
+
+
+class FacilityStatus(models.Model):
+    id = models.AutoField(primary_key=True)
+    raw_message = models.TextField(null=True)
+    timestamp = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = 'facility_status'
+        indexes = [
+            # Append-only and only ever range-scanned by time
+            BrinIndex(fields=['timestamp'], name='facility_status_ts_brin'),
+        ]
+
+
+class RetentionCheckpoint(models.Model):
+    """Progress of the batched retention job per table, so an interrupted run resumes where it stopped."""
+    table_name = models.CharField(max_length=63, primary_key=True)
+    cutoff = models.DateTimeField()
+    last_timestamp = models.DateTimeField(null=True)
+    last_id = models.BigIntegerField(null=True)
+    rows_deleted = models.BigIntegerField(default=0)
+    bytes_freed = models.BigIntegerField(default=0)
+    started_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    finished_at = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = 'retention_checkpoint'
@@ -0,0 +1,230 @@
+# monitor/mosaic.py
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+import redis
+from PIL import Image, ImageDraw
+
+from .config import (
+    camera_indexes,
+    camera_names,
+    MOSAIC_COLUMNS,
+    MOSAIC_TILE_WIDTH,
+    MOSAIC_QUALITY,
+    MOSAIC_TTL,
+)
+from .frame_cache import get_latest_frame_cache
+
+logger = logging.getLogger(__name__)
+
+# One image with the latest frame of every camera (/mosaic/), instead of a request
+# per camera. A mosaic is identified by the frame ids it shows, so requests can be
+# answered conditionally from the latest-frame cache alone. Composed mosaics are
+# shared by all processes through Redis:
+#
+#   mosaic:<format>  hash {version, data}, expires after MOSAIC_TTL
+#
+# The redis_listener recomposes the mosaic in the background whenever a camera's
+# frame changes, so requests normally find it ready.
+
+MOSAIC_KEY = 'mosaic:{format}'
+
+# format -> (Pillow format, content type)
+MOSAIC_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+}
+
+
+def mosaic_cameras():
+    """(camera index, camera name) of every configured camera, in index order."""
+    return sorted((index, camera_names.get(camera_id, camera_id)) for camera_id, index in camera_indexes.items())
+
+
+def mosaic_version(frame_versions):
+    """Short hash of the frame ids in a mosaic, from {camera_index: (data_id, timestamp) or None}."""
+    key = ','.join(f"{index}:{version[0] if version else '-'}" for index, version in sorted(frame_versions.items()))
+    return hashlib.sha1(key.encode('ascii')).hexdigest()[:16]
+
+
+def compose_mosaic(tiles, columns=MOSAIC_COLUMNS, tile_width=MOSAIC_TILE_WIDTH, image_format='jpeg', quality=MOSAIC_QUALITY):
+    """
+    Grid image of `tiles`, a list of (label, JPEG bytes or None) in display order.
+    Frames are scaled to fit 16:9 tiles; missing or unreadable frames leave their
+    tile black.
+    """
+    tile_height = tile_width * 9 // 16
+    rows = max(1, -(-len(tiles) // columns))
+    canvas = np.zeros((rows * tile_height, columns * tile_width, 3), dtype=np.uint8)
+
+    for position, (label, data) in enumerate(tiles):
+        if not data:
+            continue
+        try:
+            with Image.open(BytesIO(data)) as image:
+                image.draft('RGB', (tile_width, tile_height))
+                image = image.convert('RGB')
+                image.thumbnail((tile_width, tile_height), Image.LANCZOS)
+                pixels = np.asarray(image)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            logger.error(f"Error decoding frame for mosaic tile {label}: {e}")
+            continue
+        row, column = divmod(position, columns)
+        height, width = pixels.shape[:2]
+        # Centred in its tile, letterboxed if the frame is not 16:9
+        top = row * tile_height + (tile_height - height) // 2
+        left = column * tile_width + (tile_width - width) // 2
+        canvas[top:top + height, left:left + width] = pixels
+
+    mosaic = Image.fromarray(canvas)
+    draw = ImageDraw.Draw(mosaic)
+    for position, (label, _) in enumerate(tiles):
+        row, column = divmod(position, columns)
+        x, y = column * tile_width + 6, row * tile_height + 4
+        draw.text((x + 1, y + 1), label, fill=(0, 0, 0))
+        draw.text((x, y), label, fill=(255, 255, 255))
+
+    output = BytesIO()
+    mosaic.save(output, format=MOSAIC_FORMATS[image_format][0], quality=quality)
+    return output.getvalue()
+
+
+class MosaicService:
+
+    def __init__(self, frame_cache=None, ttl=MOSAIC_TTL):
+        self.frame_cache = frame_cache or get_latest_frame_cache()
+        self.redis = self.frame_cache.redis
+        self.ttl = ttl
+        # Composing is CPU bound and Pillow releases the GIL; one thread is plenty
+        # and also serialises recompositions.
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='mosaic')
+        self._lock = threading.Lock()
+        self._local = {}  # format -> (version, data)
+        self._in_flight = {}  # (format, version) -> future
+        self._refresh_pending = set()
+        # misses are compositions, whether for a request or a background refresh
+        self._stats = {'local_hits': 0, 'redis_hits': 0, 'misses': 0, 'redis_errors': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def current_version(self):
+        """Version of the mosaic showing every camera's current frame (one pipelined Redis read)."""
+        return mosaic_version(self.frame_cache.peek_many(index for index, _ in mosaic_cameras()))
+
+    def get(self, image_format='jpeg', version=None):
+        """
+        (version, image bytes) of the mosaic of the cameras' current frames, from
+        this process, Redis, or composed now if nobody has composed it yet.
+        """
+        version = version or self.current_version()
+        return self._cached(image_format, version) or self._submit(image_format, version).result()
+
+    def _cached(self, image_format, version):
+        with self._lock:
+            local = self._local.get(image_format)
+        if local and local[0] == version:
+            self._count('local_hits')
+            return local
+
+        key = MOSAIC_KEY.format(format=image_format)
+        try:
+            # One read, so a concurrent _compose cannot swap the data after the version was read
+            stored_version, data = self.redis.hmget(key, 'version', 'data')
+            if stored_version is not None and data is not None and stored_version.decode('ascii') == version:
+                with self._lock:
+                    self._local[image_format] = (version, data)
+                self._count('redis_hits')
+                return version, data
+        except redis.RedisError as e:
+            self._count('redis_errors')
+            logger.error(f"Redis error reading mosaic: {e}")
+        return None
+
+    def _submit(self, image_format, version):
+        with self._lock:
+            future = self._in_flight.get((image_format, version))
+            if future is None:
+                future = self.pool.submit(self._compose, image_format, version)
+                self._in_flight[(image_format, version)] = future
+        return future
+
+    def _compose(self, image_format, requested_version):
+        try:
+            with self._lock:
+                local = self._local.get(image_format)
+            if local and local[0] == requested_version:
+                # Composed by a refresh while this request was queued
+                return local
+            tiles, versions = [], {}
+            for index, name in mosaic_cameras():
+                frame = self.frame_cache.get(index)
+                versions[index] = (frame.data_id, frame.timestamp) if frame else None
+                tiles.append((name, frame.data if frame else None))
+            # Frames may have changed since the request; label the mosaic with what it shows
+            version = mosaic_version(versions)
+            data = compose_mosaic(tiles, image_format=image_format)
+            self._count('misses')
+            with self._lock:
+                self._local[image_format] = (version, data)
+            try:
+                key = MOSAIC_KEY.format(format=image_format)
+                pipeline = self.redis.pipeline()
+                pipeline.hset(key, mapping={'version': version, 'data': data})
+                pipeline.expire(key, self.ttl)
+                pipeline.execute()
+            except redis.RedisError as e:
+                self._count('redis_errors')
+                logger.error(f"Redis error storing mosaic: {e}")
+            return version, data
+        finally:
+            with self._lock:
+                self._in_flight.pop((image_format, requested_version), None)
+
+    def schedule_refresh(self, image_format='jpeg'):
+        """
+        Recompose the mosaic in the background if a frame changed. Calls made while
+        a refresh is still queued are coalesced, so a burst of new frames costs one
+        composition.
+        """
+        with self._lock:
+            if image_format in self._refresh_pending:
+                return
+            self._refresh_pending.add(image_format)
+        self.pool.submit(self._refresh, image_format)
+
+    def _refresh(self, image_format):
+        with self._lock:
+            self._refresh_pending.discard(image_format)
+        try:
+            # Runs on the pool's only thread, so it composes directly rather than through _submit()
+            version = self.current_version()
+            if self._cached(image_format, version) is None:
+                self._compose(image_format, version)
+        except Exception as e:
+            logger.error(f"Error refreshing mosaic: {e}")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['local_hits'] + stats['redis_hits'] + stats['misses']
+        stats['hit_ratio'] = (stats['local_hits'] + stats['redis_hits']) / lookups if lookups else 0.0
+        return stats
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_mosaic_service():
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = MosaicService()
+    return _service
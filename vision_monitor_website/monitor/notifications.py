@@ -8,23 +8,23 @@ from django.utils import timezone
 from django.http import JsonResponse, HttpResponse
 from .discord_client import send_discord
 from .image_handling import get_latest_image, get_latest_image_non_web
-from .state_management import parse_facility_state, alert_manager
-from .db_operations import fetch_latest_facility_state
-from .config import camera_names
+from .state_management import get_state_snapshot
+from .config import camera_names, DAILY_SUMMARY_MOSAIC
+from .mosaic import get_mosaic_service
 
 logger = logging.getLogger(__name__)
 
 ALERT_QUEUE = 'alert_queue'
 
-def notify(request, raw_message=None, specific_camera_id=None):
-    if raw_message is None:
-        raw_message = fetch_latest_facility_state()
-        if raw_message is None:
-            logger.error("Failed to fetch facility status")
+def notify(request, snapshot=None, specific_camera_id=None):
+    """Send notifications for `snapshot` (a StateSnapshot), by default the latest one."""
+    if snapshot is None:
+        snapshot = get_state_snapshot()
+        if snapshot is None:
+            logger.error("No facility state available")
             return
-        raw_message = raw_message[0]
     
-    facility_state, camera_states, alerts = parse_facility_state(raw_message)
+    facility_state, alerts = snapshot.facility_state, list(snapshot.alerts)
     
     if specific_camera_id:
         alerts = [alert for alert in alerts if alert[0] == specific_camera_id]
@@ -156,25 +156,38 @@ def send_daily_summary(title, message):
             logger.error(f"Error retrieving latest image for daily summary: {str(e)}")
             latest_image = None
 
+        image_paths = []
         if latest_image:
             with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_image:
                 temp_image.write(latest_image)
-                temp_image_path = temp_image.name
-            
-            logger.info(f"Temporary image file created at: {temp_image_path}")
+                image_paths.append((temp_image.name, "Axis Camera"))
+            logger.info(f"Temporary image file created at: {temp_image.name}")
+
+        if DAILY_SUMMARY_MOSAIC:
+            # All cameras in one attachment
+            try:
+                _, mosaic = get_mosaic_service().get('jpeg')
+                with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_image:
+                    temp_image.write(mosaic)
+                    image_paths.append((temp_image.name, "All Cameras"))
+            except Exception as e:
+                logger.error(f"Error composing mosaic for daily summary: {str(e)}")
+
+        if image_paths:
             # Send the summary to Discord
             try:
-                success = send_discord([(temp_image_path, "Axis Camera")], message, str(timezone.localtime(timezone.now()).strftime("%Y-%m-%d %I:%M:%S %p")), title)
+                success = send_discord(image_paths, message, str(timezone.localtime(timezone.now()).strftime("%Y-%m-%d %I:%M:%S %p")), title)
                 if success:
                     logger.info(f"Daily sumary sent successfully.")
                 else:
                     logger.error(f"Failed to send daily summary")
             except Exception as e:
                 logger.error(f"Error in send_discord for daily summary: {str(e)}")
-                
-            os.unlink(temp_image_path)
-            logger.info("Temporary image file deleted after test notification")
-            
+
+            for path, _ in image_paths:
+                os.unlink(path)
+            logger.info("Temporary image files deleted after daily summary")
+
         else:
             logger.warning("Latest image not available or invalid for test notification")
             try:
@@ -13,6 +13,7 @@ from functools import wraps
 import aiohttp
 
 from .db_operations import fetch_daily_descriptions
+from .db_pool import close_async_pool
 from .notifications import send_daily_summary
 from .config import DAILY_SUMMARY
 
@@ -163,6 +164,13 @@ async def start_scheduled_tasks():
     while True:
         await asyncio.sleep(3600)  # Sleep for an hour
 
+async def generate_daily_summary_now():
+    # For asyncio.run(): the loop's database pool has to be closed before the loop is
+    try:
+        await generate_daily_summary()
+    finally:
+        await close_async_pool()
+
 def run_scheduler_in_thread():
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
@@ -172,6 +180,7 @@ def run_scheduler_in_thread():
     except KeyboardInterrupt:
         pass
     finally:
+        loop.run_until_complete(close_async_pool())
         loop.close()
 
 # This function should be called when your application starts
@@ -188,7 +197,7 @@ def run_scheduler():
 
             # If the test is successful, proceed with generating the daily summary
             if isinstance(test_result, dict) and 'choices' in test_result:
-                asyncio.run(generate_daily_summary())
+                asyncio.run(generate_daily_summary_now())
             else:
                 logger.error("OpenAI connection test failed, not proceeding with summary generation")
         except Exception as e:
@@ -0,0 +1,271 @@
+# monitor/partitions.py
+import logging
+import re
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import psycopg2
+from dateutil import parser as date_parser
+
+from .config import (
+    RETENTION_DAYS,
+    PARTITION_PREMAKE_DAYS,
+    PARTITION_RETENTION_MODE,
+    BINARY_PARTITION_IDS,
+    BINARY_PARTITIONS_AHEAD,
+)
+from .db_operations import REFRESH_CAMERA_LATEST
+from .db_pool import db_connection
+
+logger = logging.getLogger(__name__)
+
+# Range-partitioned tables (migration 0005), with their partition key. Metadata
+# and state results have daily partitions. Frames are read by id, so
+# visionmon_binary_data has id-range partitions of BINARY_PARTITION_IDS ids,
+# which keep its primary key and let a lookup by id touch one partition; its
+# created_at column dates them for retention.
+PARTITIONED_TABLES = {
+    'visionmon_metadata': 'timestamp',
+    'visionmon_binary_data': 'id',
+    'state_result': 'timestamp',
+}
+
+# Frames are stored slightly before their metadata row is written, so binary
+# partitions are kept one extra day to never drop a frame that is still referenced.
+BINARY_RETENTION_GRACE = timedelta(days=1)
+
+# Partition DDL needs a brief exclusive lock on the parent; rather than queueing
+# behind a long query (and blocking ingest behind us) give up and retry next run.
+LOCK_TIMEOUT = '5s'
+
+PARTITION_BOUND_RE = re.compile(r"FROM \((?P<lower>MINVALUE|'[^']*'|-?\d+)\) TO \((?P<upper>MAXVALUE|'[^']*'|-?\d+)\)")
+
+# Newest row of an id partition, and whether it is older than the cutoff
+# (NULL for an empty partition; false for rows from before partitioning)
+PARTITION_NEWEST_EXPIRED = 'SELECT isfinite(created_at) AND created_at <= %s FROM "{name}" ORDER BY id DESC LIMIT 1'
+
+
+def partition_name(table, day):
+    return f"{table}_p{day:%Y%m%d}"
+
+
+def id_partition_name(table, start):
+    return f"{table}_p{start}"
+
+
+def _parse_bound(bound):
+    if bound in ('MINVALUE', 'MAXVALUE'):
+        return None
+    if bound.startswith("'"):
+        return date_parser.parse(bound.strip("'"))
+    return int(bound)
+
+
+def list_partitions(cursor, table):
+    """
+    Partitions of `table` as dicts with name, lower and upper bounds (None for
+    MINVALUE/MAXVALUE) and whether it is the DEFAULT partition, oldest first.
+    Returns [] if the table is not partitioned.
+    """
+    cursor.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+    """, (table,))
+    partitions = []
+    for name, bound in cursor.fetchall():
+        if bound == 'DEFAULT':
+            partitions.append({'name': name, 'lower': None, 'upper': None, 'default': True})
+            continue
+        match = PARTITION_BOUND_RE.search(bound)
+        if not match:
+            logger.warning(f"Unrecognised partition bound for {name}: {bound}")
+            continue
+        partitions.append({
+            'name': name,
+            'lower': _parse_bound(match.group('lower')),
+            'upper': _parse_bound(match.group('upper')),
+            'default': False,
+        })
+    # Bounds of one table are all days or all ids
+    partitions.sort(key=lambda p: (p['default'], p['lower'] is not None, p['lower']))
+    return partitions
+
+
+def is_partitioned(cursor, table):
+    cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def newest_id(cursor, table):
+    """Highest id in `table` (0 if empty); one primary key probe per partition."""
+    cursor.execute(f'SELECT coalesce(max(id), 0) FROM "{table}"')
+    return cursor.fetchone()[0]
+
+
+def _missing_daily_ranges(table, covered, days_ahead, today):
+    for offset in range(days_ahead + 1):
+        day = today + timedelta(days=offset)
+        start = datetime(day.year, day.month, day.day, tzinfo=dt_timezone.utc)
+        end = start + timedelta(days=1)
+        if not any((lower is None or lower < end) and (upper is None or upper > start) for lower, upper in covered):
+            yield partition_name(table, day), start, end
+
+
+def _missing_id_ranges(table, covered, newest, partition_ids, partitions_ahead):
+    # Id partitions are contiguous, so new ones continue from the highest bound
+    uppers = [upper for _, upper in covered]
+    if not uppers or None in uppers:
+        return
+    start = max(uppers)
+    while start < newest + partition_ids * partitions_ahead:
+        yield id_partition_name(table, start), start, start + partition_ids
+        start += partition_ids
+
+
+# Rows of a new partition's range that landed in DEFAULT (e.g. while an earlier
+# attempt to create it failed) would make CREATE ... PARTITION OF fail; they are
+# moved into the new partition in the same transaction.
+MOVE_FROM_DEFAULT = """
+    CREATE TEMP TABLE partition_rows ON COMMIT DROP AS
+    WITH moved AS (DELETE FROM "{default}" WHERE "{key}" >= %s AND "{key}" < %s RETURNING *)
+    SELECT * FROM moved
+"""
+
+
+def _create_partition(cursor, table, key, name, start, end):
+    """Create partition `name` of `table` for [start, end), taking over its rows from DEFAULT."""
+    cursor.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+    default = f"{table}_default"
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (default,))
+    moved = 0
+    if cursor.fetchone()[0]:
+        cursor.execute(MOVE_FROM_DEFAULT.format(default=default, key=key), (start, end))
+        moved = cursor.rowcount
+    cursor.execute(f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table}" FOR VALUES FROM (%s) TO (%s)', (start, end))
+    if moved:
+        cursor.execute(f'INSERT INTO "{table}" SELECT * FROM partition_rows')
+        logger.warning(f"Moved {moved} row(s) from {default} into the new partition {name}")
+
+
+def ensure_partitions(days_ahead=PARTITION_PREMAKE_DAYS, today=None,
+                      partition_ids=BINARY_PARTITION_IDS, partitions_ahead=BINARY_PARTITIONS_AHEAD):
+    """
+    Create any missing daily partitions from today through `days_ahead` days
+    ahead, and id partitions of `partition_ids` ids until `partitions_ahead`
+    of them lie past the newest id.
+    """
+    today = today or datetime.now(dt_timezone.utc).date()
+    created = []
+    with db_connection() as conn:
+        for table, key in PARTITIONED_TABLES.items():
+            with conn.cursor() as cursor:
+                if not is_partitioned(cursor, table):
+                    logger.warning(f"{table} is not partitioned; run migrations")
+                    continue
+                covered = [(p['lower'], p['upper']) for p in list_partitions(cursor, table) if not p['default']]
+                if key == 'id':
+                    missing = list(_missing_id_ranges(table, covered, newest_id(cursor, table), partition_ids, partitions_ahead))
+                else:
+                    missing = list(_missing_daily_ranges(table, covered, days_ahead, today))
+            conn.commit()
+
+            for name, start, end in missing:
+                try:
+                    with conn.cursor() as cursor:
+                        _create_partition(cursor, table, key, name, start, end)
+                    conn.commit()
+                    created.append(name)
+                    logger.info(f"Created partition {name}")
+                except psycopg2.Error as e:
+                    # e.g. the lock timed out; rows for the range go to DEFAULT until the
+                    # next run, which moves them into the partition
+                    conn.rollback()
+                    logger.error(f"Error creating partition {name}: {e}")
+                    if key == 'id':
+                        # Later id ranges must not leave a gap behind this one; go on with the next table
+                        break
+    return created
+
+
+def _expired_id_partitions(cursor, table, cutoff):
+    """
+    Id partitions, oldest first, whose newest row is older than `cutoff`. Ids
+    grow with created_at, so the walk stops at the first partition still in the
+    retention window. An empty partition only expires once it lies wholly below
+    the newest id, as no frame can be added to it any more.
+    """
+    newest = newest_id(cursor, table)
+    expired = []
+    for partition in list_partitions(cursor, table):
+        if partition['default'] or partition['upper'] is None:
+            break
+        cursor.execute(PARTITION_NEWEST_EXPIRED.format(name=partition['name']), (cutoff,))
+        row = cursor.fetchone()
+        if row is None:
+            if partition['upper'] > newest:
+                break
+        elif not row[0]:
+            break
+        expired.append((table, partition))
+    return expired
+
+
+def expired_partitions(retention_days=RETENTION_DAYS, now=None):
+    """(table, partition) pairs whose whole range is older than the retention window."""
+    now = now or datetime.now(dt_timezone.utc)
+    cutoff = now - timedelta(days=retention_days)
+    expired = []
+    with db_connection() as conn, conn.cursor() as cursor:
+        for table, key in PARTITIONED_TABLES.items():
+            if key == 'id':
+                expired.extend(_expired_id_partitions(cursor, table, cutoff - BINARY_RETENTION_GRACE))
+                continue
+            for partition in list_partitions(cursor, table):
+                if not partition['default'] and partition['upper'] is not None and partition['upper'] <= cutoff:
+                    expired.append((table, partition))
+    return expired
+
+
+def drop_expired_partitions(retention_days=RETENTION_DAYS, mode=PARTITION_RETENTION_MODE, now=None):
+    """
+    Retire partitions older than the retention window: DROP them, or with
+    mode='detach' DETACH them so they survive as standalone tables for archiving.
+    Returns the names of the partitions retired.
+    """
+    if mode not in ('drop', 'detach'):
+        raise ValueError(f"Unknown partition retention mode: {mode}")
+
+    retired = []
+    dropped_metadata_upper = None
+    with db_connection() as conn:
+        for table, partition in expired_partitions(retention_days, now):
+            name = partition['name']
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+                    if mode == 'detach':
+                        cursor.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"')
+                    else:
+                        cursor.execute(f'DROP TABLE "{name}"')
+                conn.commit()
+            except psycopg2.Error as e:
+                conn.rollback()
+                logger.error(f"Error retiring partition {name}: {e}")
+                continue
+            retired.append(name)
+            logger.info(f"{'Detached' if mode == 'detach' else 'Dropped'} partition {name} (up to {partition['upper']})")
+            if table == 'visionmon_metadata':
+                dropped_metadata_upper = max(dropped_metadata_upper or partition['upper'], partition['upper'])
+
+        # Dropping a partition does not fire the camera_latest delete trigger, so a
+        # camera whose newest frame was in a dropped partition needs repairing.
+        if dropped_metadata_upper is not None:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT EXISTS (SELECT 1 FROM camera_latest WHERE timestamp < %s)", (dropped_metadata_upper,))
+                if cursor.fetchone()[0]:
+                    cursor.execute(REFRESH_CAMERA_LATEST)
+                    logger.info("Repaired camera_latest after dropping metadata partitions")
+            conn.commit()
+    return retired
@@ -0,0 +1,56 @@
+# monitor/phrase_matching.py
+import re
+from functools import lru_cache
+
+# The vision models describe scenes with a small, recurring vocabulary ("people
+# eating", "door open", ...), and every state string is checked against several
+# phrase lists many times a minute. PhraseClassifier matches all configured
+# phrases in one pass of a single compiled regex and memoizes the result per
+# string, as a bitset with one bit per phrase; callers test it against masks.
+
+
+class PhraseClassifier:
+    """
+    Case-insensitive substring matching of a fixed set of phrases.
+    classify(text) returns the bitset of the phrases occurring in `text`,
+    memoized for the `cache_size` most recently classified strings.
+    """
+
+    def __init__(self, phrases, cache_size=4096):
+        self.phrases = list(dict.fromkeys(phrase.lower() for phrase in phrases))
+        self.bits = {phrase: 1 << index for index, phrase in enumerate(self.phrases)}
+        # A zero-width lookahead tries every start position, so overlapping phrases
+        # are all found. At each position the longest phrase wins, so each phrase
+        # also carries the bits of the phrases it contains.
+        alternatives = sorted(self.phrases, key=len, reverse=True)
+        self.pattern = re.compile('(?=(' + '|'.join(re.escape(phrase) for phrase in alternatives) + '))')
+        self.closure = {
+            phrase: self.mask(other for other in self.phrases if other in phrase)
+            for phrase in self.phrases
+        }
+        self.classify = lru_cache(maxsize=cache_size)(self._classify)
+
+    def mask(self, phrases):
+        """Bitset of `phrases`, which must all be among the classifier's phrases."""
+        mask = 0
+        for phrase in phrases:
+            mask |= self.bits[phrase.lower()]
+        return mask
+
+    def _classify(self, text):
+        bits = 0
+        # Lowercased like the `phrase in state.lower()` checks it replaces
+        for match in self.pattern.finditer(text.lower()):
+            bits |= self.closure[match.group(1)]
+        return bits
+
+    def stats(self):
+        info = self.classify.cache_info()
+        lookups = info.hits + info.misses
+        return {
+            'size': info.currsize,
+            'max_size': info.maxsize,
+            'hits': info.hits,
+            'misses': info.misses,
+            'hit_ratio': info.hits / lookups if lookups else 0.0,
+        }
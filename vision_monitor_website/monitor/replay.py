@@ -0,0 +1,303 @@
+# monitor/replay.py
+import json
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+
+from .alert_logic import AlertManager, FLAP_THRESHOLD, FLAP_INTERVAL
+from .config import EXPORT_FETCH_SIZE
+from .db_pool import db_connection
+from .state_management import (
+    StateWindow,
+    WINDOW_MAX_AGE,
+    WINDOW_MAX_LENGTH,
+    camera_alert_config,
+    camera_state_weight,
+    facility_state_weight,
+    is_alerting_state,
+    is_relevant_state,
+)
+
+logger = logging.getLogger(__name__)
+
+# Replays stored state_result messages through the state windows and the alert
+# flap detection in bulk, e.g. to count the alerts another camera_alert_config
+# would have produced over the last weeks. Instead of feeding StateWindow and
+# AlertState one message at a time, each window's states are encoded as integer
+# codes and processed with NumPy:
+#
+#   - a window after append i holds entries [start_i, i], start_i being the
+#     later of the 15-minute and the 900-entry limit (timestamps are sorted);
+#   - its counts are differences of cumulative one-hot counts, its mode the
+#     argmax of count x weight, ties going to the state whose oldest entry in
+#     the window came first, as in StateWindow;
+#   - an alert only changes state when the alerting flag flips, and whether a
+#     change is flapping only depends on the time since the change
+#     FLAP_THRESHOLD - 1 changes earlier, so transitions need no loop either.
+#
+# replay_live() is the message-by-message path through StateWindow and
+# AlertManager; the replay_alerts command's --verify compares the two.
+
+STATE_MESSAGES_QUERY = """
+    SELECT timestamp, raw_message FROM state_result
+    WHERE timestamp >= %s AND timestamp < %s
+    ORDER BY timestamp, id
+"""
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+# Cells of the (rows x relevant states) count matrix computed at once; bounds memory
+REPLAY_CHUNK_CELLS = 4_000_000
+
+
+def load_state_messages(start_time, end_time, fetch_size=EXPORT_FETCH_SIZE):
+    """
+    (timestamp, facility_state, camera_states) of every parseable state_result
+    message in [start_time, end_time), oldest first, read with a server-side
+    cursor.
+    """
+    messages = []
+    skipped = 0
+    with db_connection() as conn:
+        with conn.cursor(name='state_replay') as cur:
+            cur.itersize = fetch_size
+            cur.execute(STATE_MESSAGES_QUERY, (start_time, end_time))
+            for timestamp, raw_message in cur:
+                try:
+                    data = json.loads(raw_message)
+                except (TypeError, ValueError):
+                    skipped += 1
+                    continue
+                messages.append((timestamp, data.get('facility_state', '').strip(), data.get('camera_states', {})))
+    if skipped:
+        logger.warning(f"Skipped {skipped} state_result messages that are not JSON")
+    return messages
+
+
+def config_weight(camera_config):
+    """Weight function of a camera_alert_config entry, as camera_state_weight() builds for the configured cameras."""
+    def weight(state):
+        lowered = state.lower()
+        if camera_config and any(alert in lowered for alert in camera_config["alert_states"]):
+            return camera_config["penalty"]
+        return 1.0
+    return weight
+
+
+def epoch_microseconds(timestamps):
+    return np.array([(timestamp - EPOCH) // timedelta(microseconds=1) for timestamp in timestamps], dtype=np.int64)
+
+
+def encode_states(states, vocabulary):
+    """Integer codes of `states`, adding states not seen yet to `vocabulary` ({state: code})."""
+    return np.fromiter((vocabulary.setdefault(state, len(vocabulary)) for state in states), dtype=np.int64, count=len(states))
+
+
+def windowed_modes(times, codes, relevant, weights, max_age=WINDOW_MAX_AGE, maxlen=WINDOW_MAX_LENGTH):
+    """
+    Codes of what StateWindow.most_frequent() returns after each state of
+    `codes` is appended at `times` (sorted epoch microseconds). `relevant` and
+    `weights` are indexed by code.
+    """
+    count = len(codes)
+    modes = codes.copy()  # the latest state while no relevant state is in the window
+    if not count:
+        return modes
+
+    # One column per relevant state that occurs, -1 for the others
+    relevant_codes = np.unique(codes[relevant[codes]])
+    if not len(relevant_codes):
+        return modes
+    column_weights = weights[relevant_codes]
+    column_of_code = np.full(len(relevant), -1)
+    column_of_code[relevant_codes] = np.arange(len(relevant_codes))
+    columns = column_of_code[codes]
+
+    index = np.arange(count)
+    max_age = max_age // timedelta(microseconds=1)
+    starts = np.maximum(np.searchsorted(times, times - max_age, side='left'), index - maxlen + 1)
+
+    chunk = max(1, REPLAY_CHUNK_CELLS // len(relevant_codes) - maxlen)
+    for first in range(0, count, chunk):
+        last = min(first + chunk, count)
+        # Windows only move forward, so this chunk's windows all lie in [base, last)
+        base = starts[first]
+        segment = columns[base:last]
+        one_hot = np.zeros((last - base + 1, len(relevant_codes)), dtype=np.int32, order='F')
+        rows = np.flatnonzero(segment >= 0)
+        one_hot[rows + 1, segment[rows]] = 1
+        cumulative = np.cumsum(one_hot, axis=0)
+        counts = cumulative[index[first:last] - base + 1] - cumulative[starts[first:last] - base]
+        scores = np.where(counts > 0, counts * column_weights, -np.inf)
+        leaders = np.argmax(scores, axis=1)
+        best = scores[np.arange(last - first), leaders]
+        in_window = np.isfinite(best)
+        chunk_modes = modes[first:last]
+        chunk_modes[in_window] = relevant_codes[leaders[in_window]]
+
+        # Ties go to the state whose oldest entry in the window came first
+        candidates = (scores == best[:, None]) & in_window[:, None]
+        tied = np.flatnonzero(candidates.sum(axis=1) > 1)
+        if len(tied):
+            candidates = candidates[tied]
+            tied_starts = starts[first + tied]
+            oldest = np.full(candidates.shape, count, dtype=np.int64)
+            for column in np.flatnonzero(candidates.any(axis=0)):
+                positions = np.flatnonzero(segment == column) + base
+                found = positions[np.minimum(np.searchsorted(positions, tied_starts), len(positions) - 1)]
+                oldest[:, column] = np.where(candidates[:, column], found, count)
+            chunk_modes[tied] = relevant_codes[np.argmin(oldest, axis=1)]
+    return modes
+
+
+def alert_transitions(times, alerting, flap_threshold=FLAP_THRESHOLD, flap_interval=FLAP_INTERVAL):
+    """
+    (indexes, transitions) of the updates for which AlertState.update() would
+    return a transition, given the alerting flags `alerting` at `times` (epoch
+    seconds).
+    """
+    alerting = np.asarray(alerting, dtype=bool)
+    previous = np.concatenate(([False], alerting[:-1]))
+    changes = np.flatnonzero(alerting != previous)
+    change_times = np.asarray(times, dtype=np.float64)[changes]
+
+    # A change is flapping when the change flap_threshold - 1 changes before it
+    # was at most flap_interval earlier; the alert stays flapping exactly as long
+    # as that holds for every further change
+    lag = flap_threshold - 1
+    flapping = np.zeros(len(changes), dtype=bool)
+    if len(changes) > lag:
+        flapping[lag:] = change_times[lag:] - change_times[:len(changes) - lag] <= flap_interval
+    was_flapping = np.concatenate(([False], flapping[:-1]))
+
+    transitions = np.where(alerting[changes], 'ALERT', 'RESOLVED').astype(object)
+    transitions[flapping & ~was_flapping] = 'FLAPPING_START'
+    transitions[~flapping & was_flapping] = 'FLAPPING_END'
+    reported = ~(flapping & was_flapping)
+    return changes[reported], transitions[reported]
+
+
+def time_to_alert(seconds, raw_alerting, mode_alerting, alert_indexes):
+    """
+    Seconds from the first alerting state a camera sent after its smoothed
+    state last stopped alerting (or after the start of the replay) to each
+    alert in `alert_indexes`. `raw_alerting` and `mode_alerting` flag the sent
+    and the smoothed state of each message.
+    """
+    mode_alerting = np.asarray(mode_alerting, dtype=bool)
+    changes = np.flatnonzero(mode_alerting != np.concatenate(([False], mode_alerting[:-1])))
+    # The change before each alert; alerts are changes themselves
+    position = np.searchsorted(changes, alert_indexes)
+    quiet_since = np.where(position > 0, changes[np.maximum(position - 1, 0)], 0)
+    raw_positions = np.flatnonzero(raw_alerting)
+    onset = raw_positions[np.minimum(np.searchsorted(raw_positions, quiet_since), len(raw_positions) - 1)] if len(raw_positions) else alert_indexes
+    onset = np.minimum(onset, alert_indexes)
+    return seconds[alert_indexes] - seconds[onset]
+
+
+def encode_messages(messages):
+    """
+    (timestamp, facility_state, camera_states) messages as replay() works on
+    them: {'states': state of each code, 'relevant' and 'alerting': flags by
+    code, 'times': epoch microseconds and 'seconds': epoch seconds of each
+    message, 'facility': facility state codes, 'cameras': {camera_id:
+    (message indexes, state codes)}}.
+    """
+    timestamps = [timestamp for timestamp, _, _ in messages]
+    # Every distinct state is classified once
+    vocabulary = {}
+    facility_codes = encode_states([facility_state for _, facility_state, _ in messages], vocabulary)
+    camera_messages = {}
+    for message_index, (_, _, camera_states) in enumerate(messages):
+        for camera_id, state in camera_states.items():
+            indexes, states = camera_messages.setdefault(camera_id, ([], []))
+            indexes.append(message_index)
+            states.append(state)
+    cameras = {camera_id: (np.array(indexes), encode_states(states, vocabulary))
+               for camera_id, (indexes, states) in camera_messages.items()}
+    states = np.array(list(vocabulary), dtype=object)
+    return {
+        'states': states,
+        'relevant': np.array([is_relevant_state(state) for state in states], dtype=bool),
+        'alerting': np.array([is_alerting_state(state) for state in states], dtype=bool),
+        'times': epoch_microseconds(timestamps),
+        'seconds': np.array([timestamp.timestamp() for timestamp in timestamps], dtype=np.float64),
+        'facility': facility_codes,
+        'cameras': cameras,
+    }
+
+
+def state_weights(encoded, weight):
+    """`weight` of each relevant state code (1.0 for the others)."""
+    return np.array([weight(state) if relevant else 1.0 for state, relevant in zip(encoded['states'], encoded['relevant'])],
+                    dtype=np.float64)
+
+
+def alert_state_matches(encoded, alert_states):
+    """Whether each state code mentions one of `alert_states`, i.e. gets a camera's penalty."""
+    return np.array([any(alert in state.lower() for alert in alert_states) for state in encoded['states']], dtype=bool)
+
+
+def replay_camera(encoded, camera_id, weights, max_age=WINDOW_MAX_AGE, maxlen=WINDOW_MAX_LENGTH,
+                  flap_threshold=FLAP_THRESHOLD, flap_interval=FLAP_INTERVAL):
+    """(mode codes, indexes into the camera's messages with a transition, transitions) of one camera."""
+    indexes, codes = encoded['cameras'][camera_id]
+    modes = windowed_modes(encoded['times'][indexes], codes, encoded['relevant'], weights, max_age, maxlen)
+    changed, transitions = alert_transitions(encoded['seconds'][indexes], encoded['alerting'][modes], flap_threshold, flap_interval)
+    return modes, changed, transitions
+
+
+def replay(messages, camera_config=None):
+    """
+    Replay (timestamp, facility_state, camera_states) messages, oldest first.
+    `camera_config` replaces camera_alert_config. Returns
+    {'facility': [mode after each message],
+     'cameras': {camera_id: {'indexes': [message index], 'modes': [mode], 'alerts': [(message index, transition, state)]}}}.
+    """
+    encoded = encode_messages(messages)
+    states = encoded['states']
+    facility_modes = windowed_modes(encoded['times'], encoded['facility'], encoded['relevant'],
+                                    state_weights(encoded, facility_state_weight))
+    result = {'facility': states[facility_modes].tolist(), 'cameras': {}}
+    for camera_id, (indexes, _) in encoded['cameras'].items():
+        weight = config_weight(camera_config.get(camera_id)) if camera_config is not None else camera_state_weight(camera_id)
+        modes, changed, transitions = replay_camera(encoded, camera_id, state_weights(encoded, weight))
+        result['cameras'][camera_id] = {
+            'indexes': indexes.tolist(),
+            'modes': states[modes].tolist(),
+            'alerts': [(int(indexes[i]), transition, states[modes[i]]) for i, transition in zip(changed, transitions)],
+        }
+    return result
+
+
+def replay_live(messages, camera_config=None):
+    """replay() one message at a time through StateWindow and AlertManager, as ingest_state_message() does."""
+    facility_window = StateWindow(facility_state_weight)
+    camera_windows = {}
+    manager = AlertManager()
+    result = {'facility': [], 'cameras': {}}
+    for message_index, (timestamp, facility_state, camera_states) in enumerate(messages):
+        facility_window.append(facility_state, timestamp)
+        result['facility'].append(facility_window.most_frequent())
+        for camera_id, state in camera_states.items():
+            window = camera_windows.get(camera_id)
+            if window is None:
+                weight = config_weight(camera_config.get(camera_id)) if camera_config is not None else camera_state_weight(camera_id)
+                window = camera_windows[camera_id] = StateWindow(weight)
+                result['cameras'][camera_id] = {'indexes': [], 'modes': [], 'alerts': []}
+            window.append(state, timestamp)
+            mode = window.most_frequent()
+            camera_result = result['cameras'][camera_id]
+            camera_result['indexes'].append(message_index)
+            camera_result['modes'].append(mode)
+            transition = manager.update_state(camera_id, is_alerting_state(mode), timestamp.timestamp())
+            if transition:
+                camera_result['alerts'].append((message_index, transition, mode))
+    return result
+
+
+def default_camera_config():
+    """A copy of camera_alert_config to modify for a replay."""
+    return {camera_id: {"penalty": config["penalty"], "alert_states": set(config["alert_states"])}
+            for camera_id, config in camera_alert_config.items()}
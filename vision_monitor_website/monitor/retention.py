@@ -0,0 +1,300 @@
+# monitor/retention.py
+import logging
+import time
+from datetime import timedelta
+
+import psycopg2
+import psycopg2.errors
+from django.utils import timezone
+
+from .config import (
+    RETENTION_DAYS,
+    RETENTION_BATCH_SIZE,
+    RETENTION_BATCH_SLEEP,
+    RETENTION_LOCK_TIMEOUT,
+    RETENTION_MAX_RUNTIME,
+)
+from .db_pool import db_connection
+
+logger = logging.getLogger(__name__)
+
+# Deletes old rows a batch at a time, oldest first. Each batch is one short
+# transaction that also advances the table's retention_checkpoint row, so a run
+# that is killed or runs out of time resumes after the last committed batch, and
+# seeks past the dead index entries its earlier batches left behind.
+# With partitioned tables (monitor/partitions.py) whole partitions are dropped
+# instead, and this only still finds rows in the legacy and DEFAULT partitions.
+
+# Binary rows go with their metadata, unless another metadata row still uses them.
+METADATA_BATCH = """
+WITH batch AS (
+    SELECT id, timestamp
+    FROM visionmon_metadata
+    WHERE timestamp < %(cutoff)s
+      AND (timestamp, id) > (%(after_timestamp)s, %(after_id)s)
+    ORDER BY timestamp, id
+    LIMIT %(limit)s
+),
+deleted AS (
+    DELETE FROM visionmon_metadata vm
+    USING batch b
+    WHERE vm.id = b.id AND vm.timestamp = b.timestamp
+    RETURNING vm.id, vm.timestamp, vm.data_id, pg_column_size(vm.*) AS bytes
+)
+SELECT id, timestamp, data_id, bytes FROM deleted ORDER BY timestamp, id
+"""
+
+UNREFERENCED_BINARY_DELETE = """
+DELETE FROM visionmon_binary_data vb
+WHERE vb.id = ANY(%(data_ids)s)
+  AND NOT EXISTS (SELECT 1 FROM visionmon_metadata vm WHERE vm.data_id = vb.id)
+RETURNING pg_column_size(vb.*)
+"""
+
+STATE_RESULT_BATCH = """
+WITH batch AS (
+    SELECT id, timestamp
+    FROM state_result
+    WHERE timestamp < %(cutoff)s
+      AND (timestamp, id) > (%(after_timestamp)s, %(after_id)s)
+    ORDER BY timestamp, id
+    LIMIT %(limit)s
+),
+deleted AS (
+    DELETE FROM state_result sr
+    USING batch b
+    WHERE sr.id = b.id AND sr.timestamp = b.timestamp
+    RETURNING sr.id, sr.timestamp, pg_column_size(sr.*) AS bytes
+)
+SELECT id, timestamp, NULL AS data_id, bytes FROM deleted ORDER BY timestamp, id
+"""
+
+# (checkpoint name, batch statement); binary data is cleaned up alongside its metadata.
+RETENTION_TABLES = [
+    ('visionmon_metadata', METADATA_BATCH),
+    ('state_result', STATE_RESULT_BATCH),
+]
+
+# Row counts and stored sizes of what a run would delete, without touching anything.
+DRY_RUN_QUERIES = {
+    'visionmon_metadata': """
+        SELECT COUNT(*), COALESCE(SUM(pg_column_size(vm.*)), 0)
+        FROM visionmon_metadata vm WHERE vm.timestamp < %(cutoff)s
+    """,
+    'visionmon_binary_data': """
+        SELECT COUNT(*), COALESCE(SUM(pg_column_size(vb.data)), 0)
+        FROM visionmon_binary_data vb
+        WHERE vb.id IN (SELECT data_id FROM visionmon_metadata WHERE timestamp < %(cutoff)s)
+          AND NOT EXISTS (
+              SELECT 1 FROM visionmon_metadata vm
+              WHERE vm.data_id = vb.id AND vm.timestamp >= %(cutoff)s
+          )
+    """,
+    'state_result': """
+        SELECT COUNT(*), COALESCE(SUM(pg_column_size(sr.*)), 0)
+        FROM state_result sr WHERE sr.timestamp < %(cutoff)s
+    """,
+}
+
+# The oldest possible position, for a table with no checkpoint to resume from.
+START_POSITION = ('-infinity', -1)
+
+
+def format_bytes(size):
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def _load_checkpoint(cursor, table, cutoff, restart):
+    """Position to resume from for `table`; starts a new run unless an unfinished one exists."""
+    now = timezone.now()
+    cursor.execute("""
+        SELECT last_timestamp, last_id, rows_deleted, bytes_freed, finished_at
+        FROM retention_checkpoint WHERE table_name = %s
+        FOR UPDATE
+    """, (table,))
+    row = cursor.fetchone()
+    if row and row[4] is None and not restart and row[0] is not None:
+        logger.info(f"Resuming retention of {table} after ({row[0]}, {row[1]}); {row[2]} rows deleted so far")
+        cursor.execute("UPDATE retention_checkpoint SET cutoff = %s, updated_at = %s WHERE table_name = %s",
+                       (cutoff, now, table))
+        return (row[0], row[1]), row[2], row[3]
+
+    cursor.execute("""
+        INSERT INTO retention_checkpoint
+            (table_name, cutoff, last_timestamp, last_id, rows_deleted, bytes_freed, started_at, updated_at, finished_at)
+        VALUES (%s, %s, NULL, NULL, 0, 0, %s, %s, NULL)
+        ON CONFLICT (table_name) DO UPDATE SET
+            cutoff = EXCLUDED.cutoff, last_timestamp = NULL, last_id = NULL, rows_deleted = 0,
+            bytes_freed = 0, started_at = EXCLUDED.started_at, updated_at = EXCLUDED.updated_at, finished_at = NULL
+    """, (table, cutoff, now, now))
+    return START_POSITION, 0, 0
+
+
+def _log_blockers(cursor, table):
+    """Log the sessions holding locks on `table` or any of its partitions."""
+    try:
+        cursor.execute("""
+            SELECT DISTINCT a.pid, a.state, a.query_start, left(a.query, 200)
+            FROM pg_locks l
+            JOIN pg_stat_activity a ON a.pid = l.pid
+            WHERE l.granted
+              AND l.pid <> pg_backend_pid()
+              AND l.relation IN (SELECT relid FROM pg_partition_tree(to_regclass(%s)))
+        """, (table,))
+        for pid, state, started, query in cursor.fetchall():
+            logger.warning(f"    lock held by PID {pid} ({state}, since {started}): {query}")
+    except psycopg2.Error as e:
+        logger.error(f"Failed to fetch blocking queries: {e}")
+
+
+def _delete_batch(conn, table, statement, cutoff, position, batch_size):
+    """Delete one batch and advance the checkpoint in the same transaction."""
+    with conn.cursor() as cursor:
+        cursor.execute(f"SET LOCAL lock_timeout = '{RETENTION_LOCK_TIMEOUT}'")
+        cursor.execute(statement, {
+            'cutoff': cutoff,
+            'after_timestamp': position[0],
+            'after_id': position[1],
+            'limit': batch_size,
+        })
+        deleted = cursor.fetchall()
+        if not deleted:
+            return None, 0, {}
+
+        freed = {table: sum(row[3] for row in deleted)}
+        data_ids = sorted({row[2] for row in deleted if row[2] is not None})
+        if data_ids:
+            cursor.execute(UNREFERENCED_BINARY_DELETE, {'data_ids': data_ids})
+            binary_sizes = [row[0] for row in cursor.fetchall()]
+            freed['visionmon_binary_data'] = (len(binary_sizes), sum(binary_sizes))
+
+        last_id, last_timestamp = deleted[-1][0], deleted[-1][1]
+        cursor.execute("""
+            UPDATE retention_checkpoint
+            SET last_timestamp = %s, last_id = %s, rows_deleted = rows_deleted + %s,
+                bytes_freed = bytes_freed + %s, updated_at = %s
+            WHERE table_name = %s
+        """, (last_timestamp, last_id, len(deleted), freed[table], timezone.now(), table))
+    conn.commit()
+    return (last_timestamp, last_id), len(deleted), freed
+
+
+def _new_stats():
+    return {'rows': 0, 'bytes': 0, 'seconds': 0.0, 'finished': False}
+
+
+def run_retention(retention_days=RETENTION_DAYS, batch_size=RETENTION_BATCH_SIZE, sleep=RETENTION_BATCH_SLEEP,
+                  max_runtime=RETENTION_MAX_RUNTIME, restart=False, max_lock_retries=5):
+    """
+    Delete rows older than `retention_days` in batches of `batch_size`, sleeping
+    `sleep` seconds between batches and stopping after `max_runtime` seconds.
+    Returns per-table stats: rows, bytes, seconds, rows_per_sec and finished.
+    """
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    deadline = time.monotonic() + max_runtime
+    stats = {}
+
+    with db_connection() as conn:
+        for table, statement in RETENTION_TABLES:
+            with conn.cursor() as cursor:
+                position, previous_rows, previous_bytes = _load_checkpoint(cursor, table, cutoff, restart)
+            conn.commit()
+            if previous_rows:
+                logger.info(f"{table}: {previous_rows} rows ({format_bytes(previous_bytes)}) "
+                            f"already deleted by the interrupted run")
+
+            table_stats = stats[table] = _new_stats()
+            # Orphaned frames are deleted in the metadata batches and reported separately.
+            binary_stats = None
+            if table == 'visionmon_metadata':
+                binary_stats = stats['visionmon_binary_data'] = _new_stats()
+            started = time.monotonic()
+            lock_failures = 0
+            while time.monotonic() < deadline:
+                try:
+                    new_position, rows, freed = _delete_batch(conn, table, statement, cutoff, position, batch_size)
+                except psycopg2.errors.LockNotAvailable:
+                    conn.rollback()
+                    lock_failures += 1
+                    logger.warning(f"Retention batch on {table} hit the {RETENTION_LOCK_TIMEOUT} lock timeout "
+                                   f"({lock_failures}/{max_lock_retries})")
+                    with conn.cursor() as cursor:
+                        _log_blockers(cursor, table)
+                        if binary_stats is not None:
+                            _log_blockers(cursor, 'visionmon_binary_data')
+                    conn.rollback()
+                    if lock_failures >= max_lock_retries:
+                        break
+                    time.sleep(sleep * 2 ** lock_failures)
+                    continue
+
+                if new_position is None:
+                    table_stats['finished'] = True
+                    break
+                lock_failures = 0
+                position = new_position
+                table_stats['rows'] += rows
+                table_stats['bytes'] += freed[table]
+                if 'visionmon_binary_data' in freed:
+                    binary_stats['rows'] += freed['visionmon_binary_data'][0]
+                    binary_stats['bytes'] += freed['visionmon_binary_data'][1]
+                if rows < batch_size:
+                    table_stats['finished'] = True
+                    break
+                time.sleep(sleep)
+
+            table_stats['seconds'] = time.monotonic() - started
+            if binary_stats is not None:
+                binary_stats['seconds'] = table_stats['seconds']
+                binary_stats['finished'] = table_stats['finished']
+
+            if table_stats['finished']:
+                with conn.cursor() as cursor:
+                    cursor.execute("UPDATE retention_checkpoint SET finished_at = %s WHERE table_name = %s",
+                                   (timezone.now(), table))
+                conn.commit()
+            else:
+                logger.warning(f"Retention of {table} stopped early; the next run resumes after {position}")
+
+    for table, table_stats in stats.items():
+        seconds = table_stats['seconds']
+        table_stats['rows_per_sec'] = table_stats['rows'] / seconds if seconds else 0.0
+        logger.info(f"Retention {table}: {table_stats['rows']} rows, {format_bytes(table_stats['bytes'])} freed "
+                    f"in {seconds:.1f}s ({table_stats['rows_per_sec']:.0f} rows/s)"
+                    f"{'' if table_stats['finished'] else ', unfinished'}")
+    return stats
+
+
+def plan_retention(retention_days=RETENTION_DAYS, batch_size=RETENTION_BATCH_SIZE):
+    """
+    Dry run: what a retention run would delete (rows and stored bytes per table)
+    and the plans of its batch statements. Nothing is executed or modified.
+    """
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    params = {
+        'cutoff': cutoff,
+        'after_timestamp': START_POSITION[0],
+        'after_id': START_POSITION[1],
+        'limit': batch_size,
+        'data_ids': [],
+    }
+    report = {'cutoff': cutoff, 'tables': {}, 'plans': {}}
+    with db_connection() as conn, conn.cursor() as cursor:
+        # Belt and braces: nothing in here should write, and this guarantees it.
+        cursor.execute("SET TRANSACTION READ ONLY")
+        for table, query in DRY_RUN_QUERIES.items():
+            cursor.execute(query, params)
+            rows, size = cursor.fetchone()
+            report['tables'][table] = {'rows': rows, 'bytes': size}
+        for name, statement in (('visionmon_metadata', METADATA_BATCH),
+                                ('visionmon_binary_data', UNREFERENCED_BINARY_DELETE),
+                                ('state_result', STATE_RESULT_BATCH)):
+            # Plain EXPLAIN plans the statement without running it (unlike EXPLAIN ANALYZE).
+            cursor.execute("EXPLAIN " + statement, params)
+            report['plans'][name] = [row[0] for row in cursor.fetchall()]
+        conn.rollback()
+    return report
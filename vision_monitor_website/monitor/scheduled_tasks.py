@@ -2,14 +2,16 @@
 import asyncio
 import json
 import base64
-from datetime import datetime, time, timedelta
+from datetime import datetime, time
 from django.utils import timezone
 from .db_operations import get_latest_frame
 from .redis_operations import connect_redis
-from .config import ALERT_QUEUE
+from .config import ALERT_QUEUE, RETENTION_DAYS, FRAME_MIGRATION_INTERVAL
+from .partitions import ensure_partitions, drop_expired_partitions
+from .retention import run_retention, format_bytes
+from .frame_store import move_frames_to_store, collect_frame_garbage, archive_cold_frames
 import pytz
 import logging
-from django.db import connection
 from asgiref.sync import sync_to_async
 
 logger = logging.getLogger(__name__)
@@ -104,75 +106,49 @@ async def run_no_show_checks():
             logger.error(f"Error in no-show checks: {str(e)}")
         await asyncio.sleep(180)  # Check every 3 minutes
 
-def cleanup_old_entries():
+def cleanup_old_entries(**options):
+    """
+    Daily retention. Keyword options (batch_size, sleep, max_runtime, restart,
+    retention_days) are passed through to run_retention().
+    """
     logger.info('Starting cleanup operation...')
-    thirty_days_ago = timezone.now() - timedelta(days=30)
-    
-    logger.info(f'Will delete entries older than: {thirty_days_ago}')
-    
-    try:
-        with connection.cursor() as cursor:
-            logger.info('Executing deletion query...')
-            cursor.execute("""
-                WITH old_metadata AS (
-                    SELECT id, data_id 
-                    FROM visionmon_metadata 
-                    WHERE timestamp < %s
-                ),
-                deleted_metadata AS (
-                    DELETE FROM visionmon_metadata
-                    WHERE id IN (SELECT id FROM old_metadata)
-                    RETURNING id
-                ),
-                deleted_binary_data AS (
-                    DELETE FROM visionmon_binary_data
-                    WHERE id IN (SELECT data_id FROM old_metadata)
-                    RETURNING id
-                ),
-                old_state_results AS (
-                    SELECT id
-                    FROM state_result 
-                    WHERE timestamp < %s
-                ),
-                deleted_state_results AS (
-                    DELETE FROM state_result
-                    WHERE id IN (SELECT id FROM old_state_results)
-                    RETURNING id
-                )
-                SELECT 
-                    (SELECT COUNT(*) FROM deleted_metadata) +
-                    (SELECT COUNT(*) FROM deleted_binary_data) +
-                    (SELECT COUNT(*) FROM deleted_state_results) as total_deleted;
-            """, [thirty_days_ago, thirty_days_ago])
-            
-            deleted_count = cursor.fetchone()[0]
-            logger.info(f'Successfully deleted {deleted_count} entries')
-
-    except Exception as e:
-        logger.error(f'Error during cleanup: {str(e)}')
-        try:
-            with connection.cursor() as cursor:
-                cursor.execute("""
-                    SELECT pid, state, query_start, query
-                    FROM pg_stat_activity
-                    WHERE state != 'idle';
-                """)
-                active_queries = cursor.fetchall()
-                logger.info('Active database queries:')
-                for query in active_queries:
-                    logger.info(f'    PID: {query[0]}, State: {query[1]}, Started: {query[2]}')
-                    logger.info(f'    Query: {query[3]}')
-        except Exception as db_error:
-            logger.error(f"Failed to fetch active queries: {db_error}")
-        raise
+    retention_days = options.get('retention_days', RETENTION_DAYS)
+    # Keep the next days' partitions ready and retire whole days past retention;
+    # the batched delete below only still finds rows in partitions that span
+    # more than one day (the pre-partitioning legacy range and DEFAULT).
+    created = ensure_partitions()
+    retired = drop_expired_partitions(retention_days)
+    logger.info(f'Created {len(created)} partition(s), retired {len(retired)}: {", ".join(retired) or "none"}')
 
+    stats = run_retention(**options)
+    # Frames old enough for the cold tier leave the frame store for their day archive
+    stats['frame_archive'] = archive_cold_frames()
+    # Stored frames whose rows were just dropped, deleted or archived
+    stats['frame_store'] = collect_frame_garbage(retention_days)
     logger.info('Cleanup operation completed')
+    return stats
 
 async def run_cleanup_old_entries():
     while True:
         try:
-            # Wrap the synchronous cleanup_old_entries in sync_to_async
-            await sync_to_async(cleanup_old_entries)()
+            # Wrap the synchronous cleanup_old_entries in sync_to_async; on a thread of its
+            # own, as the default shared thread would hold up the frame migration for the
+            # whole run
+            await sync_to_async(cleanup_old_entries, thread_sensitive=False)()
         except Exception as e:
             logger.error(f"Error in cleanup old entries: {str(e)}")
-        await asyncio.sleep(86400)  # Run once a day
\ No newline at end of file
+        await asyncio.sleep(86400)  # Run once a day
+
+async def run_frame_migration():
+    # The ingest pipeline still writes images into visionmon_binary_data; move
+    # them to the frame store shortly after they arrive.
+    if not FRAME_MIGRATION_INTERVAL:
+        return
+    while True:
+        try:
+            stats = await sync_to_async(move_frames_to_store, thread_sensitive=False)()
+            if stats['rows']:
+                logger.info(f"Moved {stats['rows']} frames ({format_bytes(stats['bytes'])}) to the frame store")
+        except Exception as e:
+            logger.error(f"Error moving frames to the frame store: {str(e)}")
+        await asyncio.sleep(FRAME_MIGRATION_INTERVAL)
\ No newline at end of file
@@ -1,67 +1,307 @@
 import json
 import logging
-from collections import deque, Counter
-from datetime import timedelta
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+import redis
 from django.utils import timezone
 from .alert_logic import AlertManager
-from .config import camera_names
+from .config import camera_names, STATE_PHRASE_CACHE_SIZE, STATE_STORE, STATE_WINDOW_MINUTES
+from .phrase_matching import PhraseClassifier
+from .state_store import RedisStateStore
 
 logger = logging.getLogger(__name__)
 
 alert_manager = AlertManager()
 
-camera_state_windows = {}
-facility_state_window = deque(maxlen=900)  # 15 minutes * 60 seconds = 900 seconds
 state_key_phrases = ["bustling", "big religious festival", "religious or spiritual gathering", "over capacity", "night-time", "nothing", "single person present", "people eating", "door open"]
+alerting_phrases = ["big religious festival", "door open"]
+
+WINDOW_MAX_AGE = timedelta(minutes=STATE_WINDOW_MINUTES)
+WINDOW_MAX_LENGTH = int(STATE_WINDOW_MINUTES * 60)  # 15 minutes * 60 seconds = 900 seconds
+
+
+class StateWindow:
+    """
+    The states of the last WINDOW_MAX_AGE (at most WINDOW_MAX_LENGTH of them)
+    with a weighted count of each relevant state, kept up to date as states
+    enter and leave the window instead of being recounted on every query.
+
+    `weight(state)` is called once per distinct state while it is in the window.
+    most_frequent() returns the state with the highest count x weight, ties
+    going to the state that appeared first (as Counter.most_common did); it only
+    rescans the distinct states after the leading one has left the window.
+    """
+
+    def __init__(self, weight, max_age=WINDOW_MAX_AGE, maxlen=WINDOW_MAX_LENGTH):
+        self.weight = weight
+        self.max_age = max_age
+        self.maxlen = maxlen
+        self._entries = deque()  # (state, timestamp, sequence number)
+        self._counts = {}  # relevant state -> [count, weight, deque of its sequence numbers]
+        self._sequence = 0
+        self._mode = None  # leading relevant state; None when it has to be recomputed
+        self._message = None  # id of the last message appended
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _rank(self, state):
+        count, weight, sequences = self._counts[state]
+        return count * weight, -sequences[0]
+
+    def _evict(self):
+        state, _, _ = self._entries.popleft()
+        entry = self._counts.get(state)
+        if entry is None:
+            return
+        entry[0] -= 1
+        entry[2].popleft()
+        if not entry[0]:
+            del self._counts[state]
+        if state == self._mode:
+            self._mode = None
+
+    def append(self, state, timestamp, message_id=None):
+        """Append `state`; a message delivered again (same `message_id`) is only counted once."""
+        if message_id is not None and message_id == self._message:
+            return
+        self._message = message_id
+        while self._entries and (timestamp - self._entries[0][1]) > self.max_age:
+            self._evict()
+        if len(self._entries) >= self.maxlen:
+            self._evict()
+
+        self._sequence += 1
+        self._entries.append((state, timestamp, self._sequence))
+        if not is_relevant_state(state):
+            return
+        entry = self._counts.get(state)
+        if entry is None:
+            entry = self._counts[state] = [0, self.weight(state), deque()]
+        entry[0] += 1
+        entry[2].append(self._sequence)
+        # Only the state just counted can have overtaken the leader
+        if self._mode is not None and self._mode != state and self._rank(state) > self._rank(self._mode):
+            self._mode = state
+        elif self._mode is None and len(self._counts) == 1:
+            self._mode = state
+
+    def most_frequent(self):
+        """
+        Leading relevant state, the most recent state if none is relevant, or
+        None for an empty window.
+        """
+        if not self._entries:
+            return None
+        if not self._counts:
+            return self._entries[-1][0]
+        if self._mode is None:
+            self._mode = max(self._counts, key=self._rank)
+        return self._mode
+
+
+def state_message_id(timestamp):
+    """
+    Id of the state message received at `timestamp` (its state_result or
+    facility_status timestamp), so every process that parses it agrees.
+    """
+    return f"{timestamp.timestamp():.6f}"
+
+class StateSnapshot:
+    """
+    What ingesting one state message made of the windows: the most frequent
+    facility state and camera states, the alert transitions it caused and the
+    cameras alerting after it. Published by the ingest path and never modified,
+    so readers can share one instance; `version` increases with every message.
+    """
+    __slots__ = ('version', 'facility_state', 'camera_states', 'alerts', 'alerting', 'computed_at')
 
-def parse_facility_state(raw_message):
+    def __init__(self, version, facility_state, camera_states, alerts, alerting, computed_at):
+        self.version = version
+        self.facility_state = facility_state
+        self.camera_states = camera_states  # {camera_id: most frequent state}
+        self.alerts = alerts  # ((camera_id, alert type, state), ...)
+        self.alerting = alerting  # {camera_id: state} of cameras in an alerting state
+        self.computed_at = computed_at
+
+    @property
+    def etag(self):
+        return f'state-{self.version}'
+
+    def to_dict(self):
+        return {
+            'version': self.version,
+            'facility_state': self.facility_state,
+            'camera_states': self.camera_states,
+            'alerts': [list(alert) for alert in self.alerts],
+            'alerting': self.alerting,
+            'computed_at': self.computed_at.isoformat(),
+        }
+
+    def to_json(self):
+        """JSON of the snapshot without its version, which the store assigns."""
+        data = self.to_dict()
+        del data['version']
+        return json.dumps(data)
+
+    @classmethod
+    def from_json(cls, version, data):
+        data = json.loads(data)
+        return cls(
+            version,
+            data['facility_state'],
+            data['camera_states'],
+            tuple(tuple(alert) for alert in data['alerts']),
+            data['alerting'],
+            datetime.fromisoformat(data['computed_at']),
+        )
+
+def message_states(raw_message):
+    """(facility state, {camera_id: state}) as sent in a state message; raises ValueError if it is not JSON."""
+    outer_data = json.loads(raw_message)
+    return outer_data.get('facility_state', '').strip(), outer_data.get('camera_states', {})
+
+def ingest_state_message(raw_message, message_id=None):
+    """
+    Append a state message to the windows, advance the alert states and
+    publish the resulting StateSnapshot, which is returned (None if the
+    message cannot be parsed). Only the paths that receive state messages (the
+    redis_listener and the update_state view) call this; everything else
+    reads get_state_snapshot(). Pass `message_id` (see state_message_id()) so
+    a message delivered twice is only counted once.
+    """
     try:
-        outer_data = json.loads(raw_message)
-        facility_state = outer_data.get('facility_state', '').strip()
-        camera_states = outer_data.get('camera_states', {})
+        facility_state, camera_states = message_states(raw_message)
         
         logger.info(f"Parse Facility Camera states: {camera_states}")
         
         current_time = timezone.now()
         
-        update_facility_state(facility_state, current_time)
-        for camera_id, state in camera_states.items():
-            update_camera_state(camera_id, state, current_time)
-        
-        most_frequent_facility_state = get_most_frequent_facility_state()
-        most_frequent_states = {camera_id: get_most_frequent_state(camera_id) for camera_id in camera_states.keys()}
+        most_frequent_facility_state, most_frequent_states = record_states(
+            facility_state, camera_states, current_time, message_id)
         
         logger.info(f"Parse Facility Most frequent states: {most_frequent_states}")
         
+        alerting = {camera_id: state for camera_id, state in most_frequent_states.items() if is_alerting_state(state)}
+        alert_results = update_alert_states({camera_id: camera_id in alerting for camera_id in most_frequent_states})
         alerts = []
         for camera_id, state in most_frequent_states.items():
-            is_alerting = any(phrase in state.lower() for phrase in ["big religious festival", "door open"])
-            alert_result = alert_manager.update_state(camera_id, is_alerting)
+            alert_result = alert_results[camera_id]
             if alert_result:
                 alerts.append((camera_id, alert_result, state))
         
         logger.info(f"Parse Facility Alerts: {alerts}")
         
-        return most_frequent_facility_state, most_frequent_states, alerts
+        return publish_state_snapshot(StateSnapshot(
+            None, most_frequent_facility_state, most_frequent_states, tuple(alerts), alerting, current_time))
     except json.JSONDecodeError as e:
         logger.error(f"Error parsing JSON: {str(e)}")
     except Exception as e:
         logger.error(f"Unexpected error while parsing facility state: {str(e)}")
-    return None, {}, []
+    return None
+
+# The latest snapshot this process published or read
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+def publish_state_snapshot(snapshot):
+    """Give `snapshot` the next version and make it the latest one, for every process."""
+    global _snapshot
+    version = None
+    store = get_state_store()
+    if store is not None and store.available():
+        try:
+            version = store.publish_snapshot(snapshot.to_json())
+        except redis.RedisError as e:
+            logger.error(f"Redis error publishing state snapshot, only this process will see it: {e}")
+    with _snapshot_lock:
+        if version is None:
+            version = _snapshot.version + 1 if _snapshot is not None else 1
+        snapshot.version = version
+        if _snapshot is None or version > _snapshot.version:
+            _snapshot = snapshot
+    return snapshot
+
+def get_state_snapshot():
+    """
+    The latest published StateSnapshot, without touching the windows; None if
+    no state message has been ingested yet. One small Redis read while the
+    snapshot this process holds is current.
+    """
+    global _snapshot
+    store = get_state_store()
+    if store is not None and store.available():
+        try:
+            version = store.snapshot_version()
+            current = _snapshot
+            if current is not None and current.version == version:
+                return current
+            published = store.get_snapshot()
+            if published is not None:
+                snapshot = StateSnapshot.from_json(*published)
+                with _snapshot_lock:
+                    if _snapshot is None or snapshot.version > _snapshot.version:
+                        _snapshot = snapshot
+                return snapshot
+        except redis.RedisError as e:
+            logger.error(f"Redis error reading state snapshot, using this process's: {e}")
+    return _snapshot
+
+def record_states(facility_state, camera_states, timestamp, message_id=None):
+    """
+    Append one message's states to the windows; returns (most frequent
+    facility state, {camera_id: most frequent state}). The shared windows in
+    Redis decide; this process's own windows are kept up to date as well and
+    take over while Redis is unreachable.
+    """
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp)
+    update_facility_state(facility_state, timestamp, message_id)
+    for camera_id, state in camera_states.items():
+        update_camera_state(camera_id, state, timestamp, message_id)
+
+    store = get_state_store()
+    if store is not None and store.available():
+        updates = [(FACILITY_WINDOW, facility_state, is_relevant_state(facility_state), facility_state_weight(facility_state))]
+        updates += [
+            (camera_window(camera_id), state, is_relevant_state(state), camera_state_weight(camera_id)(state))
+            for camera_id, state in camera_states.items()
+        ]
+        try:
+            modes = store.append(updates, timestamp, message_id)
+            return modes[0] or "Unknown", {camera_id: mode or "Unknown" for camera_id, mode in zip(camera_states, modes[1:])}
+        except redis.RedisError as e:
+            logger.error(f"Redis error updating shared state windows, using this process's windows: {e}")
+
+    most_frequent_states = {camera_id: get_most_frequent_state(camera_id) for camera_id in camera_states.keys()}
+    return get_most_frequent_facility_state(), most_frequent_states
 
-def update_camera_state(camera_id, state, timestamp):
+def update_alert_states(alerting):
+    """
+    alert_manager.update_state() for each {camera_id: is_alerting}, through the
+    shared alert states in Redis when available; {camera_id: transition or None}.
+    As with the windows, this process's alert states are kept up to date as
+    well, so taking over while Redis is unreachable does not replay old changes.
+    """
+    transitions = {camera_id: alert_manager.update_state(camera_id, is_alerting) for camera_id, is_alerting in alerting.items()}
+    store = get_state_store()
+    if store is not None and store.available():
+        try:
+            return store.update_alerts(alerting)
+        except redis.RedisError as e:
+            logger.error(f"Redis error updating shared alert states, using this process's alert states: {e}")
+    return transitions
+
+def update_camera_state(camera_id, state, timestamp, message_id=None):
     if camera_id not in camera_state_windows:
         logger.info(f"Creating state window for camera {camera_id}")
-        camera_state_windows[camera_id] = deque(maxlen=900)  # 15 minutes * 60 seconds = 900 seconds
+        camera_state_windows[camera_id] = StateWindow(camera_state_weight(camera_id))
     
     if timezone.is_naive(timestamp):
         timestamp = timezone.make_aware(timestamp)
     
-    current_time = timestamp
-    while camera_state_windows[camera_id] and (current_time - camera_state_windows[camera_id][0][1]) > timedelta(minutes=15):
-        camera_state_windows[camera_id].popleft()
-    
-    camera_state_windows[camera_id].append((state, timestamp))
+    camera_state_windows[camera_id].append(state, timestamp, message_id)
     logger.info(f"Updated state for camera {camera_id}: {state} at {timestamp}")
 
 # Define alert state penalties and problematic states for specific cameras
@@ -128,71 +368,94 @@ facility_config = {
     }
 }
 
+# Every phrase the checks below look for, matched in one pass and memoized per
+# state string (see monitor/phrase_matching.py)
+state_classifier = PhraseClassifier(
+    state_key_phrases
+    + alerting_phrases
+    + [alert for config in camera_alert_config.values() for alert in config["alert_states"]]
+    + list(facility_config),
+    cache_size=STATE_PHRASE_CACHE_SIZE,
+)
+RELEVANT_STATE_MASK = state_classifier.mask(state_key_phrases)
+ALERTING_STATE_MASK = state_classifier.mask(alerting_phrases)
+# In facility_config order: the first entry a state mentions sets its weight
+FACILITY_STATE_WEIGHTS = [(state_classifier.bits[config_state], config["penalty"]) for config_state, config in facility_config.items()]
+
+def is_relevant_state(state):
+    """Whether a state mentions one of state_key_phrases."""
+    return bool(state_classifier.classify(state) & RELEVANT_STATE_MASK)
+
+def is_alerting_state(state):
+    return bool(state_classifier.classify(state) & ALERTING_STATE_MASK)
+
+def facility_state_weight(state):
+    bits = state_classifier.classify(state)
+    for bit, penalty in FACILITY_STATE_WEIGHTS:
+        if bits & bit:
+            return penalty
+    return 1.0  # Default weight if no specific config
+
+def camera_state_weight(camera_id):
+    """Weight function of a camera's window: its alert states count `penalty` times."""
+    camera_config = camera_alert_config.get(camera_id)
+    alert_mask = state_classifier.mask(camera_config["alert_states"]) if camera_config else 0
+
+    def weight(state):
+        if state_classifier.classify(state) & alert_mask:
+            # Apply penalty to specific alert states for this camera
+            return camera_config["penalty"]
+        return 1.0
+    return weight
+
+# This process's windows; with STATE_STORE = 'redis' they only decide while Redis is unreachable
+camera_state_windows = {}
+facility_state_window = StateWindow(facility_state_weight)
+
+# Names of the shared windows in Redis (monitor/state_store.py)
+FACILITY_WINDOW = 'facility'
+
+def camera_window(camera_id):
+    return f'camera:{camera_id}'
+
+_state_store = None
+_state_store_lock = threading.Lock()
+
+def get_state_store():
+    """The shared RedisStateStore, or None with STATE_STORE = 'local'."""
+    global _state_store
+    if STATE_STORE != 'redis':
+        return None
+    if _state_store is None:
+        with _state_store_lock:
+            if _state_store is None:
+                _state_store = RedisStateStore(WINDOW_MAX_AGE, WINDOW_MAX_LENGTH)
+    return _state_store
+
 def get_most_frequent_state(camera_id):
     if camera_id not in camera_state_windows:
         logger.error(f"Camera {camera_id} not found in state windows")
         return "Unknown"
     
-    if not camera_state_windows[camera_id]:
+    most_common_state = camera_state_windows[camera_id].most_frequent()
+    if most_common_state is None:
         logger.warning(f"No states recorded for camera {camera_id}")
         return "Unknown"
-    
-    relevant_states = [state for state, _ in camera_state_windows[camera_id] if any(phrase in state.lower() for phrase in state_key_phrases)]
-    
-    if not relevant_states:
-        logger.warning(f"No relevant states found for camera {camera_id}")
-        return camera_state_windows[camera_id][-1][0]  # Return the most recent state if no relevant states
-    
-    # Get the alert config for this camera
-    camera_config = camera_alert_config.get(camera_id)
-    
-    # Create a weighted Counter
-    state_counts = Counter()
-    for state in relevant_states:
-        if camera_config and any(alert in state.lower() for alert in camera_config["alert_states"]):
-            # Apply penalty to specific alert states for this camera
-            state_counts[state] += camera_config["penalty"]
-        else:
-            state_counts[state] += 1.0
-    
-    most_common_state = state_counts.most_common(1)[0][0]
     logger.info(f"Most frequent state for camera {camera_id}: {most_common_state}")
     return most_common_state
 
-def update_facility_state(facility_state, timestamp):
-    global facility_state_window
-    
+def update_facility_state(facility_state, timestamp, message_id=None):
     if timezone.is_naive(timestamp):
         timestamp = timezone.make_aware(timestamp)
     
-    current_time = timestamp
-    while facility_state_window and (current_time - facility_state_window[0][1]) > timedelta(minutes=15):
-        facility_state_window.popleft()
-    
-    facility_state_window.append((facility_state, timestamp))
+    facility_state_window.append(facility_state, timestamp, message_id)
     logger.info(f"Updated facility state: {facility_state} at {timestamp}")
 
 def get_most_frequent_facility_state():
-    if not facility_state_window:
+    most_common_state = facility_state_window.most_frequent()
+    if most_common_state is None:
         logger.warning("No facility states recorded")
         return "Unknown"
-    
-    relevant_states = [state for state, _ in facility_state_window if any(phrase in state.lower() for phrase in state_key_phrases)]
-    
-    if not relevant_states:
-        logger.warning("No relevant states found in facility states")
-        return facility_state_window[-1][0]  # Return the most recent state if no relevant states
-    
-    # Create a weighted Counter
-    state_counts = Counter()
-    for state in relevant_states:
-        for config_state, config in facility_config.items():
-            if config_state in state.lower():
-                state_counts[state] += config["penalty"]
-                break
-        else:
-            state_counts[state] += 1.0  # Default weight if no specific config
-
-    most_common_state = state_counts.most_common(1)[0][0]
+
     logger.info(f"Most frequent facility state: {most_common_state}")
     return most_common_state
\ No newline at end of file
@@ -0,0 +1,332 @@
+# monitor/state_store.py
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import redis
+
+from .alert_logic import FLAP_THRESHOLD, FLAP_INTERVAL
+from .config import REDIS_HOST, REDIS_PORT, STATE_STORE_TTL
+
+logger = logging.getLogger(__name__)
+
+# The state windows and alert states behind ingest_state_message(), kept in
+# Redis so the redis_listener and the web workers all work on the same windows,
+# and the windows survive restarts. A window is a few keys sharing one
+# hash tag, so a script touching them also works on a Redis Cluster:
+#
+#   state_window:{<window>}:meta     hash {head, seq, mode, message}: sequence numbers of the oldest and
+#                                    newest entry, the leading state (absent while it has to be
+#                                    recomputed) and the id of the last message appended
+#   state_window:{<window>}:entries  hash seq -> "<epoch microseconds>|<state>"
+#   state_window:{<window>}:next     hash seq -> seq of the next entry with the same relevant state
+#   state_window:{<window>}:counts   hash relevant state -> entries in the window
+#   state_window:{<window>}:weights  hash relevant state -> weight
+#   state_window:{<window>}:first    hash relevant state -> seq of its oldest entry
+#   state_window:{<window>}:last     hash relevant state -> seq of its newest entry
+#   alert_state:{<name>}             hash {alerting, flapping, changes}
+#   state_snapshot                   hash {version, data}: the latest StateSnapshot as JSON (without
+#                                    its version); never expires
+#
+# The scripts are StateWindow.append()/most_frequent() and AlertState.update()
+# run inside Redis, so updates from several processes apply atomically and in
+# order. Relevance and weights are computed by the caller, which has the phrase
+# configuration; every key expires after `ttl` seconds without updates.
+
+WINDOW_KEY = 'state_window:{{{window}}}:{part}'
+WINDOW_KEY_PARTS = ('meta', 'entries', 'next', 'counts', 'weights', 'first', 'last')
+ALERT_KEY = 'alert_state:{{{name}}}'
+SNAPSHOT_KEY = 'state_snapshot'
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+# After a Redis error the store is not tried again for this many seconds, so an
+# outage does not add connection timeouts to every message and page load.
+RETRY_INTERVAL = 30
+
+WINDOW_FUNCTIONS = """
+local meta, entries, nexts, counts, weights, firsts, lasts = KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5], KEYS[6], KEYS[7]
+local head = tonumber(redis.call('HGET', meta, 'head')) or 1
+local seq = tonumber(redis.call('HGET', meta, 'seq')) or 0
+local mode = redis.call('HGET', meta, 'mode')
+
+local function split(entry)
+    local separator = string.find(entry, '|', 1, true)
+    return tonumber(string.sub(entry, 1, separator - 1)), string.sub(entry, separator + 1)
+end
+
+-- Highest count x weight, ties going to the state that entered the window first
+local function outranks(state, other)
+    local score = tonumber(redis.call('HGET', counts, state)) * tonumber(redis.call('HGET', weights, state))
+    local other_score = tonumber(redis.call('HGET', counts, other)) * tonumber(redis.call('HGET', weights, other))
+    if score ~= other_score then
+        return score > other_score
+    end
+    return tonumber(redis.call('HGET', firsts, state)) < tonumber(redis.call('HGET', firsts, other))
+end
+
+local function most_frequent()
+    if head > seq then
+        return false
+    end
+    if not mode then
+        local states = redis.call('HKEYS', counts)
+        if #states == 0 then
+            local _, latest = split(redis.call('HGET', entries, seq))
+            return latest
+        end
+        mode = states[1]
+        for i = 2, #states do
+            if outranks(states[i], mode) then
+                mode = states[i]
+            end
+        end
+        redis.call('HSET', meta, 'mode', mode)
+    end
+    return mode
+end
+"""
+
+# KEYS: the window's keys in WINDOW_KEY_PARTS order
+# ARGV: state, epoch microseconds, relevant (1/0), weight, max age and max length, ttl, message id ('' for none)
+# Returns the window's most frequent state after the append.
+APPEND_STATE_SCRIPT = WINDOW_FUNCTIONS + """
+local state, now, relevant, weight = ARGV[1], tonumber(ARGV[2]), ARGV[3] == '1', ARGV[4]
+local max_age, maxlen, ttl, message = tonumber(ARGV[5]), tonumber(ARGV[6]), tonumber(ARGV[7]), ARGV[8]
+
+-- A message delivered again is only counted once
+if message ~= '' and message == redis.call('HGET', meta, 'message') then
+    return most_frequent()
+end
+
+local function evict()
+    local _, evicted = split(redis.call('HGET', entries, head))
+    local count = tonumber(redis.call('HGET', counts, evicted))
+    if count then
+        if count == 1 then
+            redis.call('HDEL', counts, evicted)
+            redis.call('HDEL', weights, evicted)
+            redis.call('HDEL', firsts, evicted)
+            redis.call('HDEL', lasts, evicted)
+        else
+            redis.call('HSET', counts, evicted, count - 1)
+            redis.call('HSET', firsts, evicted, redis.call('HGET', nexts, head))
+            redis.call('HDEL', nexts, head)
+        end
+        if evicted == mode then
+            mode = false
+        end
+    end
+    redis.call('HDEL', entries, head)
+    head = head + 1
+end
+
+while head <= seq do
+    local timestamp = split(redis.call('HGET', entries, head))
+    if now - timestamp <= max_age then
+        break
+    end
+    evict()
+end
+if seq - head + 1 >= maxlen then
+    evict()
+end
+
+seq = seq + 1
+redis.call('HSET', entries, seq, ARGV[2] .. '|' .. state)
+if relevant then
+    local last = redis.call('HGET', lasts, state)
+    if last then
+        redis.call('HINCRBY', counts, state, 1)
+        redis.call('HSET', nexts, last, seq)
+    else
+        redis.call('HSET', counts, state, 1)
+        redis.call('HSET', weights, state, weight)
+        redis.call('HSET', firsts, state, seq)
+    end
+    redis.call('HSET', lasts, state, seq)
+    -- Only the state just counted can have overtaken the leader
+    if mode and mode ~= state and outranks(state, mode) then
+        mode = state
+    elseif not mode and redis.call('HLEN', counts) == 1 then
+        mode = state
+    end
+end
+
+redis.call('HSET', meta, 'head', head, 'seq', seq, 'message', message)
+if mode then
+    redis.call('HSET', meta, 'mode', mode)
+else
+    redis.call('HDEL', meta, 'mode')
+end
+local result = most_frequent()
+for _, key in ipairs(KEYS) do
+    redis.call('EXPIRE', key, ttl)
+end
+return result
+"""
+
+MOST_FREQUENT_SCRIPT = WINDOW_FUNCTIONS + """
+return most_frequent()
+"""
+
+# KEYS: the alert's key
+# ARGV: alerting (1/0), time, flap threshold, flap interval, ttl
+# Returns the transition AlertState.update() would, or nil.
+UPDATE_ALERT_SCRIPT = """
+local key, alerting, now = KEYS[1], ARGV[1], tonumber(ARGV[2])
+local threshold, interval, ttl = tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5])
+redis.call('EXPIRE', key, ttl)
+if alerting == (redis.call('HGET', key, 'alerting') or '0') then
+    return false
+end
+
+local changes = {}
+for change in string.gmatch(redis.call('HGET', key, 'changes') or '', '[^,]+') do
+    table.insert(changes, change)
+end
+table.insert(changes, ARGV[2])
+while #changes > threshold do
+    table.remove(changes, 1)
+end
+local flapping = redis.call('HGET', key, 'flapping') == '1'
+redis.call('HSET', key, 'alerting', alerting, 'changes', table.concat(changes, ','))
+redis.call('EXPIRE', key, ttl)
+
+if #changes == threshold then
+    if now - tonumber(changes[1]) <= interval then
+        if not flapping then
+            redis.call('HSET', key, 'flapping', '1')
+            return 'FLAPPING_START'
+        end
+    elseif flapping then
+        redis.call('HSET', key, 'flapping', '0')
+        return 'FLAPPING_END'
+    end
+end
+if flapping then
+    return false
+end
+if alerting == '1' then
+    return 'ALERT'
+end
+return 'RESOLVED'
+"""
+
+
+# Versions only ever increase, also across restarts, so they can serve as ETags
+PUBLISH_SNAPSHOT_SCRIPT = """
+local version = redis.call('HINCRBY', KEYS[1], 'version', 1)
+redis.call('HSET', KEYS[1], 'data', ARGV[1])
+return version
+"""
+
+
+def window_keys(window):
+    return [WINDOW_KEY.format(window=window, part=part) for part in WINDOW_KEY_PARTS]
+
+
+def epoch_microseconds(timestamp):
+    """Exact integer microseconds since the epoch of an aware datetime."""
+    return (timestamp - EPOCH) // timedelta(microseconds=1)
+
+
+class RedisStateStore:
+    """
+    State windows and alert states shared through Redis. All windows of a
+    message go to Redis in one pipelined round trip, as do all alert updates;
+    each script runs atomically. Raises redis.RedisError when Redis is
+    unreachable, so the caller can fall back to its own windows; available()
+    is False for RETRY_INTERVAL seconds after that.
+    """
+
+    def __init__(self, max_age, maxlen, redis_client=None, ttl=STATE_STORE_TTL,
+                 flap_threshold=FLAP_THRESHOLD, flap_interval=FLAP_INTERVAL):
+        self.redis = redis_client or redis.Redis(host=REDIS_HOST, port=REDIS_PORT,
+                                                 socket_timeout=2, socket_connect_timeout=2)
+        self.max_age = max_age // timedelta(microseconds=1)
+        self.maxlen = maxlen
+        self.ttl = ttl
+        self.flap_threshold = flap_threshold
+        self.flap_interval = flap_interval
+        self._append_script = self.redis.register_script(APPEND_STATE_SCRIPT)
+        self._most_frequent_script = self.redis.register_script(MOST_FREQUENT_SCRIPT)
+        self._alert_script = self.redis.register_script(UPDATE_ALERT_SCRIPT)
+        self._publish_script = self.redis.register_script(PUBLISH_SNAPSHOT_SCRIPT)
+        self._lock = threading.Lock()
+        self._stats = {'appends': 0, 'alert_updates': 0, 'redis_errors': 0}
+        self._retry_at = 0.0
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _call(self, call):
+        try:
+            return call()
+        except redis.RedisError:
+            self._count('redis_errors')
+            self._retry_at = time.monotonic() + RETRY_INTERVAL
+            raise
+
+    def available(self):
+        return time.monotonic() >= self._retry_at
+
+    def append(self, updates, timestamp, message_id=None):
+        """
+        Append one message's states, `updates` being (window, state, relevant,
+        weight) tuples, and return each window's most frequent state after it.
+        """
+        now = epoch_microseconds(timestamp)
+        pipeline = self.redis.pipeline(transaction=False)
+        for window, state, relevant, weight in updates:
+            self._append_script(
+                keys=window_keys(window),
+                args=[state, now, int(relevant), repr(float(weight)), self.max_age, self.maxlen, self.ttl, message_id or ''],
+                client=pipeline,
+            )
+        modes = self._call(pipeline.execute)
+        self._count('appends', len(updates))
+        return [mode.decode('utf-8') if mode is not None else None for mode in modes]
+
+    def most_frequent(self, windows):
+        """Most frequent state of each window, None for an empty one."""
+        pipeline = self.redis.pipeline(transaction=False)
+        for window in windows:
+            self._most_frequent_script(keys=window_keys(window), client=pipeline)
+        return [mode.decode('utf-8') if mode is not None else None for mode in self._call(pipeline.execute)]
+
+    def update_alerts(self, alerting, now=None):
+        """AlertManager.update_state() for each {name: is_alerting}; {name: transition or None}."""
+        now = repr(time.time() if now is None else float(now))
+        names = list(alerting)
+        pipeline = self.redis.pipeline(transaction=False)
+        for name in names:
+            self._alert_script(
+                keys=[ALERT_KEY.format(name=name)],
+                args=[int(bool(alerting[name])), now, self.flap_threshold, self.flap_interval, self.ttl],
+                client=pipeline,
+            )
+        results = self._call(pipeline.execute)
+        self._count('alert_updates', len(names))
+        return {name: result.decode('ascii') if result is not None else None for name, result in zip(names, results)}
+
+    def publish_snapshot(self, data):
+        """Store a snapshot's JSON `data` as the latest one; returns its version."""
+        return self._call(lambda: self._publish_script(keys=[SNAPSHOT_KEY], args=[data]))
+
+    def snapshot_version(self):
+        """Version of the latest snapshot, 0 if none was published."""
+        return self._call(lambda: int(self.redis.hget(SNAPSHOT_KEY, 'version') or 0))
+
+    def get_snapshot(self):
+        """(version, JSON data) of the latest snapshot, or None."""
+        version, data = self._call(lambda: self.redis.hmget(SNAPSHOT_KEY, 'version', 'data'))
+        if data is None:
+            return None
+        return int(version), data
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,316 @@
+import base64
+import random
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import skipUnless
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from .alert_logic import AlertManager, AlertState
+from .db_operations import collapse_duplicate_events, decode_timeline_cursor, encode_timeline_cursor
+from .phrase_matching import PhraseClassifier
+from .replay import alert_transitions, default_camera_config, encode_states, replay, replay_live, windowed_modes
+from .state_management import (
+    StateWindow,
+    WINDOW_MAX_AGE,
+    WINDOW_MAX_LENGTH,
+    camera_state_weight,
+    alerting_phrases,
+    facility_config,
+    facility_state_weight,
+    is_alerting_state,
+    is_relevant_state,
+    state_key_phrases,
+)
+from .state_store import RedisStateStore
+
+try:
+    import fakeredis
+    import lupa  # noqa: F401 -- fakeredis runs the Lua scripts with it
+except ImportError:
+    fakeredis = None
+
+# Relevant and irrelevant states, alerting ones and ones that get a camera's penalty
+STATES = [
+    "nothing", "night-time", "single person present", "people eating", "bustling crowd at the entrance",
+    "big religious festival", "religious or spiritual gathering", "over capacity", "door open at the back",
+    "empty hallway", "camera offline",
+]
+
+START = datetime(2024, 3, 1, tzinfo=dt_timezone.utc)
+
+
+def random_states(seed, count, states=STATES, gaps=(0, 0.5, 1, 1, 1, 2, 3, 7, 45)):
+    """
+    (timestamp, state) pairs that mostly repeat the previous state, `gaps`
+    seconds apart, with the odd gap long enough to empty a window.
+    """
+    rng = random.Random(seed)
+    timestamp = START
+    state = rng.choice(states)
+    for _ in range(count):
+        timestamp += timedelta(seconds=rng.choice(gaps) if rng.random() > 0.005 else rng.uniform(120, 1200))
+        if rng.random() < 0.3:
+            state = rng.choice(states)
+        yield timestamp, state
+
+
+class TimelineCursorTests(SimpleTestCase):
+    def test_round_trip(self):
+        for timestamp, event_id in [
+            (datetime(2024, 3, 1, 12, 30, 45, 123456, tzinfo=dt_timezone.utc), 42),
+            (datetime(2024, 3, 1, 7, 0, tzinfo=dt_timezone(timedelta(hours=-5))), 1),
+            (datetime(1999, 12, 31, 23, 59, 59, tzinfo=dt_timezone.utc), 2 ** 40),
+        ]:
+            cursor = encode_timeline_cursor(timestamp, event_id)
+            self.assertEqual(decode_timeline_cursor(cursor), (timestamp, event_id))
+
+    def test_cursor_is_url_safe(self):
+        cursor = encode_timeline_cursor(datetime(2024, 3, 1, 12, 30, 45, 999999, tzinfo=dt_timezone.utc), 123456789)
+        self.assertNotIn('=', cursor)
+        self.assertTrue(set(cursor) <= set('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_'))
+
+    def test_malformed_cursors(self):
+        def encode(payload):
+            return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+        for cursor in [
+            '',
+            'not a cursor!',
+            'é',
+            encode(b'not json'),
+            encode(b'{"timestamp": "2024-03-01T12:00:00+00:00"}'),
+            encode(b'["2024-03-01T12:00:00+00:00"]'),
+            encode(b'["not a date", 1]'),
+            encode(b'["2024-03-01T12:00:00+00:00", "x"]'),
+            encode(b'[null, 1]'),
+        ]:
+            with self.assertRaises(ValueError, msg=cursor):
+                decode_timeline_cursor(cursor)
+
+
+
+class CollapseDuplicateEventsTests(SimpleTestCase):
+    def events(self, *specs):
+        # (camera_id, timestamp) pairs, newest first
+        return [{'camera_id': camera_id, 'timestamp': timestamp} for camera_id, timestamp in specs]
+
+    def test_consecutive_duplicates_fold_into_newest(self):
+        events = self.events(("Hall 2", "12:05"), ("Hall 2", "12:04"), ("Hall 2", "12:03"), ("Hall 2", "12:02"))
+        collapsed = collapse_duplicate_events(events, ["a", "a", "a", "b"])
+        self.assertEqual(collapsed, [
+            {'camera_id': "Hall 2", 'timestamp': "12:05", 'count': 3, 'first_timestamp': "12:03"},
+            {'camera_id': "Hall 2", 'timestamp': "12:02"},
+        ])
+
+    def test_runs_are_per_camera(self):
+        # Another camera's events in between do not end a run
+        events = self.events(("Hall 2", "12:05"), ("Axis 7", "12:05"), ("Hall 2", "12:04"), ("Axis 7", "12:04"))
+        collapsed = collapse_duplicate_events(events, ["a", "b", "a", "c"])
+        self.assertEqual(collapsed, [
+            {'camera_id': "Hall 2", 'timestamp': "12:05", 'count': 2, 'first_timestamp': "12:04"},
+            {'camera_id': "Axis 7", 'timestamp': "12:05"},
+            {'camera_id': "Axis 7", 'timestamp': "12:04"},
+        ])
+
+    def test_keeps_events_that_are_not_consecutive_duplicates(self):
+        events = self.events(("Hall 2", "12:05"), ("Hall 2", "12:04"), ("Hall 2", "12:03"), ("Axis 7", "12:02"),
+                             ("Hall 2", "12:01"), ("Hall 2", "12:00"))
+        # The same frame again after a different one, the same hash on another camera,
+        # and events without a stored hash
+        collapsed = collapse_duplicate_events(events, ["a", "b", "a", "a", None, None])
+        self.assertEqual(collapsed, events)
+        self.assertFalse(any('count' in event for event in collapsed))
+
+    def test_empty(self):
+        self.assertEqual(collapse_duplicate_events([], []), [])
+
+
+class PhraseClassifierTests(SimpleTestCase):
+    """classify() finds exactly the phrases the `phrase in text.lower()` checks it replaces find."""
+
+    def assert_matches_substrings(self, classifier, phrases, text):
+        expected = classifier.mask(phrase for phrase in phrases if phrase.lower() in text.lower())
+        self.assertEqual(classifier.classify(text), expected, text)
+
+    def test_overlapping_phrases_and_mixed_case(self):
+        phrases = ["door open", "open", "Door", "people", "people eating", "eating area", "eat", "a", "open door"]
+        classifier = PhraseClassifier(phrases)
+        for text in [
+            "", "nothing", "People Eating Area", "PEOPLE EATING", "door opener", "the door opens",
+            "open door open", "dOoR oPeN door", "EatingArea", "people eating area by the open door",
+        ]:
+            self.assert_matches_substrings(classifier, phrases, text)
+
+    def test_random_texts(self):
+        phrases = ["door open", "open", "door", "people", "people eating", "eating area", "eat", "over capacity"]
+        classifier = PhraseClassifier(phrases)
+        rng = random.Random(8)
+        fragments = phrases + ["peop", "ing", "are", "capa", "ty", "do", "or", " ", " ", "x"]
+        for _ in range(2000):
+            text = "".join(rng.choice(fragments) for _ in range(rng.randint(0, 8)))
+            text = "".join(char.upper() if rng.random() < 0.3 else char for char in text)
+            self.assert_matches_substrings(classifier, phrases, text)
+
+    def test_state_checks_match_substring_checks(self):
+        for state in STATES + [state.upper() for state in STATES] + ["Over Capacity crowd", "PEOPLE EATING in Hall"]:
+            self.assertEqual(is_relevant_state(state), any(phrase in state.lower() for phrase in state_key_phrases), state)
+            self.assertEqual(is_alerting_state(state), any(phrase in state.lower() for phrase in alerting_phrases), state)
+            expected = next((config["penalty"] for config_state, config in facility_config.items() if config_state in state.lower()), 1.0)
+            self.assertEqual(facility_state_weight(state), expected, state)
+
+
+@skipUnless(fakeredis, "fakeredis[lua] is not installed")
+class RedisStateStoreParityTests(SimpleTestCase):
+    """The Lua windows and alert states behave exactly like StateWindow and AlertManager."""
+
+    def store(self, max_age=WINDOW_MAX_AGE, maxlen=WINDOW_MAX_LENGTH):
+        return RedisStateStore(max_age, maxlen, redis_client=fakeredis.FakeRedis())
+
+    def assert_windows_match(self, store, seed, weight, messages, max_age, maxlen):
+        window = StateWindow(weight, max_age, maxlen)
+        rng = random.Random(seed)
+        for index, (timestamp, state) in enumerate(messages):
+            message_id = f"{seed}-{index}"
+            deliveries = 2 if rng.random() < 0.02 else 1  # a message delivered again is only counted once
+            for _ in range(deliveries):
+                window.append(state, timestamp, message_id)
+                mode, = store.append([(f"test-{seed}", state, is_relevant_state(state), weight(state))], timestamp, message_id)
+            self.assertEqual(mode, window.most_frequent(), f"message {index} of seed {seed}")
+
+    def test_small_windows_match_state_window(self):
+        # Short windows are evicted by age and by length many times over
+        max_age, maxlen = timedelta(minutes=2), 25
+        store = self.store(max_age, maxlen)
+        for seed, weight in [(1, facility_state_weight), (2, camera_state_weight("Hall 2")),
+                             (3, camera_state_weight("Axis 7")), (4, camera_state_weight("Front_Driveway 8"))]:
+            self.assert_windows_match(store, seed, weight, random_states(seed, 1000), max_age, maxlen)
+
+    def test_default_windows_match_state_window(self):
+        # Half a second apart, so the window fills up to WINDOW_MAX_LENGTH before states age out
+        messages = random_states(5, 1500, gaps=(0, 0.5, 1))
+        self.assert_windows_match(self.store(), 5, camera_state_weight("Down_Pujari 1"), messages, WINDOW_MAX_AGE, WINDOW_MAX_LENGTH)
+
+    def test_most_frequent_matches_state_window(self):
+        store = self.store()
+        window = StateWindow(facility_state_weight)
+        self.assertEqual(store.most_frequent(["test-empty"]), [None])
+        for timestamp, state in random_states(6, 500):
+            window.append(state, timestamp)
+            store.append([("test-read", state, is_relevant_state(state), facility_state_weight(state))], timestamp)
+        self.assertEqual(store.most_frequent(["test-read"]), [window.most_frequent()])
+
+    def test_alerts_match_alert_manager(self):
+        store = self.store()
+        manager = AlertManager()
+        rng = random.Random(7)
+        names = ["Hall 2", "Axis 7", "Temple 5"]
+        alerting = dict.fromkeys(names, False)
+        now = START.timestamp()
+        transitions = set()
+        for index in range(1500):
+            # Bursts of changes seconds apart flap, long quiet spells end the flapping,
+            # and steps of 300 and 600 seconds hit the default FLAP_INTERVAL exactly
+            now += rng.choice([1, 2, 5, 30, 120, 300, 600, 1800])
+            for name in names:
+                if rng.random() < 0.35:
+                    alerting[name] = not alerting[name]
+            expected = {name: manager.update_state(name, is_alerting, now) for name, is_alerting in alerting.items()}
+            self.assertEqual(store.update_alerts(alerting, now), expected, f"update {index}")
+            transitions.update(expected.values())
+        self.assertEqual(transitions, {None, "ALERT", "RESOLVED", "FLAPPING_START", "FLAPPING_END"})
+
+
+def random_messages(seed, count, cameras=("Hall 2", "Axis 7", "Kitchen 3", "Garage 9")):
+    """
+    (timestamp, facility_state, camera_states) messages as load_state_messages()
+    returns them; each camera is missing from some messages, and "Garage 9" is
+    not in camera_alert_config.
+    """
+    rng = random.Random(seed)
+    timestamp = START
+    facility_state = rng.choice(STATES)
+    camera_states = {camera_id: rng.choice(STATES) for camera_id in cameras}
+    messages = []
+    for _ in range(count):
+        timestamp += timedelta(seconds=rng.choice([0, 0.5, 1, 2, 3, 7, 45]) if rng.random() > 0.003 else rng.uniform(120, 1200))
+        if rng.random() < 0.3:
+            facility_state = rng.choice(STATES)
+        for camera_id in cameras:
+            if rng.random() < 0.3:
+                camera_states[camera_id] = rng.choice(STATES)
+        sent = {camera_id: state for camera_id, state in camera_states.items() if rng.random() > 0.1}
+        messages.append((timestamp, facility_state, sent))
+    return messages
+
+
+class ReplayParityTests(SimpleTestCase):
+    """The vectorized replay gives what StateWindow and AlertManager give message by message."""
+
+    def assert_replays_match(self, messages, camera_config=None):
+        live = replay_live(messages, camera_config)
+        result = replay(messages, camera_config)
+        self.assertEqual(result['facility'], live['facility'])
+        self.assertEqual(set(result['cameras']), set(live['cameras']))
+        for camera_id, camera_result in live['cameras'].items():
+            for key in ('indexes', 'modes', 'alerts'):
+                self.assertEqual(result['cameras'][camera_id][key], camera_result[key], f"{camera_id} {key}")
+        return live
+
+    def test_replay_matches_live_path(self):
+        for seed in (11, 12, 13):
+            live = self.assert_replays_match(random_messages(seed, 4000))
+            self.assertTrue(any(camera_result['alerts'] for camera_result in live['cameras'].values()))
+
+    def test_replay_with_other_penalties_matches_live_path(self):
+        camera_config = default_camera_config()
+        camera_config["Hall 2"]["penalty"] = 1.7
+        camera_config["Axis 7"]["penalty"] = 0.55
+        camera_config["Kitchen 3"]["alert_states"] = {"people eating", "door open"}
+        self.assert_replays_match(random_messages(14, 4000), camera_config)
+
+    def test_empty_replay(self):
+        self.assertEqual(replay([]), {'facility': [], 'cameras': {}})
+        self.assertEqual(replay_live([]), {'facility': [], 'cameras': {}})
+
+    def test_small_windows_match_state_window(self):
+        # Short windows with penalties that tie (2 x 0.5 == 1 x 1.0) exercise eviction and the tie-break
+        max_age, maxlen = timedelta(minutes=2), 25
+        for seed, weight in [(15, facility_state_weight), (16, camera_state_weight("Prabhupada 4")),
+                             (17, lambda state: 0.5 if "bustling" in state else 1.0)]:
+            messages = list(random_states(seed, 5000))
+            window = StateWindow(weight, max_age, maxlen)
+            expected = []
+            for timestamp, state in messages:
+                window.append(state, timestamp)
+                expected.append(window.most_frequent())
+
+            vocabulary = {}
+            codes = encode_states([state for _, state in messages], vocabulary)
+            states = np.array(list(vocabulary), dtype=object)
+            relevant = np.array([is_relevant_state(state) for state in states], dtype=bool)
+            weights = np.array([weight(state) if is_relevant else 1.0 for state, is_relevant in zip(states, relevant)])
+            times = np.array([(timestamp - START) // timedelta(microseconds=1) for timestamp, _ in messages], dtype=np.int64)
+            modes = windowed_modes(times, codes, relevant, weights, max_age, maxlen)
+            self.assertEqual(states[modes].tolist(), expected, f"seed {seed}")
+
+    def test_alert_transitions_match_alert_manager(self):
+        rng = random.Random(18)
+        times, alerting = [], []
+        now = START.timestamp()
+        is_alerting = False
+        for _ in range(5000):
+            now += rng.choice([1, 2, 5, 30, 120, 300, 600, 1800])
+            if rng.random() < 0.35:
+                is_alerting = not is_alerting
+            times.append(now)
+            alerting.append(is_alerting)
+        for flap_threshold, flap_interval in [(3, 600), (2, 30), (5, 1800), (1, 600)]:
+            manager = AlertManager()
+            manager.states["camera"] = AlertState("camera", flap_threshold, flap_interval)
+            expected = [(index, transition) for index, transition in
+                        ((index, manager.update_state("camera", flag, at)) for index, (at, flag) in enumerate(zip(times, alerting)))
+                        if transition]
+            changed, transitions = alert_transitions(np.array(times), alerting, flap_threshold, flap_interval)
+            self.assertEqual(list(zip(changed.tolist(), transitions.tolist())), expected,
+                             f"flap_threshold={flap_threshold}, flap_interval={flap_interval}")
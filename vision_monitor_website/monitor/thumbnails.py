@@ -0,0 +1,326 @@
+# monitor/thumbnails.py
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image
+
+from .config import (
+    THUMBNAIL_WIDTHS,
+    THUMBNAIL_DEFAULT_QUALITY,
+    THUMBNAIL_WORKERS,
+    THUMBNAIL_CACHE_DIR,
+    THUMBNAIL_CACHE_MAX_BYTES,
+    IMAGE_NEGOTIATED_FORMATS,
+    IMAGE_TRANSCODE_QUALITY,
+    AVIF_ENCODE_SPEED,
+)
+
+try:
+    import pillow_avif  # noqa: F401  AVIF encoder for Pillow releases without a built-in one
+except ImportError:
+    pass
+
+logger = logging.getLogger(__name__)
+
+# Resized and transcoded variants of stored frames (?w=<width>&q=<quality> on the
+# image endpoints, and WebP/AVIF for clients whose Accept header asks for them).
+# A frame never changes, so a variant is keyed by frame id, width, quality and
+# format, generated once by a small worker pool, and kept in a size-bounded
+# directory shared by all server processes.
+
+MIN_QUALITY = 20
+MAX_QUALITY = 95
+
+# format -> (Pillow format, content type, file extension)
+IMAGE_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg', 'jpg'),
+    'webp': ('WEBP', 'image/webp', 'webp'),
+    'avif': ('AVIF', 'image/avif', 'avif'),
+}
+
+Image.init()
+# Formats offered to clients, in order of preference; those this Pillow build
+# cannot encode are left out.
+NEGOTIATED_FORMATS = tuple(
+    image_format for image_format in IMAGE_NEGOTIATED_FORMATS
+    if image_format in IMAGE_FORMATS and image_format != 'jpeg' and IMAGE_FORMATS[image_format][0] in Image.SAVE
+)
+
+
+class Variant:
+    __slots__ = ('width', 'quality', 'image_format')
+
+    def __init__(self, width, quality, image_format='jpeg'):
+        self.width = width  # None keeps the original size
+        self.quality = quality
+        self.image_format = image_format
+
+    @property
+    def tag(self):
+        tag = f"w{self.width}q{self.quality}" if self.width else f"q{self.quality}"
+        return tag if self.image_format == 'jpeg' else f"{tag}-{self.image_format}"
+
+    @property
+    def content_type(self):
+        return IMAGE_FORMATS[self.image_format][1]
+
+    @property
+    def extension(self):
+        return IMAGE_FORMATS[self.image_format][2]
+
+
+def negotiate_format(accept, offered=NEGOTIATED_FORMATS):
+    """
+    First of `offered` whose content type the Accept header names with q > 0,
+    or 'jpeg'. Wildcards such as image/* are not enough: clients sending only
+    those cannot be assumed to decode WebP or AVIF.
+    """
+    accepted = set()
+    for item in (accept or '').split(','):
+        media_type, *params = item.split(';')
+        quality = 1.0
+        for param in params:
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(media_type.strip().lower())
+    return next((image_format for image_format in offered if IMAGE_FORMATS[image_format][1] in accepted), 'jpeg')
+
+
+def parse_variant(params, accept=''):
+    """
+    Variant requested by ?w= and ?q= in the format negotiated from `accept`, or
+    None for the original image. The width is rounded up to the nearest of
+    THUMBNAIL_WIDTHS (so arbitrary widths cannot fill the cache) and the quality
+    clamped to 20-95. Without ?w= and ?q=, a client accepting WebP or AVIF gets
+    the original size transcoded at IMAGE_TRANSCODE_QUALITY. Raises ValueError
+    for bad input.
+    """
+    image_format = negotiate_format(accept)
+    width = params.get('w')
+    quality = params.get('q')
+    if not width and not quality:
+        return None if image_format == 'jpeg' else Variant(None, IMAGE_TRANSCODE_QUALITY, image_format)
+    width = int(width) if width else max(THUMBNAIL_WIDTHS)
+    quality = int(quality) if quality else THUMBNAIL_DEFAULT_QUALITY
+    if width <= 0:
+        raise ValueError(f"Invalid width: {width}")
+    width = next((allowed for allowed in THUMBNAIL_WIDTHS if allowed >= width), max(THUMBNAIL_WIDTHS))
+    quality = min(MAX_QUALITY, max(MIN_QUALITY, quality))
+    return Variant(width, quality, image_format)
+
+
+def encode_variant(data, width, quality, image_format='jpeg'):
+    """
+    `data` (JPEG or PNG) encoded as `image_format`, scaled down to `width` pixels
+    wide (never up, and not at all for None) keeping the aspect ratio.
+    """
+    with Image.open(BytesIO(data)) as image:
+        if width:
+            # Let the JPEG decoder downscale by up to 8x while decoding, which is far cheaper
+            # than decoding the full frame and resizing it afterwards.
+            image.draft('RGB', (width, image.height * width // max(image.width, 1)))
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        if width and image.width > width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        output = BytesIO()
+        if image_format == 'jpeg':
+            image.save(output, format='JPEG', quality=quality, optimize=True)
+        elif image_format == 'webp':
+            image.save(output, format='WEBP', quality=quality, method=4)
+        else:
+            image.save(output, format=IMAGE_FORMATS[image_format][0], quality=quality, speed=AVIF_ENCODE_SPEED)
+        return output.getvalue()
+
+
+class DerivedImageCache:
+    """
+    Directory of derived images bounded to `max_bytes`, evicting the least
+    recently used files (by mtime, which reads refresh) once it grows past the
+    bound. Safe to share between processes: files are written atomically and
+    each process re-scans the directory when it evicts.
+    """
+
+    def __init__(self, directory=THUMBNAIL_CACHE_DIR, max_bytes=THUMBNAIL_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None  # estimate of the directory size, rebuilt on eviction
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+    def _path(self, key):
+        # Keys end in the file extension, e.g. 123_w240q70.jpg
+        return os.path.join(self.directory, key)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            self._count('misses')
+            return None
+        except OSError as e:
+            logger.error(f"Error reading derived image {path}: {e}")
+            self._count('misses')
+            return None
+        self._count('hits')
+        return data
+
+    def set(self, key, data):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, self._path(key))
+            except BaseException:
+                # evict() skips .tmp files, so nothing else would remove it
+                try:
+                    os.remove(tmp_path)
+                except FileNotFoundError:
+                    pass
+                raise
+        except OSError as e:
+            logger.error(f"Error storing derived image {key}: {e}")
+            return
+        self._count('stores')
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data)
+            needs_eviction = self._size is None or self._size > self.max_bytes
+        if needs_eviction:
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used files until the directory is below 90% of max_bytes."""
+        entries = []
+        total = 0
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith('.tmp'):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        except FileNotFoundError:
+            pass
+
+        evicted = 0
+        if total > self.max_bytes:
+            target = self.max_bytes * 0.9
+            entries.sort()
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                evicted += 1
+        with self._lock:
+            self._size = total
+            self._stats['evictions'] += evicted
+        return evicted
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['bytes'] = self._size
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        stats['max_bytes'] = self.max_bytes
+        return stats
+
+
+class ThumbnailService:
+    """Serves variants from the DerivedImageCache, generating missing ones in a worker pool."""
+
+    def __init__(self, cache=None, workers=THUMBNAIL_WORKERS):
+        self.cache = cache or DerivedImageCache()
+        # Pillow releases the GIL while decoding, resizing and encoding, so threads
+        # resize in parallel without copying frames to other processes.
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnail')
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._generated = 0
+        self._failures = 0
+
+    def get(self, data_id, variant, load_original):
+        """
+        Variant of frame `data_id`; `load_original()` is only called when it has to be
+        generated. Concurrent requests for the same missing variant share one resize.
+        Returns None if the original is missing or cannot be decoded.
+        """
+        key = f"{data_id}_{variant.tag}.{variant.extension}"
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self.pool.submit(self._generate, key, variant, load_original)
+                self._in_flight[key] = future
+        try:
+            return future.result()
+        finally:
+            if owner:
+                with self._lock:
+                    self._in_flight.pop(key, None)
+
+    def _generate(self, key, variant, load_original):
+        original = load_original()
+        if not original:
+            return None
+        try:
+            data = encode_variant(bytes(original), variant.width, variant.quality, variant.image_format)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            logger.error(f"Error resizing frame for {key}: {e}")
+            with self._lock:
+                self._failures += 1
+            return None
+        self.cache.set(key, data)
+        with self._lock:
+            self._generated += 1
+        return data
+
+    def stats(self):
+        stats = self.cache.stats()
+        with self._lock:
+            stats.update({'generated': self._generated, 'failures': self._failures, 'in_flight': len(self._in_flight)})
+        return stats
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_thumbnail_service():
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = ThumbnailService()
+    return _service
@@ -5,7 +5,7 @@ from django.conf import settings
 import os
 
 from . import views
-from .image_handling import get_latest_image, get_composite_image, get_frame_image
+from .image_handling import get_latest_image, get_composite_image, get_frame_image, get_mosaic
 from .notifications import test_notification
 
 def serve_favicon(request):
@@ -21,7 +21,9 @@ urlpatterns = [
     path('get_latest_image/<int:camera_index>/', get_latest_image, name='get_latest_image'),
     path('get_frame_image/<int:data_id>/', get_frame_image, name='get_frame_image'),
     path('get_composite_image/<str:camera_name>/', get_composite_image, name='get_composite_image'),
+    path('mosaic/', get_mosaic, name='mosaic'),
     path('update_state/', views.update_state, name='update_state'),
+    path('state/', views.get_state, name='state'),
     path('webhook/no-show/', views.no_show_webhook, name='no_show_webhook'),
     path('timeline/', views.timeline_view, name='timeline'),
     path('get_timeline_events/<str:camera_id>/', views.get_timeline_events, name='get_timeline_events'),
@@ -29,5 +31,7 @@ urlpatterns = [
     path('get_timeline_events_paginated/', views.get_timeline_events_paginated, name='get_timeline_events_paginated'),
     path('get_timeline_events_by_date/', views.get_timeline_events_by_date, name='get_timeline_events_by_date'),
     path('get_timeline_events_by_date_paginated/', views.get_timeline_events_by_date_paginated, name='get_timeline_events_by_date_paginated'),
+    path('export_timeline_events/', views.export_timeline_events, name='export_timeline_events'),
+    path('metrics/db/', views.db_metrics, name='db_metrics'),
 ]
     
\ No newline at end of file
@@ -1,24 +1,34 @@
 import logging
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
 from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from asgiref.sync import async_to_sync, sync_to_async
+import csv
+import io
 import json
 from datetime import timedelta
 
-from .db_operations import fetch_latest_facility_state, fetch_latest_frame_analyses, fetch_recent_llm_outputs, insert_facility_status, fetch_timeline_events, fetch_timeline_events_paginated
-from .state_management import parse_facility_state
-from .image_handling import get_composite_images
+from .db_operations import fetch_latest_facility_state, fetch_latest_frame_analyses, fetch_recent_llm_outputs, insert_facility_status, fetch_timeline_events, fetch_timeline_events_paginated, fetch_timeline_events_page, iter_timeline_events
+from .state_management import ingest_state_message, get_state_snapshot, message_states, state_classifier, state_message_id
+from .image_handling import get_composite_urls
 from .notifications import notify, test_notification
 import base64
 from django.views.decorators.csrf import csrf_exempt
-from django.http import HttpResponse
-from .db_operations import get_latest_frame
+from django.http import HttpResponse, HttpResponseNotModified, HttpResponseForbidden
+from django.utils.cache import quote_etag
+from django.utils.http import parse_etags
 from .redis_operations import connect_redis
-from .config import ALERT_QUEUE
+from .config import ALERT_QUEUE, DB_METRICS_ALLOWED_IPS
+from .instrumentation import query_metrics, render_prometheus
+from .db_pool import get_pool_stats
+from .db_operations import camera_state_cache
+from .frame_cache import get_latest_frame_cache
+from .thumbnails import get_thumbnail_service
+from .mosaic import get_mosaic_service
 
 logger = logging.getLogger(__name__)
 timezone.activate(timezone.get_current_timezone())
@@ -27,21 +37,27 @@ def home(request):
     return render(request, 'monitor/home.html')
 
 def monitor(request):
-    raw_message = fetch_latest_facility_state()
-    if raw_message:
-        facility_state, camera_states, alerts = parse_facility_state(raw_message[0])
-        timestamp = raw_message[1]
+    snapshot = get_state_snapshot()
+    if snapshot is not None:
+        facility_state, camera_states = snapshot.facility_state, snapshot.camera_states
     else:
-        facility_state, camera_states = None, {}
+        # Nothing ingested since the state store was emptied: show the latest message as sent
+        raw_message = fetch_latest_facility_state()
+        try:
+            facility_state, camera_states = message_states(raw_message[0]) if raw_message else (None, {})
+        except ValueError:
+            facility_state, camera_states = None, {}
 
     latest_frame_analyses = fetch_latest_frame_analyses()
     llm_outputs = fetch_recent_llm_outputs()
 
-    composite_images = get_composite_images(latest_frame_analyses)
+    # The page references composites by URL; the images themselves load separately
+    composite_urls = get_composite_urls([analysis[0] for analysis in latest_frame_analyses])
 
     initial_data = {
         'facility_state': facility_state,
         'camera_states': camera_states,
+        'state_version': snapshot.version if snapshot is not None else None,
         'camera_feeds': [
             {
                 'cameraId': analysis[0],
@@ -49,7 +65,7 @@ def monitor(request):
                 'timestamp': analysis[2].isoformat(),
                 'description': analysis[3],
                 'cameraName': analysis[4],
-                'compositeImage': composite_images.get(analysis[0], '')
+                'compositeImage': composite_urls.get(analysis[0], '')
             } for analysis in latest_frame_analyses
         ],
         'llm_outputs': [
@@ -65,7 +81,6 @@ def monitor(request):
 
     return render(request, 'monitor/monitor.html', {
         'initial_data': initial_data,
-        'composite_images': composite_images
     })
 
 def timeline_view(request):
@@ -80,7 +95,7 @@ def timeline_view(request):
             {
                 'id': analysis[0],
                 'name': analysis[4],
-                'image': f'/get_latest_image/{analysis[1]}' if get_latest_frame(analysis[0]) else '',
+                'image': f'/get_latest_image/{analysis[1]}/?w=240' if get_latest_frame_cache().peek(analysis[1]) else '',
                 'index': analysis[1],
             } for analysis in latest_analyses
         ],
@@ -115,12 +130,12 @@ def update_state(request):
         current_time = timezone.now()
         
         if insert_facility_status(raw_message, current_time):
-            facility_state, camera_states, alerts = parse_facility_state(raw_message)
+            snapshot = ingest_state_message(raw_message, state_message_id(current_time))
             
             # Handle alerts
-            for camera_id, alert_type, state in alerts:
+            for camera_id, alert_type, state in (snapshot.alerts if snapshot else ()):
                 if alert_type == "ALERT":
-                    notify(request, raw_message, camera_id)
+                    notify(request, snapshot, camera_id)
                 send_websocket_update(json.dumps({
                     "type": "alert",
                     "camera_id": camera_id,
@@ -134,6 +149,25 @@ def update_state(request):
         logger.error(f"Error in update_state: {str(e)}")
         return JsonResponse({"status": "error", "message": str(e)}, status=500)
 
+@require_http_methods(["GET"])
+def get_state(request):
+    """
+    The latest state snapshot (see StateSnapshot) as JSON. Its ETag is the
+    snapshot's version, so a client polling with If-None-Match gets a 304
+    until the next state message is ingested.
+    """
+    snapshot = get_state_snapshot()
+    if snapshot is None:
+        return JsonResponse({"error": "No state available"}, status=404)
+    etag = quote_etag(snapshot.etag)
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = JsonResponse(snapshot.to_dict())
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
 @require_http_methods(["GET"])
 def test_notification_view(request):
     return test_notification(request)
@@ -185,11 +219,15 @@ def no_show_webhook(request):
         logger.error(f"Error processing webhook: {str(e)}")
         return JsonResponse({"error": f"Error processing webhook: {str(e)}"}, status=500)
     
+def collapse_duplicates_requested(request):
+    """?collapse_duplicates=1 folds runs of a camera's identical frames into one event with a count."""
+    return request.GET.get('collapse_duplicates', '').lower() in ('1', 'true')
+
 @require_http_methods(["GET"])
 def get_timeline_events(request, camera_id):
     start_time = timezone.now() - timedelta(hours=1)
     end_time = timezone.now()
-    events = fetch_timeline_events(start_time, end_time, camera_id)
+    events = fetch_timeline_events(start_time, end_time, camera_id, collapse_duplicates=collapse_duplicates_requested(request))
     return JsonResponse({"events": events})
 
 @require_http_methods(["GET"])
@@ -197,18 +235,37 @@ def get_latest_frame_analyses(request):
     latest_analyses = fetch_latest_frame_analyses()
     return JsonResponse({"latest_analyses": latest_analyses})
 
+def timeline_page_response(request, limit, start_time=None, end_time=None, camera_id=None):
+    cursor = request.GET.get('cursor')
+    collapse_duplicates = collapse_duplicates_requested(request)
+    if not cursor and 'offset' in request.GET:
+        # Compatibility path for clients still paging by offset
+        offset = int(request.GET.get('offset', 0))
+        events = fetch_timeline_events_paginated(offset=offset, limit=limit, start_time=start_time, end_time=end_time, camera_id=camera_id,
+                                                 collapse_duplicates=collapse_duplicates)
+        return JsonResponse({"events": events})
+
+    try:
+        events, next_cursor = fetch_timeline_events_page(limit=limit, cursor=cursor, start_time=start_time, end_time=end_time, camera_id=camera_id,
+                                                         collapse_duplicates=collapse_duplicates)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse({"events": events, "next_cursor": next_cursor})
+
 @require_http_methods(["GET"])
 def get_timeline_events_paginated(request):
     """
-    Returns a chunk of timeline events based on offset & limit
+    Returns a chunk of timeline events, newest first:
+      ?limit=20&cursor=<next_cursor from the previous page>
+    The response carries `next_cursor` (null on the last page). Passing
+    ?offset= without a cursor uses the old OFFSET pagination.
+    &collapse_duplicates=1 folds runs of identical frames into one event
+    carrying `count` and `first_timestamp`.
     """
     try:
         camera_id = request.GET.get('camera_id')  # optional
-        offset = int(request.GET.get('offset', 0))
         limit = int(request.GET.get('limit', 20))
-
-        events = fetch_timeline_events_paginated(offset=offset, limit=limit, camera_id=camera_id)
-        return JsonResponse({"events": events})
+        return timeline_page_response(request, limit, camera_id=camera_id)
     except Exception as e:
         logger.error(f"Error in get_timeline_events_paginated: {str(e)}")
         return JsonResponse({"error": str(e)}, status=500)
@@ -219,6 +276,7 @@ def get_timeline_events_by_date(request):
     Fetch timeline events for a given date/time range in query params:
       ?start_time=YYYY-MM-DDTHH:MM:SSZ
       ?end_time=YYYY-MM-DDTHH:MM:SSZ
+      &collapse_duplicates=1 (optional)
     """
     try:
         start_time_str = request.GET.get('start_time')
@@ -232,7 +290,8 @@ def get_timeline_events_by_date(request):
         start_time = parser.parse(start_time_str)
         end_time = parser.parse(end_time_str)
 
-        events = fetch_timeline_events(start_time, end_time, camera_id=camera_id)
+        events = fetch_timeline_events(start_time, end_time, camera_id=camera_id,
+                                       collapse_duplicates=collapse_duplicates_requested(request))
         return JsonResponse({"events": events})
     except Exception as e:
         logger.error(f"Error in get_timeline_events_by_date: {str(e)}")
@@ -244,13 +303,14 @@ def get_timeline_events_by_date_paginated(request):
     Fetch timeline events for a given date/time range with pagination:
       ?start_time=YYYY-MM-DDTHH:MM:SSZ
       ?end_time=YYYY-MM-DDTHH:MM:SSZ
-      &offset=0
       &limit=20
+      &cursor=<next_cursor from the previous page>
+    As above, ?offset= without a cursor falls back to OFFSET pagination, and
+    &collapse_duplicates=1 folds runs of identical frames.
     """
     try:
         start_time_str = request.GET.get('start_time')
         end_time_str = request.GET.get('end_time')
-        offset = int(request.GET.get('offset', 0))
         limit = int(request.GET.get('limit', 20))
         camera_id = request.GET.get('camera_id', None)  # optional
 
@@ -261,8 +321,121 @@ def get_timeline_events_by_date_paginated(request):
         start_time = parser.parse(start_time_str)
         end_time = parser.parse(end_time_str)
 
-        events = fetch_timeline_events_paginated(offset=offset, limit=limit, start_time=start_time, end_time=end_time, camera_id=camera_id)
-        return JsonResponse({"events": events})
+        return timeline_page_response(request, limit, start_time=start_time, end_time=end_time, camera_id=camera_id)
     except Exception as e:
         logger.error(f"Error in get_timeline_events_by_date_paginated: {str(e)}")
         return JsonResponse({"error": str(e)}, status=500)
+
+EXPORT_FIELDS = ['camera_id', 'camera_name', 'timestamp', 'data_id', 'description', 'state']
+
+def render_timeline_export(batches, export_format):
+    """Turn batches of timeline events into NDJSON or CSV text chunks, one chunk per batch."""
+    try:
+        if export_format == 'csv':
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            for batch in batches:
+                writer.writerows(batch)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+        else:
+            for batch in batches:
+                yield ''.join(json.dumps({field: event[field] for field in EXPORT_FIELDS}) + '\n' for event in batch)
+    except Exception as e:
+        # Headers are already sent, so all we can do is stop the stream early
+        logger.error(f"Error while streaming timeline export: {str(e)}")
+    finally:
+        batches.close()
+
+async def iterate_in_thread(chunks):
+    """
+    Serve a blocking generator to ASGI without buffering it: under ASGI, Django 4.2
+    reads synchronous streaming content into a list before sending it. Every step
+    runs in the same worker thread, which keeps the pooled psycopg2 connection on
+    one thread.
+    """
+    step = sync_to_async(next, thread_sensitive=True)
+    try:
+        while True:
+            chunk = await step(chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close, thread_sensitive=True)()
+
+@require_http_methods(["GET"])
+def export_timeline_events(request):
+    """
+    Stream every timeline event in a date range, oldest first:
+      ?start_time=YYYY-MM-DDTHH:MM:SSZ
+      &end_time=YYYY-MM-DDTHH:MM:SSZ
+      &camera_id=<optional>
+      &format=ndjson (default) | csv
+    """
+    start_time_str = request.GET.get('start_time')
+    end_time_str = request.GET.get('end_time')
+    camera_id = request.GET.get('camera_id', None)  # optional
+    export_format = request.GET.get('format', 'ndjson')
+
+    if not start_time_str or not end_time_str:
+        return JsonResponse({"error": "Missing start_time or end_time"}, status=400)
+    if export_format not in ('ndjson', 'csv'):
+        return JsonResponse({"error": "format must be ndjson or csv"}, status=400)
+
+    from dateutil import parser
+    try:
+        start_time = parser.parse(start_time_str)
+        end_time = parser.parse(end_time_str)
+    except (ValueError, OverflowError) as e:
+        return JsonResponse({"error": f"Invalid date range: {str(e)}"}, status=400)
+
+    chunks = render_timeline_export(iter_timeline_events(start_time, end_time, camera_id=camera_id), export_format)
+    if isinstance(request, ASGIRequest):
+        chunks = iterate_in_thread(chunks)
+
+    content_type = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(chunks, content_type=f'{content_type}; charset=utf-8')
+    filename = f"timeline_{start_time:%Y%m%dT%H%M%S}_{end_time:%Y%m%dT%H%M%S}.{export_format}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    # Tell nginx not to buffer the whole export before passing it on
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+LOOPBACK_ADDRESSES = ('127.0.0.1', '::1')
+
+def metrics_client_address(request):
+    # Behind nginx the peer is the proxy on loopback; nginx overwrites X-Real-IP with the client's address
+    address = request.META.get('REMOTE_ADDR')
+    if address in LOOPBACK_ADDRESSES:
+        return request.headers.get('X-Real-IP', address)
+    return address
+
+@require_http_methods(["GET"])
+def db_metrics(request):
+    """
+    Data-access metrics of this server process: per-function latency histograms,
+    rows and payload bytes, recent slow queries, connection pool and cache stats.
+    Only for staff users and clients in DB_METRICS_ALLOWED_IPS (by default this
+    host, for `manage.py dbstats`), as slow queries show the SQL the app runs.
+      ?format=json (default) | prometheus
+    """
+    if not (request.user.is_staff or metrics_client_address(request) in DB_METRICS_ALLOWED_IPS):
+        return HttpResponseForbidden("Staff login or an allowed address required")
+    snapshot = query_metrics.snapshot()
+    pool_stats = get_pool_stats()
+    cache_stats = {
+        'latest_frame': get_latest_frame_cache().stats(),
+        'camera_state': camera_state_cache.stats(),
+        'thumbnails': get_thumbnail_service().stats(),
+        'mosaic': get_mosaic_service().stats(),
+        'state_phrases': state_classifier.stats(),
+    }
+    if request.GET.get('format') == 'prometheus':
+        return HttpResponse(render_prometheus(snapshot, pool_stats, cache_stats), content_type='text/plain; version=0.0.4; charset=utf-8')
+    snapshot['pool'] = pool_stats
+    snapshot['caches'] = cache_stats
+    return JsonResponse(snapshot)
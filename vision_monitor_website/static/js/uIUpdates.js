@@ -8,13 +8,17 @@ const facilityState = document.getElementById('facility-state');
 const overall = document.getElementById('overall');
 
 // ====== GLOBAL PAGINATION STATE ======
-let offset = 0;
+// Pages are fetched by keyset cursor: each response carries `next_cursor`
+// (null on the last page), and every event carries its own `cursor`.
+let nextCursor = null;
+let hasMore = true;
 let limit = 20;
 let isLoading = false;
 let currentCameraId = null;  // Track currently selected camera
 
 // Timeline pagination and date-range tracking
-let timelineOffset = 0;
+let timelineCursor = null;
+let timelineHasMore = true;
 const timelineLimit = 20;
 let timelineIsLoading = false;
 let selectedStartTime = null; // Store selected start time
@@ -129,7 +133,8 @@ export function updateSingleCamera(camera) {
             : camera.description;
 
         if (imageElement) {
-            imageElement.src = getLatestImageUrl(camera.cameraIndex);
+            // A new analysis means a new frame; its timestamp makes the URL unique to that frame
+            imageElement.src = getLatestImageUrl(camera.cameraIndex, camera.timestamp);
         } else {
             logger.warn(`Image element not found for camera ${camera.cameraIndex}`);
         }
@@ -266,7 +271,9 @@ export function appendToTimeline(events) {
         const timelineRow = document.createElement('div');
         timelineRow.className = 'timeline-row';
         const time = formatTimestamp(event.timestamp);
-        const imageUrl = `/get_frame_image/${event.data_id}`;
+        const imageUrl = `/get_frame_image/${event.data_id}/`;
+        // Small variant for the list; the full frame is only loaded when the event is clicked
+        const thumbnailUrl = `${imageUrl}?w=120`;
         timelineRow.innerHTML = `
             <div class="time-marker">${time}</div>
             <div class="middle-strip">
@@ -284,7 +291,7 @@ export function appendToTimeline(events) {
             <img
                 class="event-thumbnail" 
                 style="height: 60px; width: 60px;"
-                src="${imageUrl}"
+                src="${thumbnailUrl}"
                 alt="Event"
             >
         `;
@@ -320,12 +327,22 @@ function setupInfiniteScroll() {
     });
 }
 
-// Load more timeline events (paginates by offset/limit)
+function lastEventCursor(events) {
+    return events && events.length > 0 ? events[events.length - 1].cursor : null;
+}
+
+// Load more timeline events (paginates by keyset cursor)
 function loadMoreTimeline() {
+    if (!hasMore) {
+        isLoading = false;
+        return;
+    }
     const params = new URLSearchParams({
-        offset: offset,
         limit: limit
     });
+    if (nextCursor) {
+        params.append('cursor', nextCursor);
+    }
     
     // Add camera_id to query params if we have one selected
     if (currentCameraId) {
@@ -343,7 +360,8 @@ function loadMoreTimeline() {
         })
         .then((data) => {
             appendToTimeline(data.events);
-            offset += limit;
+            nextCursor = data.next_cursor;
+            hasMore = !!data.next_cursor;
             isLoading = false;
         })
         .catch((err) => {
@@ -355,8 +373,9 @@ function loadMoreTimeline() {
 export function updateTimelinePage(data) {
     console.log('Updating timeline page with data:', data);
 
-    // Reset the timeline container and offset on each update
-    offset = 0;
+    // Reset the timeline container and cursor on each update
+    nextCursor = null;
+    hasMore = true;
     isLoading = false;
     const timelineContainer = document.getElementById('timelineContainer');
     if (timelineContainer) {
@@ -395,7 +414,7 @@ export function updateTimelinePage(data) {
         // Append initial chunk of events
         if (data.events) {
             appendToTimeline(data.events);
-            offset += data.events.length; // Keep track of how many loaded
+            nextCursor = lastEventCursor(data.events); // Continue after the last loaded event
         }
 
         // Re-initialize scroll listener after setting initial content
@@ -442,7 +461,8 @@ export function selectCamera(cameraIndex, cameraId) {
     mainCameraImage.src = imageUrl;
 
     // Reset pagination when selecting a new camera
-    offset = 0;
+    nextCursor = null;
+    hasMore = true;
     isLoading = false;
 
     // Fetch both timeline events and latest frame analyses
@@ -466,7 +486,7 @@ export function selectCamera(cameraIndex, cameraId) {
                 cameras: analysesData.latest_analyses.map(analysis => ({
                     id: analysis[0],
                     name: analysis[4],
-                    image: `/get_latest_image/${analysis[1]}`,
+                    image: `/get_latest_image/${analysis[1]}/?w=240`,
                     index: analysis[1]
                 })),
                 events: timelineData.events
@@ -542,6 +562,10 @@ export function loadMoreTimelineEvents(getAppendFn, cameraId = null) {
         logger.debug('Timeline is already loading, skipping request');
         return;
     }
+    if (!timelineHasMore) {
+        logger.debug('Reached the end of the timeline, skipping request');
+        return;
+    }
     timelineIsLoading = true;
 
     let url = '';
@@ -551,7 +575,7 @@ export function loadMoreTimelineEvents(getAppendFn, cameraId = null) {
     if (cameraId) {
         // If the user selected a camera, direct requests to the camera-specific endpoints
         if (selectedStartTime && selectedEndTime) {
-            url = '/get_timeline_events_by_date';
+            url = '/get_timeline_events_by_date_paginated';
             params.append('start_time', selectedStartTime);
             params.append('end_time', selectedEndTime);
             logger.debug(`Loading camera ${cameraId} timeline (by date) startTime=${selectedStartTime}, endTime=${selectedEndTime}`);
@@ -578,7 +602,9 @@ export function loadMoreTimelineEvents(getAppendFn, cameraId = null) {
         }
     }
 
-    params.append('offset', timelineOffset);
+    if (timelineCursor) {
+        params.append('cursor', timelineCursor);
+    }
     params.append('limit', timelineLimit);
 
     const fullUrl = `${url}?${params.toString()}`;
@@ -598,11 +624,12 @@ export function loadMoreTimelineEvents(getAppendFn, cameraId = null) {
                 const appendFn = getAppendFn();
                 logger.debug('Appending events to timeline, appendFn exists:', !!appendFn);
                 appendFn(data.events);
-                timelineOffset += data.events.length;
-                logger.debug('Updated timeline offset to:', timelineOffset);
             } else {
                 logger.debug('No events received from API');
             }
+            timelineCursor = data.next_cursor || null;
+            timelineHasMore = !!data.next_cursor;
+            logger.debug('Updated timeline cursor to:', timelineCursor);
             timelineIsLoading = false;
         })
         .catch(err => {
@@ -621,9 +648,19 @@ export function loadMoreTimelineEvents(getAppendFn, cameraId = null) {
 export function setTimelineDateRangeAndReset(startTimeISO, endTimeISO) {
     selectedStartTime = startTimeISO;
     selectedEndTime = endTimeISO;
-    timelineOffset = 0;
+    timelineCursor = null;
+    timelineHasMore = true;
     timelineIsLoading = false;
 }
+
+/**
+ * Continue infinite scroll after events that are already on the page
+ * (e.g. the initial events rendered by the server).
+ */
+export function setTimelineCursorAfter(events) {
+    timelineCursor = lastEventCursor(events);
+    timelineHasMore = true;
+}
  // Function to update the date button based on the first event in the timeline
 export function updateDateButton() {
     const timelineGrid = document.getElementById('timelineContainer');
@@ -1,9 +1,11 @@
-export function getLatestImageUrl(cameraIndex) {
-    return `/get_latest_image/${cameraIndex}/?t=${new Date().getTime()}`;
+export function getLatestImageUrl(cameraIndex, version = new Date().getTime()) {
+    return `/get_latest_image/${cameraIndex}/?t=${encodeURIComponent(version)}`;
 }
 
+// Composites carry content-hash ETags and are revalidated by the browser, so the
+// URL stays the same and an unchanged composite is never downloaded again.
 export function getCompositeImageUrl(cameraName) {
-    return `/get_composite_image/${cameraName}/?t=${new Date().getTime()}`;
+    return `/get_composite_image/${cameraName}/`;
 }
 
 export function colorCodeState(element, state) {
@@ -42,8 +44,43 @@ export function typeWriter(element, text, speed) {
 export function refreshImages() {
     const allImages = document.querySelectorAll('#camera-feeds img, #camera-states img');
     allImages.forEach(img => {
-        const currentSrc = new URL(img.src);
+        const currentSrc = new URL(img.dataset.imagePath || img.src, window.location.href);
+        currentSrc.searchParams.delete('t');
+        if (currentSrc.pathname.startsWith('/get_latest_image/') || currentSrc.pathname.startsWith('/get_composite_image/')) {
+            revalidateImage(img, currentSrc.pathname + currentSrc.search);
+            return;
+        }
         currentSrc.searchParams.set('t', new Date().getTime());
         img.src = currentSrc.toString();
     });
+}
+
+// fetch() sends Accept: */*, which gets JPEG; ask for WebP like <img> requests do
+// when this browser can decode it (a canvas that encodes WebP also decodes it).
+const IMAGE_ACCEPT = document.createElement('canvas').toDataURL('image/webp').startsWith('data:image/webp')
+    ? 'image/webp,image/*;q=0.8'
+    : 'image/*';
+
+// Latest and composite images are revalidated against their ETag instead of being
+// re-downloaded: an unchanged image costs a 304, and it is only swapped when it changed.
+async function revalidateImage(img, path) {
+    try {
+        const response = await fetch(path, { cache: 'no-cache', headers: { Accept: IMAGE_ACCEPT } });
+        if (!response.ok) {
+            return;
+        }
+        const etag = response.headers.get('ETag');
+        if (etag && etag === img.dataset.etag) {
+            return;
+        }
+        const objectUrl = URL.createObjectURL(await response.blob());
+        if (img.src.startsWith('blob:')) {
+            URL.revokeObjectURL(img.src);
+        }
+        img.dataset.imagePath = path;
+        img.dataset.etag = etag || '';
+        img.src = objectUrl;
+    } catch (error) {
+        console.error('Error refreshing image:', error);
+    }
 }
\ No newline at end of file